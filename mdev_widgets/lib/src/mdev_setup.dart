@@ -10,17 +10,20 @@ class MdevSetup {
 
   MdevSetup._(this.provider, this._socket);
 
-  static Future<MdevSetup> init({String? serverUrl}) async {
+  /// [session] keeps this app's widgets apart from other app instances
+  /// connected to the same server (e.g. 'ios', 'android', 'web').
+  static Future<MdevSetup> init({String? serverUrl, String? session}) async {
     final provider = WidgetConfigProvider();
     await provider.init();
 
     final socket = serverUrl != null
-        ? ConfigSocket(provider, url: serverUrl)
-        : ConfigSocket(provider);
+        ? ConfigSocket(provider, url: serverUrl, session: session)
+        : ConfigSocket(provider, session: session);
 
     provider.onRegister = socket.register;
     provider.onUnregister = socket.unregister;
     provider.onStyleChange = socket.sendStyles;
+    provider.onStyleTokenChange = socket.sendStyleToken;
 
     return MdevSetup._(provider, socket);
   }
@@ -139,6 +139,36 @@ class StyleRegistry {
     'custom': _custom,
   };
 
+  /// Set or (with a null value) remove one token of a category.
+  void updateToken(String category, String name, dynamic value) {
+    switch (category) {
+      case 'colors':
+        if (value is Map) {
+          _colors[name] = ThemedColor.fromJson(Map<String, dynamic>.from(value));
+        } else {
+          _colors.remove(name);
+        }
+      case 'sizes':
+        if (value is num) {
+          _sizes[name] = value.toDouble();
+        } else {
+          _sizes.remove(name);
+        }
+      case 'textStyles':
+        if (value is Map) {
+          _textStyles[name] = TextStyleConfig.fromJson(Map<String, dynamic>.from(value));
+        } else {
+          _textStyles.remove(name);
+        }
+      case 'custom':
+        if (value != null) {
+          _custom[name] = value;
+        } else {
+          _custom.remove(name);
+        }
+    }
+  }
+
   void updateFromJson(Map<String, dynamic> json) {
     if (json['colors'] != null) {
       _colors.clear();
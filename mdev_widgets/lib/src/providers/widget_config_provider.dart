@@ -8,6 +8,7 @@ import '../services/session_storage.dart'
 typedef RegisterCallback = void Function(String id, String type, Map<String, dynamic> properties, {List<Map<String, dynamic>>? schema});
 typedef UnregisterCallback = void Function(String id);
 typedef StyleChangeCallback = void Function(Map<String, dynamic> styles);
+typedef StyleTokenCallback = void Function(String category, String name, dynamic value);
 
 class WidgetConfigProvider extends ChangeNotifier {
   static const _sessionKey = 'mdev_provider_session';
@@ -44,6 +45,9 @@ class WidgetConfigProvider extends ChangeNotifier {
   UnregisterCallback? onUnregister;
   StyleChangeCallback? onStyleChange;
 
+  /// Called with one changed token; falls back to [onStyleChange] if unset.
+  StyleTokenCallback? onStyleTokenChange;
+
   Map<String, WidgetConfig> get configs => Map.unmodifiable(_configs);
   StyleRegistry get styles => _styles;
   bool get isInitialized => _initialized;
@@ -152,32 +156,76 @@ class WidgetConfigProvider extends ChangeNotifier {
     }
   }
 
+  /// Apply individual property changes from a server patch.
+  ///
+  /// [changes] maps widget id -> {key: value}. Values equal to the registered
+  /// default clear the override. Saves and notifies once for the whole batch.
+  void updatePropsFromServer(Map<String, Map<String, dynamic>> changes) {
+    if (!_isActive || !isCurrentSession) return;
+    var changed = false;
+    changes.forEach((id, props) {
+      final existing = _configs[id];
+      if (existing == null) return;
+      final overrides = Map<String, dynamic>.from(existing.overrides);
+      props.forEach((key, value) {
+        if (value != existing.properties[key]) {
+          overrides[key] = value;
+        } else {
+          overrides.remove(key);
+        }
+      });
+      _configs[id] = WidgetConfig(
+        id: id,
+        type: existing.type,
+        properties: existing.properties,
+        overrides: overrides,
+        schema: existing.schema,
+      );
+      changed = true;
+    });
+    if (changed) {
+      _saveConfigs();
+      notifyListeners();
+    }
+  }
+
   void updateStylesFromServer(Map<String, dynamic> json) {
     if (!_isActive || !isCurrentSession) return;
     _styles.updateFromJson(json);
     notifyListeners();
   }
 
+  /// Apply one token change from the server; a null value removes the token.
+  void updateStyleTokenFromServer(String category, String name, dynamic value) {
+    if (!_isActive || !isCurrentSession) return;
+    _styles.updateToken(category, name, value);
+    notifyListeners();
+  }
+
   void registerColor(String key, {required String light, required String dark}) {
     _styles.registerColor(key, light: light, dark: dark);
-    _notifyStyleChange();
+    _notifyStyleChange('colors', key, _styles.getThemedColor(key)!.toJson());
     notifyListeners();
   }
 
   void registerSize(String key, double value) {
     _styles.registerSize(key, value);
-    _notifyStyleChange();
+    _notifyStyleChange('sizes', key, value);
     notifyListeners();
   }
 
   void registerTextStyle(String key, TextStyleConfig style) {
     _styles.registerTextStyle(key, style);
-    _notifyStyleChange();
+    _notifyStyleChange('textStyles', key, style.toJson());
     notifyListeners();
   }
 
-  void _notifyStyleChange() {
-    onStyleChange?.call(_styles.toJson());
+  void _notifyStyleChange(String category, String key, dynamic value) {
+    if (onStyleTokenChange != null) {
+      onStyleTokenChange!(category, key, value);
+    } else {
+      onStyleChange?.call(_styles.toJson());
+    }
   }
 
   void _saveConfigs() {
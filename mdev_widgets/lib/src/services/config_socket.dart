@@ -12,6 +12,10 @@ class ConfigSocket {
   final WidgetConfigProvider provider;
   final String url;
 
+  /// Server session (namespace) to join, e.g. 'ios' or 'web'. Apps in
+  /// different sessions keep separate widgets and don't reset each other.
+  final String? session;
+
   WebSocketChannel? _channel;
   StreamSubscription? _subscription;
   bool _disposed = false;
@@ -20,10 +24,28 @@ class ConfigSocket {
   int _reconnectAttempts = 0;
   static const int _maxReconnectDelay = 30;
 
-  final List<Map<String, dynamic>> _pendingMessages = [];
+  /// Registrations waiting to be flushed as one `register_batch`, keyed by id.
+  final Map<String, Map<String, dynamic>> _pendingMessages = {};
   Map<String, dynamic>? _pendingStyles;
 
-  ConfigSocket(this.provider, {this.url = 'ws://localhost:8081'});
+  /// Style tokens changed while disconnected: category -> name -> value.
+  final Map<String, Map<String, dynamic>> _pendingTokens = {};
+  bool _flushScheduled = false;
+
+  /// Server epoch and version of the last snapshot/patch received, used to
+  /// ask for only the missed changes after a reconnect.
+  String? _epoch;
+  int? _version;
+  bool _awaitingCatchUp = false;
+
+  ConfigSocket(this.provider, {this.url = 'ws://localhost:8081', this.session});
+
+  /// Connect URI; the session is selected by the path.
+  Uri get uri {
+    final base = Uri.parse(url);
+    if (session == null) return base;
+    return base.replace(pathSegments: [session!]);
+  }
 
   ConnectionState get state => _state;
   bool get isConnected => _state == ConnectionState.connected;
@@ -35,10 +57,10 @@ class ConfigSocket {
 
   Future<void> _connectAsync() async {
     _state = ConnectionState.connecting;
-    debugPrint('Connecting to $url...');
+    debugPrint('Connecting to $uri...');
 
     try {
-      _channel = WebSocketChannel.connect(Uri.parse(url));
+      _channel = WebSocketChannel.connect(uri);
 
       await _channel!.ready.timeout(
         const Duration(seconds: 5),
@@ -48,7 +70,7 @@ class ConfigSocket {
       _state = ConnectionState.connected;
       final wasReconnect = _reconnectAttempts > 0;
       _reconnectAttempts = 0;
-      debugPrint('Connected to $url');
+      debugPrint('Connected to $uri');
 
       _subscription = _channel!.stream.listen(
         _onMessage,
@@ -64,24 +86,23 @@ class ConfigSocket {
 
       provider.addListener(_onProviderChange);
 
-      if (wasReconnect) {
+      if (wasReconnect && _epoch != null) {
+        // The server usually kept our widgets; catch up on missed edits and
+        // only re-register if it answers with a state from another epoch.
+        _awaitingCatchUp = true;
+        _send({'type': 'get_changes', 'since': _version ?? 0, 'epoch': _epoch});
+        _sendPendingStyles();
+        _flushPending();
+      } else if (wasReconnect) {
         provider.reregisterAll();
       } else {
-        // First connection - reset server state
+        // First connection - reset this session's server state
         _send({'type': 'reset_all'});
 
-        if (_pendingStyles != null) {
-          debugPrint('Sending pending styles');
-          _send({'type': 'styles', 'data': _pendingStyles});
-          _pendingStyles = null;
-        }
+        _sendPendingStyles();
 
-        debugPrint('Sending ${_pendingMessages.length} pending messages');
-        for (final msg in _pendingMessages) {
-          debugPrint('  -> ${msg['id']} (${msg['widgetType']})');
-          _send(msg);
-        }
-        _pendingMessages.clear();
+        debugPrint('Sending ${_pendingMessages.length} pending registrations');
+        _flushPending();
       }
     } catch (e) {
       debugPrint('Connection failed: $e');
@@ -125,6 +146,37 @@ class ConfigSocket {
         final widgetData = data['data'] as Map<String, dynamic>;
         final id = widgetData['id'] as String;
         provider.updateFromServer(id, widgetData);
+      } else if (type == 'widgets') {
+        // Full snapshot, e.g. after the server dropped our backlog
+        final epoch = data['epoch'] as String?;
+        if (_awaitingCatchUp && epoch != _epoch) {
+          // The server lost its state (restart without a journal)
+          _awaitingCatchUp = false;
+          _epoch = epoch;
+          _version = data['version'] as int?;
+          provider.reregisterAll();
+          return;
+        }
+        _awaitingCatchUp = false;
+        _epoch = epoch;
+        _version = data['version'] as int?;
+        final widgets = data['data'] as Map<String, dynamic>;
+        widgets.forEach((id, widgetData) {
+          provider.updateFromServer(id, widgetData as Map<String, dynamic>);
+        });
+      } else if (type == 'patch') {
+        _awaitingCatchUp = false;
+        _epoch = data['epoch'] as String? ?? _epoch;
+        _version = data['version'] as int? ?? _version;
+        _applyPatch(data['ops'] as List);
+      } else if (type == 'register_ack') {
+        debugPrint('Registered ${data['registered']} widgets (${data['unchanged']} unchanged)');
+      } else if (type == 'style_changed') {
+        provider.updateStyleTokenFromServer(
+          data['category'] as String,
+          data['name'] as String,
+          data['deleted'] == true ? null : data['value'],
+        );
       } else if (type == 'styles') {
         final stylesData = data['data'] as Map<String, dynamic>;
         provider.updateStylesFromServer(stylesData);
@@ -134,38 +186,111 @@ class ConfigSocket {
     }
   }
 
+  /// Apply a versioned patch from the server.
+  ///
+  /// Only `upsert` and `prop_changed` affect the app; `removed`,
+  /// `modified_flag_changed` and `cleared` are dashboard bookkeeping.
+  void _applyPatch(List ops) {
+    final changes = <String, Map<String, dynamic>>{};
+    for (final op in ops.cast<Map<String, dynamic>>()) {
+      switch (op['op']) {
+        case 'upsert':
+          final widgetData = op['widget'] as Map<String, dynamic>;
+          provider.updateFromServer(widgetData['id'] as String, widgetData);
+        case 'prop_changed':
+          changes.putIfAbsent(op['id'] as String, () => {})[op['key'] as String] = op['value'];
+      }
+    }
+    if (changes.isNotEmpty) {
+      provider.updatePropsFromServer(changes);
+    }
+  }
+
   void _onProviderChange() {}
 
+  /// Queue a registration. While connected, registrations made in the same
+  /// event-loop turn (a frame's builds, [WidgetConfigProvider.reregisterAll])
+  /// are flushed together as one `register_batch`.
   void register(String id, String type, Map<String, dynamic> properties, {List<Map<String, dynamic>>? schema}) {
-    final msg = {
-      'type': 'register',
+    _pendingMessages[id] = {
       'id': id,
       'widgetType': type,
       'properties': properties,
       if (schema != null) 'schema': schema,
+      'hash': _contentHash([type, properties, schema]),
     };
 
     if (isConnected) {
-      debugPrint('Sending registration: $id ($type)');
-      _send(msg);
+      _scheduleFlush();
     } else {
       debugPrint('Queueing registration: $id ($type)');
-      _pendingMessages.add(msg);
     }
   }
 
   void unregister(String id) {
-    final msg = {'type': 'unregister', 'id': id};
-
+    _pendingMessages.remove(id);
     if (isConnected) {
-      _send(msg);
-    } else {
-      _pendingMessages.removeWhere(
-        (m) => m['type'] == 'register' && m['id'] == id,
-      );
+      _send({'type': 'unregister', 'id': id});
     }
   }
 
+  void _scheduleFlush() {
+    if (_flushScheduled) return;
+    _flushScheduled = true;
+    scheduleMicrotask(() {
+      _flushScheduled = false;
+      if (isConnected) _flushPending();
+    });
+  }
+
+  /// Send all pending registrations as one `register_batch` message with a
+  /// shared schema table (one schema per widget type).
+  void _flushPending() {
+    if (_pendingMessages.isEmpty) return;
+
+    final schemas = <String, List<Map<String, dynamic>>>{};
+    final entries = <Map<String, dynamic>>[];
+    for (final msg in _pendingMessages.values) {
+      final type = msg['widgetType'] as String;
+      final schema = msg['schema'] as List<Map<String, dynamic>>?;
+      if (schema != null) schemas.putIfAbsent(type, () => schema);
+      entries.add({
+        'id': msg['id'],
+        'widgetType': type,
+        'properties': msg['properties'],
+        'hash': msg['hash'],
+      });
+    }
+    _pendingMessages.clear();
+
+    debugPrint('Sending registration batch: ${entries.length} widgets');
+    _send({'type': 'register_batch', 'schemas': schemas, 'widgets': entries});
+  }
+
+  void _sendPendingStyles() {
+    if (_pendingStyles != null) {
+      debugPrint('Sending pending styles');
+      _send({'type': 'styles', 'data': _pendingStyles});
+      _pendingStyles = null;
+    }
+    _pendingTokens.forEach((category, tokens) {
+      tokens.forEach((name, value) => sendStyleToken(category, name, value));
+    });
+    _pendingTokens.clear();
+  }
+
+  /// FNV-1a hash of a registration, so the server can skip unchanged ones
+  /// (e.g. every widget re-registered after a reconnect) without comparing
+  /// their properties. Split multiply keeps it exact on the web too.
+  static String _contentHash(Object? value) {
+    var hash = 0x811c9dc5;
+    for (final byte in utf8.encode(jsonEncode(value))) {
+      hash ^= byte;
+      hash = (hash * 0x193 + ((hash & 0xff) << 24)) & 0xffffffff;
+    }
+    return hash.toRadixString(16);
+  }
+
   void sendStyles(Map<String, dynamic> styles) {
     if (isConnected) {
       _send({'type': 'styles', 'data': styles});
@@ -174,6 +299,15 @@ class ConfigSocket {
     }
   }
 
+  /// Send one changed style token instead of the whole registry.
+  void sendStyleToken(String category, String name, dynamic value) {
+    if (isConnected) {
+      _send({'type': 'style_upsert', 'category': category, 'name': name, 'value': value});
+    } else {
+      _pendingTokens.putIfAbsent(category, () => {})[name] = value;
+    }
+  }
+
   void resetServer() {
     _send({'type': 'reset_all'});
   }
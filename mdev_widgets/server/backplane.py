@@ -0,0 +1,233 @@
+"""
+Backplane shared by the server's worker processes.
+
+With `--workers N` several processes accept WebSocket connections on the
+same port, each with its own replica of the widget, schema and style
+store. Workers don't apply mutations from their clients directly: they
+publish them to the backplane, which puts every record in one global
+order and delivers it to all workers, including the one it came from.
+Each worker applies records in that order and broadcasts the resulting
+patches to its own clients, so the replicas stay identical.
+
+A worker joining late gets a snapshot of the state first, and then every
+record sequenced after it.
+
+Backends implement `Backplane`:
+  LocalBackplane   workers in one process sharing a Sequencer (tests)
+  UnixBackplane    a worker's connection to a Broker process over a Unix socket
+
+A Redis backend would fit the same interface: an XADD'ed stream gives the
+order, and a snapshot key kept by one consumer serves joining workers.
+
+Broker wire format: 4-byte big-endian length + a JSON object per frame.
+  worker -> broker  {"type": "join"}, then {"type": "publish", "record": {...}}
+  broker -> worker  {"type": "snapshot", "seq": N, "state": {...}},
+                    then {"type": "record", "record": {..., "seq": n}}
+"""
+
+import asyncio
+import json
+import logging
+import struct
+
+log = logging.getLogger('mdev_widgets')
+
+HEADER = struct.Struct('>I')
+
+
+class Backplane:
+    """Interface of a backplane backend, as seen by one worker."""
+
+    async def join(self, deliver):
+        """Start receiving records; returns the state to start from.
+
+        deliver(record) is called (not awaited) for every record sequenced
+        after that state, in order.
+        """
+        raise NotImplementedError
+
+    async def publish(self, record):
+        """Hand a record to the backplane to be sequenced and delivered to every worker."""
+        raise NotImplementedError
+
+    async def wait_closed(self):
+        """Return when the backplane is gone (closed, or the connection to it lost)."""
+        raise NotImplementedError
+
+    async def close(self):
+        raise NotImplementedError
+
+
+class Sequencer:
+    """Orders published records and fans them out to the joined workers."""
+
+    def __init__(self, apply=None, snapshot=None):
+        self.apply = apply  # Coroutine function(record) keeping the authoritative copy, or None
+        self.snapshot = snapshot  # Callable() -> state for joining workers, or None
+        self.seq = 0  # Seq of the last record
+        self._subscribers = []
+        self._lock = asyncio.Lock()
+
+    async def join(self, deliver):
+        """Subscribe deliver to the records after the returned state."""
+        async with self._lock:
+            self._subscribers.append(deliver)
+            return self.snapshot() if self.snapshot is not None else None
+
+    def leave(self, deliver):
+        if deliver in self._subscribers:
+            self._subscribers.remove(deliver)
+
+    async def publish(self, record):
+        async with self._lock:
+            self.seq += 1
+            record = {**record, 'seq': self.seq}
+            if self.apply is not None:
+                try:
+                    await self.apply(record)
+                except Exception:
+                    # Delivered all the same: its sender is waiting to see it come back
+                    log.exception("Applying backplane record %d failed", self.seq)
+            for deliver in list(self._subscribers):
+                deliver(record)
+        return record
+
+
+class LocalBackplane(Backplane):
+    """In-process backend: a worker attached directly to a shared Sequencer."""
+
+    def __init__(self, sequencer):
+        self.sequencer = sequencer
+        self._deliver = None
+        self._closed = asyncio.Event()
+
+    async def join(self, deliver):
+        self._deliver = deliver
+        return await self.sequencer.join(deliver)
+
+    async def publish(self, record):
+        if self._closed.is_set():
+            raise ConnectionError('backplane closed')
+        await self.sequencer.publish(record)
+
+    async def wait_closed(self):
+        await self._closed.wait()
+
+    async def close(self):
+        if self._deliver is not None:
+            self.sequencer.leave(self._deliver)
+        self._closed.set()
+
+
+def encode_frame(frame):
+    data = json.dumps(frame, separators=(',', ':')).encode()
+    return HEADER.pack(len(data)) + data
+
+
+async def read_frame(reader):
+    """Next frame from reader, or None at the end of the stream."""
+    try:
+        header = await reader.readexactly(HEADER.size)
+        return json.loads(await reader.readexactly(HEADER.unpack(header)[0]))
+    except asyncio.IncompleteReadError:
+        return None
+
+
+class UnixBackplane(Backplane):
+    """Worker side of a Broker, over its Unix socket."""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._reader = None
+        self._writer = None
+        self._task = None
+
+    async def join(self, deliver):
+        self._reader, self._writer = await asyncio.open_unix_connection(self.path)
+        self._writer.write(encode_frame({'type': 'join'}))
+        snapshot = await read_frame(self._reader)
+        if snapshot is None or snapshot.get('type') != 'snapshot':
+            raise ConnectionError(f'backplane broker at {self.path} did not send a snapshot')
+        self._task = asyncio.create_task(self._receive(deliver))
+        return snapshot['state']
+
+    async def _receive(self, deliver):
+        try:
+            while (frame := await read_frame(self._reader)) is not None:
+                deliver(frame['record'])
+        except ConnectionError:
+            pass
+        log.info("Backplane connection to %s closed", self.path)
+
+    async def publish(self, record):
+        if self._writer is None or self._writer.is_closing():
+            raise ConnectionError('backplane closed')
+        self._writer.write(encode_frame({'type': 'publish', 'record': record}))
+        await self._writer.drain()  # Pushes back when the broker falls behind
+
+    async def wait_closed(self):
+        if self._task is not None:
+            await asyncio.shield(self._task)
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except ConnectionError:
+                pass
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+
+class Broker:
+    """Unix-socket server sequencing the records of its UnixBackplane workers."""
+
+    def __init__(self, path, sequencer):
+        self.path = str(path)
+        self.sequencer = sequencer
+        self._server = None
+        self._connections = set()
+
+    async def start(self):
+        self._server = await asyncio.start_unix_server(self._handle, self.path)
+
+    async def _handle(self, reader, writer):
+        self._connections.add(writer)
+
+        def deliver(record):
+            # Never waits: a slow worker's records buffer in its transport
+            if not writer.is_closing():
+                writer.write(encode_frame({'type': 'record', 'record': record}))
+
+        joined = False
+        try:
+            frame = await read_frame(reader)
+            if frame is None or frame.get('type') != 'join':
+                return
+            state = await self.sequencer.join(deliver)
+            joined = True
+            # Written before yielding, so it precedes every record delivered after the snapshot
+            writer.write(encode_frame({'type': 'snapshot', 'seq': self.sequencer.seq, 'state': state}))
+            while (frame := await read_frame(reader)) is not None:
+                if frame.get('type') == 'publish':
+                    await self.sequencer.publish(frame['record'])
+        except ConnectionError:
+            pass
+        finally:
+            if joined:
+                self.sequencer.leave(deliver)
+            self._connections.discard(writer)
+            writer.close()
+
+    async def close(self):
+        if self._server is None:
+            return
+        self._server.close()
+        for writer in list(self._connections):
+            writer.close()
+        await self._server.wait_closed()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Wire codec benchmark: CPU and bytes per codec under a register storm.
+
+Simulates an app registering N widgets (one `register` each), the server
+broadcasting an upsert patch per registration, then a dashboard editing
+properties (one prop_changed patch each). For every codec it reports
+encode/decode time and bytes on the wire, raw and after permessage-deflate
+with context takeover at the websockets default window (12 bits) and the
+server's default (15 bits).
+
+Usage: python benchmarks/bench_codec.py [--widgets N] [--edits N]
+"""
+
+import argparse
+import sys
+import time
+import zlib
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from codec import CODECS
+
+WIDGET_TYPES = ['Text', 'Column', 'Row', 'Padding', 'Container', 'SizedBox']
+
+
+def register_storm(widgets, edits):
+    """(inbound registers, outbound patches) for a storm of widget registrations and edits."""
+    registers = []
+    patches = []
+    for i in range(widgets):
+        widget = {
+            'id': f'widget{i % 50} (lib/screens/screen_{i // 50}.dart:{10 + i % 50}:{5 + i % 7})',
+            'type': WIDGET_TYPES[i % len(WIDGET_TYPES)],
+            'properties': {
+                'fontSize': 14.0, 'color': '#ff6200ee', 'paddingAll': 8.0,
+                'text': f'Label {i}', 'visible': True, 'highlight': False,
+            },
+        }
+        registers.append({'type': 'register', 'id': widget['id'], 'widgetType': widget['type'],
+                          'properties': widget['properties']})
+        patches.append({'type': 'patch', 'version': i + 1, 'ops': [
+            {'op': 'upsert', 'widget': {**widget, 'schemaRef': '3f2a9c1b0d4e5f60', 'modified': False}},
+        ]})
+    for i in range(edits):
+        widget_id = registers[i % widgets]['id']
+        patches.append({'type': 'patch', 'version': widgets + i + 1, 'ops': [
+            {'op': 'prop_changed', 'id': widget_id, 'key': 'fontSize', 'value': 14.0 + i % 10},
+            {'op': 'modified_flag_changed', 'id': widget_id, 'modified': True},
+        ]})
+    return registers, patches
+
+
+def deflated_size(frames, window_bits):
+    """Bytes after permessage-deflate with context takeover (RFC 7692)."""
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -window_bits)
+    total = 0
+    for frame in frames:
+        if isinstance(frame, str):
+            frame = frame.encode()
+        data = compressor.compress(frame) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        total += len(data) - 4  # The trailing 00 00 ff ff is not sent
+    return total
+
+
+def size(frame):
+    return len(frame.encode() if isinstance(frame, str) else frame)
+
+
+def bench(codec, registers, patches):
+    started = time.perf_counter()
+    inbound = [codec.dumps(m) for m in registers]  # Encoded by the app
+    encode_in = time.perf_counter() - started
+    started = time.perf_counter()
+    for frame in inbound:
+        codec.decode(frame)
+    decode_in = time.perf_counter() - started
+
+    started = time.perf_counter()
+    outbound = [codec.encode(message) for message in patches]
+    encode_out = time.perf_counter() - started
+    started = time.perf_counter()
+    for frame in outbound:
+        codec.decode(frame)
+    decode_out = time.perf_counter() - started
+
+    return {
+        'codec': codec.name,
+        'encode_ms': (encode_in + encode_out) * 1000,
+        'decode_ms': (decode_in + decode_out) * 1000,
+        'in_bytes': sum(size(f) for f in inbound),
+        'out_bytes': sum(size(f) for f in outbound),
+        'out_deflate12': deflated_size(outbound, 12),
+        'out_deflate15': deflated_size(outbound, 15),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--widgets', type=int, default=5000)
+    parser.add_argument('--edits', type=int, default=5000)
+    args = parser.parse_args(argv)
+
+    registers, patches = register_storm(args.widgets, args.edits)
+    print(f"{args.widgets} registers, {len(patches)} patches")
+    header = f"{'codec':<18}{'encode ms':>10}{'decode ms':>10}{'in KiB':>9}{'out KiB':>9}{'deflate12':>11}{'deflate15':>11}"
+    print(header)
+    print('-' * len(header))
+    for codec in CODECS.values():
+        r = bench(codec, registers, patches)
+        print(f"{r['codec']:<18}{r['encode_ms']:>10.1f}{r['decode_ms']:>10.1f}"
+              f"{r['in_bytes'] / 1024:>9.0f}{r['out_bytes'] / 1024:>9.0f}"
+              f"{r['out_deflate12'] / 1024:>11.0f}{r['out_deflate15'] / 1024:>11.0f}")
+
+
+if __name__ == '__main__':
+    main()
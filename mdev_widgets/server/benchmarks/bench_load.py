@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+"""
+Load benchmark: the config server in-process under many real WebSocket clients.
+
+The server runs on an ephemeral port with its production options. Each app
+gets its own session (as web, simulator and emulator builds do), and the
+dashboards are spread across those sessions. Three scenarios run in order:
+
+  register   every app registers its widgets in `register_batch` chunks, as
+             the Flutter package flushes a frame's builds; latency is from a
+             batch being sent to a dashboard having every widget in it
+  edit       every dashboard drags a property of its own widget (one
+             `update_prop` per input event) and asks for `get_all` now and
+             then; latency is from an edit to the other clients of the
+             session seeing that value or a newer one
+  reconnect  every client drops and reconnects at once; apps re-register
+             (a tenth of the widgets changed, as after a hot reload) and
+             dashboards send `get_changes`; latency is from connecting to
+             being back in sync
+
+For each scenario it reports throughput, p50/p99 latency, the process RSS
+(server and clients share it) and payload bytes both ways; for get_all,
+the bytes of the snapshots it returned. Frames are not compressed, so
+payload bytes are what crosses the socket, headers aside.
+
+`--save` stores the results as the baseline; `--compare` checks them
+against it and exits with status 1 if any metric is worse by more than
+`--threshold`. Baselines only mean something on the machine they were
+saved on: save one there before upgrading, then compare after. They are
+not committed.
+
+Usage: python benchmarks/bench_load.py [--apps N] [--widgets N] [--dashboards N] [--save | --compare]
+"""
+
+import argparse
+import asyncio
+import json
+import resource
+import statistics
+import sys
+import time
+import zlib
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import websockets
+
+import config_server
+from codec import deflate_extensions, select_subprotocol
+
+BASELINE_PATH = Path(__file__).parent / 'baselines' / 'bench_load.json'
+WIDGET_TYPES = ['Text', 'Column', 'Row', 'Padding', 'Container', 'SizedBox']
+SCHEMA = [{'name': 'value', 'type': 'double'}, {'name': 'text', 'type': 'string'},
+          {'name': 'color', 'type': 'color'}, {'name': 'visible', 'type': 'bool'}]
+
+# Metric -> True if higher is better
+METRICS = {'throughput': True, 'p50_ms': False, 'p99_ms': False, 'rss_mib': False, 'kib': False}
+LATENCY_SLACK_MS = 1.0  # Latency changes below this are noise, whatever the ratio
+
+
+def widget_entries(app, count, revision=0):
+    """register_batch entries for one app; `revision` changes every tenth widget."""
+    entries = []
+    for i in range(count):
+        properties = {
+            'value': float(i % 100), 'text': f'Label {i}', 'color': '#ff6200ee', 'visible': True,
+        }
+        if revision and i % 10 == 0:
+            properties['text'] = f'Label {i} r{revision}'
+        widget_type = WIDGET_TYPES[i % len(WIDGET_TYPES)]
+        entries.append({
+            'id': f'widget{i % 50} (lib/app{app}/screen_{i // 50}.dart:{10 + i % 50}:9)',
+            'widgetType': widget_type,
+            'properties': properties,
+            'hash': zlib.crc32(json.dumps([widget_type, properties], sort_keys=True).encode()),
+        })
+    return entries
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else 0.0
+
+
+def rss_mib():
+    """Current resident set size; peak RSS where /proc is unavailable."""
+    try:
+        for line in Path('/proc/self/status').read_text().splitlines():
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / (1024 if sys.platform == 'darwin' else 1)
+
+
+class Client:
+    """A WebSocket client that keeps what the benchmark needs from every message."""
+
+    def __init__(self, url, session):
+        self.url = f'{url}/{session}'
+        self.session = session
+        self.websocket = None
+        self.reader = None
+        self.bytes = 0
+        self.snapshot_bytes = 0  # Of the bytes received, those in `widgets` snapshots
+        self.version = 0
+        self.epoch = None
+        self.widgets = set()  # Widget ids seen upserted
+        self.props = {}  # Widget id -> [(arrival, value)] of prop_changed ops
+        self.replies = {}  # Message type -> asyncio.Event set when one arrives
+        self.acked = 0  # Widgets acknowledged by register_ack
+        self.on_upsert = None  # Callable(arrival time) per upsert, for batch latency
+
+    async def connect(self):
+        self.websocket = await websockets.connect(self.url, compression=None, max_size=None)
+        self.reader = asyncio.create_task(self._read())
+
+    async def close(self):
+        await self.websocket.close()
+        await self.reader
+
+    async def send(self, message):
+        data = json.dumps(message)
+        self.bytes += len(data)
+        await self.websocket.send(data)
+
+    def expect(self, message_type):
+        """Event set by the next message of this type."""
+        event = self.replies[message_type] = asyncio.Event()
+        return event
+
+    async def _read(self):
+        try:
+            async for data in self.websocket:
+                arrival = time.perf_counter()
+                self.bytes += len(data)
+                message = json.loads(data)
+                if message['type'] == 'widgets':
+                    self.snapshot_bytes += len(data)
+                self._handle(message, arrival)
+        except websockets.ConnectionClosed:
+            pass
+
+    def _handle(self, message, arrival):
+        kind = message['type']
+        if kind == 'widgets':
+            self.epoch, self.version = message['epoch'], message['version']
+            self.widgets = set(message['data'])
+        elif kind == 'patch':
+            self.epoch, self.version = message['epoch'], message['version']
+            for op in message['ops']:
+                if op['op'] == 'upsert':
+                    self.widgets.add(op['widget']['id'])
+                    if self.on_upsert is not None:
+                        self.on_upsert(op['widget']['id'], arrival)
+                elif op['op'] == 'prop_changed' and op['key'] == 'value':
+                    self.props.setdefault(op['id'], []).append((arrival, op['value']))
+        elif kind == 'register_ack':
+            self.acked += message['registered']
+        event = self.replies.pop(kind, None)
+        if event is not None:
+            event.set()
+
+
+async def wait_until(predicate, timeout=60.0):
+    deadline = time.perf_counter() + timeout
+    while not predicate():
+        if time.perf_counter() > deadline:
+            raise TimeoutError('clients did not catch up in time')
+        await asyncio.sleep(0.001)
+
+
+async def bench_register(apps, dashboards, widgets, batch):
+    """Apps register their widgets; dashboards must see every one."""
+    latencies = []
+    sent_at = {}  # Id of the last widget of each batch -> send time
+
+    def on_upsert(widget_id, arrival):
+        if widget_id in sent_at:
+            latencies.append(arrival - sent_at[widget_id])
+
+    for dashboard in dashboards:
+        dashboard.on_upsert = on_upsert
+        ready = dashboard.expect('widgets')
+        await dashboard.send({'type': 'get_all'})
+        await ready.wait()
+
+    async def register(index, app):
+        entries = widget_entries(index, widgets)
+        for start in range(0, len(entries), batch):
+            chunk = entries[start:start + batch]
+            sent_at[chunk[-1]['id']] = time.perf_counter()
+            schemas = {entry['widgetType']: SCHEMA for entry in chunk}
+            await app.send({'type': 'register_batch', 'schemas': schemas, 'widgets': chunk})
+            await asyncio.sleep(0)  # Let other apps interleave, as separate devices would
+
+    started = time.perf_counter()
+    await asyncio.gather(*(register(i, app) for i, app in enumerate(apps)))
+    await wait_until(lambda: all(len(d.widgets) == widgets for d in dashboards))
+    elapsed = time.perf_counter() - started
+    for dashboard in dashboards:
+        dashboard.on_upsert = None
+    return len(apps) * widgets / elapsed, latencies
+
+
+async def bench_edit(apps, dashboards, rate, seconds, get_all_every):
+    """Dashboards drag a property each and poll get_all; the session's other clients follow."""
+    targets = {}  # Dashboard -> widget id it drags
+    for dashboard in dashboards:
+        widget_ids = sorted(dashboard.widgets)
+        targets[dashboard] = widget_ids[sum(d.session == dashboard.session for d in targets)]
+    sent = {dashboard: [] for dashboard in dashboards}  # (send time, value)
+    snapshots = []
+
+    async def drag(index, dashboard):
+        widget_id = targets[dashboard]
+        interval = 1 / rate
+        events = int(rate * seconds)
+        start = time.perf_counter()
+        next_get_all = start + get_all_every * (index + 1) / len(dashboards)  # Dashboards poll out of step
+        for value in range(events):
+            await asyncio.sleep(max(0.0, start + value * interval - time.perf_counter()))
+            sent[dashboard].append((time.perf_counter(), value))
+            await dashboard.send({'type': 'update_prop', 'id': widget_id, 'key': 'value', 'value': value})
+            if get_all_every and time.perf_counter() >= next_get_all:
+                next_get_all += get_all_every
+                requested = time.perf_counter()
+                ready = dashboard.expect('widgets')
+                await dashboard.send({'type': 'get_all'})
+                await ready.wait()
+                snapshots.append(time.perf_counter() - requested)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(drag(i, d) for i, d in enumerate(dashboards)))
+    last = int(rate * seconds) - 1
+    watchers = {d: [c for c in (*apps, *dashboards) if c.session == d.session and c is not d]
+                for d in dashboards}
+    await wait_until(lambda: all(w.props.get(targets[d], [(0, -1)])[-1][1] == last
+                                 for d in dashboards for w in watchers[d]))
+    elapsed = time.perf_counter() - started
+
+    latencies = []
+    for dashboard in dashboards:
+        for watcher in watchers[dashboard]:
+            seen = watcher.props[targets[dashboard]]
+            cursor = 0
+            for sent_at, value in sent[dashboard]:
+                while seen[cursor][1] < value:
+                    cursor += 1
+                latencies.append(seen[cursor][0] - sent_at)
+    edits = sum(len(edits) for edits in sent.values())
+    return edits / elapsed, latencies, snapshots
+
+
+async def bench_reconnect(apps, dashboards, widgets, batch):
+    """Every client drops and reconnects at once; apps re-register after a hot reload."""
+    for client in (*apps, *dashboards):
+        await client.close()
+    latencies = []
+
+    async def reconnect_app(index, app):
+        started = time.perf_counter()
+        await app.connect()
+        app.acked = 0
+        entries = widget_entries(index, widgets, revision=1)
+        for start in range(0, len(entries), batch):
+            chunk = entries[start:start + batch]
+            schemas = {entry['widgetType']: SCHEMA for entry in chunk}
+            await app.send({'type': 'register_batch', 'schemas': schemas, 'widgets': chunk})
+        await wait_until(lambda: app.acked >= widgets)
+        latencies.append(time.perf_counter() - started)
+
+    async def reconnect_dashboard(dashboard):
+        started = time.perf_counter()
+        await dashboard.connect()
+        # Both a catch-up patch and a snapshot end with the session's styles
+        synced = dashboard.expect('styles')
+        await dashboard.send({'type': 'get_changes', 'since': dashboard.version, 'epoch': dashboard.epoch})
+        await synced.wait()
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(reconnect_app(i, app) for i, app in enumerate(apps)),
+                         *(reconnect_dashboard(d) for d in dashboards))
+    elapsed = time.perf_counter() - started
+    return (len(apps) + len(dashboards)) / elapsed, latencies
+
+
+def summarize(throughput, latencies, kib):
+    return {
+        'throughput': throughput,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'rss_mib': rss_mib(),
+        'kib': kib,
+    }
+
+
+async def run(args):
+    config_server.UPDATE_PROP_RATE = args.update_rate
+    config_server.sessions.clear()  # Repeats start from an empty server
+    config_server.sessions[config_server.DEFAULT_SESSION] = config_server.default_session
+    config_server.store.clear()
+    server = await websockets.serve(
+        config_server.handle_websocket, '127.0.0.1', 0,
+        process_request=config_server.process_request,
+        select_subprotocol=select_subprotocol,
+        compression=None,
+        extensions=deflate_extensions(config_server.DEFLATE_WINDOW_BITS),
+    )
+    port = server.sockets[0].getsockname()[1]
+    url = f'ws://127.0.0.1:{port}'
+    apps = [Client(url, f'app{i}') for i in range(args.apps)]
+    dashboards = [Client(url, f'app{i % args.apps}') for i in range(args.dashboards)]
+    clients = [*apps, *dashboards]
+    for client in clients:
+        await client.connect()
+
+    def kib_since(start):
+        return (sum(c.bytes for c in clients) - start) / 1024
+
+    results = {}
+    try:
+        throughput, latencies = await bench_register(apps, dashboards, args.widgets, args.batch)
+        results['register'] = summarize(throughput, latencies, kib_since(0))
+
+        start = sum(c.bytes for c in clients)
+        snapshot_start = sum(c.snapshot_bytes for c in clients)
+        throughput, latencies, snapshots = await bench_edit(apps, dashboards, args.edit_rate, args.seconds,
+                                                            args.get_all_every)
+        results['edit'] = summarize(throughput, latencies, kib_since(start))  # Includes the get_all replies
+        if snapshots:
+            snapshot_kib = (sum(c.snapshot_bytes for c in clients) - snapshot_start) / 1024
+            results['get_all'] = summarize(len(snapshots) / sum(snapshots), snapshots, snapshot_kib)
+
+        start = sum(c.bytes for c in clients)
+        throughput, latencies = await bench_reconnect(apps, dashboards, args.widgets, args.batch)
+        results['reconnect'] = summarize(throughput, latencies, kib_since(start))
+    finally:
+        for client in clients:
+            await client.close()
+        server.close()
+        await server.wait_closed()
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Lines describing each metric against the baseline, and whether any regressed."""
+    lines = []
+    regressed = False
+    for scenario, metrics in results.items():
+        for metric, value in metrics.items():
+            base = baseline.get(scenario, {}).get(metric)
+            if not base:
+                continue
+            change = value / base - 1
+            worse = -change if METRICS[metric] else change
+            if metric.endswith('_ms') and abs(value - base) < LATENCY_SLACK_MS:
+                worse = 0.0
+            status = 'REGRESSED' if worse > threshold else 'ok'
+            regressed |= worse > threshold
+            lines.append(f"{scenario:<11}{metric:<12}{base:>12.1f}{value:>12.1f}{change:>+9.0%}  {status}")
+    return lines, regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--apps', type=int, default=4)
+    parser.add_argument('--widgets', type=int, default=2000, help='widgets per app')
+    parser.add_argument('--batch', type=int, default=200, help='widgets per register_batch')
+    parser.add_argument('--dashboards', type=int, default=8)
+    parser.add_argument('--edit-rate', type=float, default=60, help='update_prop per second per dashboard')
+    parser.add_argument('--seconds', type=float, default=3.0, help='length of the edit scenario')
+    parser.add_argument('--get-all-every', type=float, default=1.0, help='seconds between get_all polls')
+    parser.add_argument('--update-rate', type=float, default=config_server.UPDATE_PROP_RATE, metavar='HZ',
+                        help='server broadcast rate for update_prop (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs to take the median of (default: %(default)s)')
+    parser.add_argument('--baseline', type=Path, default=BASELINE_PATH)
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='fraction by which a metric may be worse than the baseline (default: %(default)s)')
+    action = parser.add_mutually_exclusive_group()
+    action.add_argument('--save', action='store_true', help='save the results as the baseline')
+    action.add_argument('--compare', action='store_true', help='exit 1 if a metric regressed')
+    args = parser.parse_args(argv)
+    if args.dashboards < args.apps:
+        parser.error('need at least one dashboard per app')
+
+    params = {name: getattr(args, name) for name in
+              ('apps', 'widgets', 'batch', 'dashboards', 'edit_rate', 'seconds', 'get_all_every', 'update_rate')}
+    print(f"{args.apps} apps x {args.widgets} widgets, {args.dashboards} dashboards, "
+          f"edits at {args.edit_rate:g}/s for {args.seconds:g}s, broadcast rate {args.update_rate:g}/s")
+    runs = [asyncio.run(run(args)) for _ in range(args.repeat)]
+    results = {scenario: {metric: round(statistics.median(r[scenario][metric] for r in runs), 3)
+                          for metric in metrics}
+               for scenario, metrics in runs[0].items()}
+
+    header = f"{'scenario':<11}{'per sec':>10}{'p50 ms':>9}{'p99 ms':>9}{'RSS MiB':>9}{'KiB':>10}"
+    print(header)
+    print('-' * len(header))
+    for scenario, r in results.items():
+        print(f"{scenario:<11}{r['throughput']:>10.0f}{r['p50_ms']:>9.1f}{r['p99_ms']:>9.1f}"
+              f"{r['rss_mib']:>9.1f}{r['kib']:>10.0f}")
+
+    if args.save:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps({'params': params, 'results': results}, indent=2) + '\n')
+        print(f"\nSaved baseline to {args.baseline}")
+    elif args.compare:
+        saved = json.loads(args.baseline.read_text())
+        if saved['params'] != params:
+            print(f"\nBaseline was saved with different parameters: {saved['params']}")
+            return 2
+        lines, regressed = compare(results, saved['results'], args.threshold)
+        print(f"\n{'scenario':<11}{'metric':<12}{'baseline':>12}{'now':>12}{'change':>9}")
+        print('\n'.join(lines))
+        if regressed:
+            print(f"\nRegressed by more than {args.threshold:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Widget store memory benchmark: RSS growth for a large catalog.
+
+Registers N widgets the way the server receives them (JSON-decoded
+`register_batch` messages of 200 widgets, so every batch brings its own
+copies of type names and property keys), then edits a share of them and
+resets all edits. It reports the process RSS growth after each step, and
+after building a snapshot, which caches every widget's encoded JSON.
+
+Usage: python benchmarks/bench_memory.py [--widgets N] [--edited FRACTION]
+"""
+
+import argparse
+import gc
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from widget_store import WidgetStore
+
+WIDGET_TYPES = ['Text', 'Column', 'Row', 'Padding', 'Container', 'SizedBox', 'ElevatedButton', 'Icon']
+
+
+def rss_mib():
+    for line in Path('/proc/self/status').read_text().splitlines():
+        if line.startswith('VmRSS:'):
+            return int(line.split()[1]) / 1024
+    raise OSError('VmRSS not available')
+
+
+def batches(count, size=200):
+    """Encoded register_batch messages for a catalog of count widgets."""
+    for start in range(0, count, size):
+        widgets = []
+        for i in range(start, min(start + size, count)):
+            widgets.append({
+                'id': f'widget{i % 50} (package:app/screens/screen_{i // 50}.dart:{10 + i % 50}:9)',
+                'widgetType': WIDGET_TYPES[i % len(WIDGET_TYPES)],
+                'properties': {
+                    'fontSize': 14.0, 'fontWeight': 'w400', 'color': '#ff6200ee', 'paddingAll': 8.0,
+                    'text': f'Label {i}', 'visible': True, 'highlight': False,
+                },
+            })
+        yield json.dumps({'type': 'register_batch', 'widgets': widgets})
+
+
+def measure(widgets, edited):
+    gc.collect()
+    start = rss_mib()
+    store = WidgetStore()
+    steps = []
+
+    def step(name):
+        gc.collect()
+        steps.append((name, rss_mib() - start))
+
+    for encoded in batches(widgets):
+        for entry in json.loads(encoded)['widgets']:
+            store.register(entry['id'], entry['widgetType'], entry['properties'])
+    step('registered')
+    ids = list(store.widgets)
+    for widget_id in ids[:int(len(ids) * edited)]:
+        store.set_prop(widget_id, 'fontSize', 18.0)
+        store.set_prop(widget_id, 'color', '#ff03dac6')
+    step(f'{edited:.0%} edited')
+    store.reset_all_changes()
+    step('reset')
+    store.snapshot_json()
+    step('snapshot cached')
+    return steps
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--widgets', type=int, default=50000)
+    parser.add_argument('--edited', type=float, default=0.1, help='fraction of widgets edited')
+    args = parser.parse_args(argv)
+
+    print(f"{args.widgets} widgets")
+    print(f"{'step':<18}{'RSS MiB':>9}{'bytes/widget':>14}")
+    for name, mib in measure(args.widgets, args.edited):
+        print(f"{name:<18}{mib:>9.1f}{mib * 1024 * 1024 / args.widgets:>14.0f}")
+
+
+if __name__ == '__main__':
+    main()
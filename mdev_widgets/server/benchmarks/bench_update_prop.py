@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+update_prop benchmark: broadcast volume and latency during a continuous drag.
+
+An editor client sends one `update_prop` per input event (as a dashboard
+slider does) while several other clients watch. For each broadcast rate
+limit it reports how many patches and bytes every watcher receives, the
+latency from an edit to the watchers seeing it (or a newer value), the
+latency of the drag's final value, and the editor's own echo latency.
+
+Usage: python benchmarks/bench_update_prop.py [--events-per-sec N] [--seconds N] [--watchers N]
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import config_server
+
+WIDGET_ID = 'slider (lib/screens/settings.dart:42:9)'
+
+
+class Watcher:
+    """Client connection that timestamps what the server sends it."""
+
+    def __init__(self):
+        self.received = []  # (arrival time, message)
+        self.bytes = 0
+
+    async def send(self, data):
+        self.bytes += len(data)
+        self.received.append((time.perf_counter(), json.loads(data)))
+
+
+class Editor(Watcher):
+    """Client that drags one property, one update_prop per input event."""
+
+    def __init__(self, events, interval):
+        super().__init__()
+        self.events = events
+        self.interval = interval
+        self.sent_at = {}  # Value -> send time
+
+    def __aiter__(self):
+        return self._drag()
+
+    async def _drag(self):
+        start = time.perf_counter()
+        for i in range(self.events):
+            # Pace against the clock so slow iterations don't stretch the drag
+            await asyncio.sleep(max(0.0, start + i * self.interval - time.perf_counter()))
+            self.sent_at[i] = time.perf_counter()
+            yield json.dumps({'type': 'update_prop', 'id': WIDGET_ID, 'key': 'value', 'value': i})
+        await asyncio.sleep(0.2)  # Let the last held value go out
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else 0.0
+
+
+async def run(rate, events, interval, watcher_count):
+    config_server.UPDATE_PROP_RATE = rate
+    config_server.store.clear()
+    config_server.clients.clear()
+    session = config_server.default_session
+    session.pending_props.clear()
+    session.pending_flags.clear()
+    session.props_flushed_at = float('-inf')
+    config_server.store.register(WIDGET_ID, 'Slider', {'value': -1})
+
+    watchers = [Watcher() for _ in range(watcher_count)]
+    for watcher in watchers:
+        config_server.add_client(watcher)
+    editor = Editor(events, interval)
+    await config_server.handle_websocket(editor)
+    for watcher in watchers:
+        await config_server.remove_client(watcher)
+
+    # Latency of an edit = time until a watcher saw that value or a newer one
+    watcher = watchers[0]
+    seen = [(arrival, op['value']) for arrival, message in watcher.received if message['type'] == 'patch'
+            for op in message['ops'] if op['op'] == 'prop_changed']
+    latencies = []
+    cursor = 0
+    for value, sent in sorted(editor.sent_at.items()):
+        while cursor < len(seen) and seen[cursor][1] < value:
+            cursor += 1
+        if cursor < len(seen):
+            latencies.append(seen[cursor][0] - sent)
+    final = seen[-1][0] - editor.sent_at[events - 1] if seen and seen[-1][1] == events - 1 else None
+    echoes = [arrival - editor.sent_at[message['value']] for arrival, message in editor.received
+              if message['type'] == 'prop_ack']
+
+    return {
+        'rate': rate or 'off',
+        'patches': sum(1 for _, m in watcher.received if m['type'] == 'patch'),
+        'kib': sum(w.bytes for w in watchers) / len(watchers) / 1024,
+        'mean_ms': statistics.mean(latencies) * 1000 if latencies else 0.0,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'final_ms': final * 1000 if final is not None else float('nan'),
+        'echo_ms': statistics.mean(echoes) * 1000 if echoes else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--events-per-sec', type=float, default=120)
+    parser.add_argument('--seconds', type=float, default=2.0)
+    parser.add_argument('--watchers', type=int, default=5)
+    parser.add_argument('--rates', type=float, nargs='+', default=[0, 60, 30, 10])
+    args = parser.parse_args(argv)
+
+    events = int(args.events_per_sec * args.seconds)
+    print(f"{events} edits at {args.events_per_sec:g}/s, {args.watchers} watchers")
+    header = (f"{'rate/s':<8}{'patches':>9}{'KiB/watcher':>13}{'mean ms':>9}{'p95 ms':>9}"
+              f"{'final ms':>10}{'echo ms':>9}")
+    print(header)
+    print('-' * len(header))
+    for rate in args.rates:
+        r = asyncio.run(run(rate, events, 1 / args.events_per_sec, args.watchers))
+        print(f"{r['rate']:<8}{r['patches']:>9}{r['kib']:>13.1f}{r['mean_ms']:>9.1f}{r['p95_ms']:>9.1f}"
+              f"{r['final_ms']:>10.1f}{r['echo_ms']:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Replay a traffic capture (`config_server.py --capture FILE`) against a fresh server.
+
+Every captured connection is opened again, on its captured path and
+subprotocol, and sends its captured messages on the captured schedule,
+sped up by `--speed` (1 to 100 times). Connections run concurrently, so
+reconnect storms, drag bursts and hot-reload waves hit the server as they
+happened.
+
+Latency is measured per message type, from sending a message to receiving
+the reply the capture shows for it: the first message the server sent that
+connection after it, if one came before the connection's next message. In
+the replay the first message of the same type counts as that reply.
+Throughput is messages sent per second of replay.
+
+At the end each captured session's state, as `get_all` shows it, is
+diffed against the state the capture recorded on shutdown. Capture from a
+server started empty (no journal), or the diff includes what it restored.
+
+By default the server runs in-process on an ephemeral port, as in
+bench_load; `--url` replays against a server started separately instead,
+e.g. another checkout or one with `--workers`.
+
+Usage: python benchmarks/replay.py CAPTURE [--speed X] [--url ws://localhost:8081]
+"""
+
+import argparse
+import asyncio
+from collections import deque
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import websockets
+
+import config_server
+from capture import read_capture
+from codec import codec_for, deflate_extensions, select_subprotocol
+from session import DEFAULT_SESSION
+
+REPLY_TIMEOUT = 2.0  # Seconds a connection waits for outstanding replies before closing
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else 0.0
+
+
+class Connection:
+    """One captured connection: when it opened and closed, and what it sent."""
+
+    def __init__(self, path, subprotocol, opened):
+        self.path = path
+        self.subprotocol = subprotocol
+        self.opened = opened
+        self.closed = None
+        self.messages = []  # [time, frame, message type, reply type or None]
+
+
+def message_type(frame, codec):
+    try:
+        message = frame if isinstance(frame, dict) else codec.decode(frame)
+        return message.get('type') if isinstance(message, dict) else None
+    except Exception:
+        return None  # e.g. msgpack frames without msgpack installed
+
+
+def load(path):
+    """Connections in a capture, its duration and the final state it recorded."""
+    connections = {}
+    state = None
+    end = 0.0
+    for t, conn, kind, data in read_capture(path):
+        end = t
+        connection = connections.get(conn)
+        if kind == 'open':
+            connections[conn] = Connection(data['path'], data.get('subprotocol'), t)
+        elif kind == 'state':
+            state = data
+        elif connection is None:
+            continue  # Opened before the capture started
+        elif kind == 'in':
+            codec = codec_for(connection.subprotocol)
+            connection.messages.append([t, data, message_type(data, codec), None])
+        elif kind == 'out':
+            last = connection.messages[-1] if connection.messages else None
+            if last is not None and last[3] is None:
+                last[3] = message_type(data, codec_for(connection.subprotocol)) or False
+        elif kind == 'close':
+            connection.closed = t
+    for connection in connections.values():
+        for message in connection.messages:
+            message[3] = message[3] or None
+    start = min((c.opened for c in connections.values()), default=0.0)
+    return connections, start, end, state
+
+
+class Stats:
+    def __init__(self):
+        self.sent = {}  # Message type -> count
+        self.latencies = {}  # Message type -> [seconds]
+        self.unanswered = {}  # Message type -> count
+        self.received = 0
+        self.bytes = 0
+
+    def count(self, table, msg_type, amount=1):
+        table[msg_type] = table.get(msg_type, 0) + amount
+
+
+async def replay_connection(connection, url, started, origin, speed, stats):
+    def at(t):
+        return started + (t - origin) / speed
+
+    await asyncio.sleep(max(0.0, at(connection.opened) - time.perf_counter()))
+    subprotocols = [connection.subprotocol] if connection.subprotocol else None
+    websocket = await websockets.connect(url + connection.path, subprotocols=subprotocols, max_size=None)
+    codec = codec_for(connection.subprotocol)
+    pending = deque()  # (reply type, sent at, message type)
+    answered = asyncio.Event()
+
+    async def read():
+        try:
+            async for frame in websocket:
+                arrival = time.perf_counter()
+                stats.received += 1
+                stats.bytes += len(frame)
+                reply = message_type(frame, codec)
+                for item in pending:
+                    if item[0] == reply:
+                        pending.remove(item)
+                        stats.latencies.setdefault(item[2], []).append(arrival - item[1])
+                        break
+                if not pending:
+                    answered.set()
+        except websockets.ConnectionClosed:
+            pass
+
+    reader = asyncio.create_task(read())
+    try:
+        for t, frame, msg_type, reply in connection.messages:
+            await asyncio.sleep(max(0.0, at(t) - time.perf_counter()))
+            data = json.dumps(frame) if isinstance(frame, dict) else frame
+            stats.bytes += len(data)
+            stats.count(stats.sent, msg_type or 'unknown')
+            if reply is not None:
+                answered.clear()
+                pending.append((reply, time.perf_counter(), msg_type or 'unknown'))
+            await websocket.send(data)
+        if connection.closed is not None:
+            await asyncio.sleep(max(0.0, at(connection.closed) - time.perf_counter()))
+        if pending:
+            try:
+                await asyncio.wait_for(answered.wait(), REPLY_TIMEOUT)
+            except asyncio.TimeoutError:
+                pass
+        for _, _, msg_type in pending:
+            stats.count(stats.unanswered, msg_type)
+    finally:
+        await websocket.close()
+        await reader
+
+
+async def session_state(url, session):
+    """A session's widgets and styles, as get_all shows them."""
+    path = '/' if session == DEFAULT_SESSION else f'/{session}'
+    async with websockets.connect(url + path, max_size=None) as websocket:
+        await websocket.send(json.dumps({'type': 'get_all'}))
+        widgets = None
+        async for frame in websocket:
+            message = json.loads(frame)
+            if message['type'] == 'widgets':
+                widgets = message['data']
+            elif message['type'] == 'styles' and widgets is not None:
+                return {'widgets': widgets, 'styles': message['data']}
+
+
+def diff_states(expected, actual, limit=5):
+    """Lines describing how actual differs from expected, per session."""
+    lines = []
+    for session in sorted(expected):
+        want, got = expected[session], actual.get(session) or {'widgets': {}, 'styles': {}}
+        for label, ids in (
+            ('missing', sorted(want['widgets'].keys() - got['widgets'].keys())),
+            ('extra', sorted(got['widgets'].keys() - want['widgets'].keys())),
+            ('different', sorted(i for i in want['widgets'].keys() & got['widgets'].keys()
+                                 if want['widgets'][i] != got['widgets'][i])),
+        ):
+            if ids:
+                shown = ', '.join(ids[:limit]) + (', ...' if len(ids) > limit else '')
+                lines.append(f"{session}: {len(ids)} {label} widgets: {shown}")
+        if want['styles'] != got['styles']:
+            lines.append(f"{session}: styles differ")
+    return lines
+
+
+async def run(args, connections, origin, expected):
+    server = None
+    url = args.url
+    if url is None:
+        config_server.sessions.clear()
+        config_server.sessions[config_server.DEFAULT_SESSION] = config_server.default_session
+        config_server.store.clear()
+        server = await websockets.serve(
+            config_server.handle_websocket, '127.0.0.1', 0,
+            process_request=config_server.process_request,
+            select_subprotocol=select_subprotocol,
+            compression=None,
+            extensions=deflate_extensions(config_server.DEFLATE_WINDOW_BITS),
+            max_size=None,
+        )
+        url = f'ws://127.0.0.1:{server.sockets[0].getsockname()[1]}'
+    url = url.rstrip('/')
+    stats = Stats()
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*(replay_connection(c, url, started, origin, args.speed, stats)
+                               for c in connections.values()))
+        elapsed = time.perf_counter() - started
+        actual = {session: await session_state(url, session) for session in (expected or {})}
+    finally:
+        if server is not None:
+            server.close()
+            await server.wait_closed()
+    return stats, elapsed, actual
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('capture', type=Path, help='capture file written by config_server.py --capture')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay speed, 1 to 100 (default: %(default)s)')
+    parser.add_argument('--url', help='replay against this server instead of one started in-process')
+    args = parser.parse_args(argv)
+    if not 1 <= args.speed <= 100:
+        parser.error('--speed must be between 1 and 100')
+
+    connections, origin, end, expected = load(args.capture)
+    messages = sum(len(c.messages) for c in connections.values())
+    print(f"{len(connections)} connections, {messages} messages over {end - origin:.1f}s, "
+          f"replayed at {args.speed:g}x")
+    stats, elapsed, actual = asyncio.run(run(args, connections, origin, expected))
+
+    header = f"{'type':<18}{'sent':>8}{'per sec':>10}{'p50 ms':>9}{'p99 ms':>9}{'no reply':>10}"
+    print(header)
+    print('-' * len(header))
+    for msg_type in sorted(stats.sent, key=stats.sent.get, reverse=True):
+        latencies = stats.latencies.get(msg_type, [])
+        p50 = f"{percentile(latencies, 50) * 1000:.1f}" if latencies else '-'
+        p99 = f"{percentile(latencies, 99) * 1000:.1f}" if latencies else '-'
+        print(f"{msg_type:<18}{stats.sent[msg_type]:>8}{stats.sent[msg_type] / elapsed:>10.0f}"
+              f"{p50:>9}{p99:>9}{stats.unanswered.get(msg_type, 0):>10}")
+    print(f"\n{elapsed:.1f}s (captured {(end - origin) / args.speed:.1f}s at this speed), "
+          f"{stats.received} messages received, {stats.bytes / 1024:.0f} KiB both ways")
+
+    if expected is None:
+        print("The capture has no final state (was the server stopped cleanly?); nothing to diff")
+        return 0
+    lines = diff_states(expected, actual)
+    if lines:
+        print("\nFinal state differs from the capture:")
+        print('\n'.join(lines))
+        return 1
+    print(f"Final state matches the capture ({len(expected)} sessions)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
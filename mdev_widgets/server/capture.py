@@ -0,0 +1,143 @@
+"""
+Traffic capture: every message in and out of the server, for replay.
+
+With `--capture FILE` the server appends one JSON array per line:
+
+  [t, conn, "start", {"time": unix time}]            a server process started capturing
+  [t, conn, "open", {"path": ..., "subprotocol": ...}]
+  [t, conn, "in", message]                            received from the client
+  [t, conn, "out", message]                           sent to the client
+  [t, conn, "close"]
+  [t, 0, "state", {session: {"widgets": ..., "styles": ...}}]   written on shutdown
+
+t is seconds since the capture started and conn the connection's client
+id. Text frames are stored as the JSON they carry, spliced in without
+re-encoding; binary frames (msgpack) become "in_bin"/"out_bin" events with
+the frame in base64. Lines are buffered and written by a background task,
+like the journal, but without fsync: a capture is for load testing, not
+durability. A FILE ending in .gz is gzip-compressed. Restarts append to
+the same file, each after a new "start" event.
+"""
+
+import asyncio
+import base64
+import gzip
+import json
+import time
+
+
+def frame_json(frame):
+    """A text frame as a JSON value that fits on one line, or None if it isn't valid JSON."""
+    if '\n' in frame or '\r' in frame:
+        # Only whitespace between tokens can contain raw line breaks
+        try:
+            return json.dumps(json.loads(frame), separators=(',', ':'))
+        except ValueError:
+            return None
+    return frame
+
+
+class Capture:
+    """Append-only traffic capture file, written off the event loop."""
+
+    def __init__(self, path, flush_interval=0.2):
+        self.path = str(path)
+        self.flush_interval = flush_interval
+        self.events = 0
+        self.started = time.monotonic()
+        self._buffer = []
+        self._file = None
+        self._wakeup = None
+        self._task = None
+        self._closing = False
+
+    def start(self):
+        self._file = gzip.open(self.path, 'ab') if self.path.endswith('.gz') else open(self.path, 'ab')
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        self.record(0, 'start', {'time': time.time()})
+
+    def record(self, conn, kind, data=None):
+        """Queue an event; data is JSON-able."""
+        t = round(time.monotonic() - self.started, 6)
+        if data is None:
+            line = f'[{t},{conn},"{kind}"]'
+        else:
+            line = f'[{t},{conn},"{kind}",{json.dumps(data, separators=(",", ":"))}]'
+        self._append(line)
+
+    def frame(self, conn, direction, frame):
+        """Queue a frame received ('in') or sent ('out') on a connection."""
+        t = round(time.monotonic() - self.started, 6)
+        if isinstance(frame, str):
+            encoded = frame_json(frame)
+            if encoded is not None:
+                self._append(f'[{t},{conn},"{direction}",{encoded}]')
+                return
+            frame = frame.encode()  # Not JSON; kept verbatim
+        self._append(f'[{t},{conn},"{direction}_bin","{base64.b64encode(frame).decode()}"]')
+
+    def _append(self, line):
+        self.events += 1
+        self._buffer.append(line)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def close(self):
+        """Write everything buffered and close the file."""
+        if self._task is None:
+            return
+        self._closing = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        await asyncio.to_thread(self._file.close)
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if not self._closing:
+                await asyncio.sleep(self.flush_interval)  # Write in batches
+            lines, self._buffer = self._buffer, []
+            if lines:
+                await asyncio.to_thread(self._write_lines, self._file, lines)
+            if self._closing and not self._buffer:
+                return
+
+    @staticmethod
+    def _write_lines(f, lines):
+        f.write(('\n'.join(lines) + '\n').encode())
+        f.flush()
+
+
+def read_capture(path):
+    """Yield (t, conn, kind, data) events from a capture file.
+
+    Times continue across restarts, connection ids are made unique across
+    them ('<run>:<id>'), and binary frames are decoded to bytes with their
+    kind back to 'in'/'out'. A torn last line is ignored.
+    """
+    path = str(path)
+    opener = gzip.open if path.endswith('.gz') else open
+    run = 0
+    offset = last = 0.0
+    with opener(path, 'rb') as f:
+        try:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    break  # Torn write at the end
+                t, conn, kind = event[:3]
+                data = event[3] if len(event) > 3 else None
+                if kind == 'start':
+                    run += 1
+                    offset = last
+                    continue
+                if kind.endswith('_bin'):
+                    kind, data = kind[:-4], base64.b64decode(data)
+                last = offset + t
+                yield last, f'{run}:{conn}', kind, data
+        except EOFError:
+            pass  # gzip stream cut off by a crash
@@ -0,0 +1,236 @@
+"""
+Per-client outbound queues.
+
+Every connected client gets a bounded queue drained by its own writer task,
+so a slow or half-dead client never blocks the handler of the client that
+triggered a broadcast. When a queue is full an overflow policy applies:
+
+  resync     - drop everything queued and send a fresh snapshot instead
+  coalesce   - merge queued patches (last write per field wins); falls back
+               to resync if the queue is still full afterwards
+  disconnect - close the connection; the client reconnects and resyncs
+"""
+
+import asyncio
+from collections import deque
+import logging
+import time
+
+from websockets.exceptions import ConnectionClosed
+
+from codec import JSON
+
+POLICIES = ('resync', 'coalesce', 'disconnect')
+
+log = logging.getLogger('mdev_widgets')
+
+
+def coalesce_patches(patches):
+    """Merge consecutive patch messages into one equivalent patch.
+
+    Ops on different widgets commute, so only the last op per field is kept:
+    upsert/removed supersede every earlier op for that widget, cleared
+    supersedes everything. A schema_changed op is kept once per widget type,
+    at the place of the last one, so it still follows the upserts it
+    applies to and precedes those already carrying its schemaRef.
+    """
+    merged = {}
+    keys_by_id = {}
+    for patch in patches:
+        for op in patch['ops']:
+            kind = op['op']
+            if kind == 'cleared':
+                merged.clear()
+                keys_by_id.clear()
+                merged[('cleared',)] = op
+                continue
+            if kind == 'schema_changed':
+                key = ('schema', op['type'])
+                merged.pop(key, None)
+                merged[key] = op
+                continue
+            widget_id = op['widget']['id'] if kind == 'upsert' else op['id']
+            if kind in ('upsert', 'removed'):
+                for key in keys_by_id.pop(widget_id, ()):
+                    merged.pop(key, None)
+                key = ('widget', widget_id)
+            elif kind == 'prop_changed':
+                key = ('prop', widget_id, op['key'])
+            else:
+                key = (kind, widget_id)
+            merged.pop(key, None)
+            merged[key] = op
+            keys_by_id.setdefault(widget_id, set()).add(key)
+
+    first = patches[0]
+    patch = {
+        'type': 'patch',
+        'base_version': first.get('base_version', first['version'] - 1),
+        'version': patches[-1]['version'],
+        'ops': list(merged.values()),
+    }
+    if 'epoch' in first:
+        patch['epoch'] = first['epoch']
+    return patch
+
+
+class ClientQueue:
+    """Bounded outbound queue for one websocket, drained by its own writer task."""
+
+    def __init__(self, websocket, maxsize=256, policy='resync', snapshot=None, codec=JSON, client_id=None,
+                 on_send=None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown queue policy: {policy}")
+        self.websocket = websocket
+        self.maxsize = maxsize
+        self.policy = policy
+        self.snapshot = snapshot  # Callable(queue) returning (message, encoded) pairs for a full resync
+        self.codec = codec  # Wire format negotiated for this connection (see codec.py)
+        self.client_id = client_id  # Label for this connection in metrics
+        self.on_send = on_send  # Callable(queue, encoded) after each send, e.g. for traffic capture
+        self.known_schemas = set()  # Schema hashes already queued for this client
+        self.dropped = 0
+        self.resyncs = 0
+        self.sent = 0
+        self.bytes_in = 0  # Counted by the message handler
+        self.bytes_out = 0
+        self.send_seconds = 0.0  # Time spent in websocket.send
+        self._items = deque()  # (message, encoded) pairs
+        self._wakeup = asyncio.Event()
+        self._resync = False
+        self._closed = False
+        self._task = None
+
+    def __len__(self):
+        return len(self._items)
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def start(self):
+        """Start the writer task."""
+        self._task = asyncio.create_task(self._writer())
+
+    def put(self, message, encoded=None):
+        """Queue a message without blocking, applying the overflow policy when full.
+
+        encoded must come from this queue's codec.
+        """
+        if self._closed:
+            return
+        if encoded is None:
+            encoded = self.codec.encode(message)
+        self._items.append((message, encoded))
+        if len(self._items) > self.maxsize:
+            self._overflow()
+        self._wakeup.set()
+
+    def _overflow(self):
+        if self.policy == 'coalesce':
+            self._coalesce()
+            if len(self._items) <= self.maxsize:
+                return
+        if self.policy == 'disconnect':
+            self.dropped += len(self._items)
+            self._items.clear()
+            self._closed = True
+            asyncio.create_task(self._close_connection())
+            return
+        # Drop and resync; dropped messages may have carried schema definitions
+        self.dropped += len(self._items)
+        self._items.clear()
+        self.known_schemas.clear()
+        self._resync = True
+
+    def _coalesce(self):
+        """Merge each run of consecutive patches and keep only the latest styles."""
+        items = []
+        run = []
+        latest_styles = None
+        for message, encoded in self._items:
+            if message.get('type') == 'patch':
+                run.append(message)
+                continue
+            if run:
+                items.append(self._merged(run))
+                run = []
+            if message.get('type') == 'styles':
+                latest_styles = len(items)
+            items.append((message, encoded))
+        if run:
+            items.append(self._merged(run))
+        self.dropped += len(self._items) - len(items)
+        self._items = deque(
+            item for i, item in enumerate(items)
+            if item[0].get('type') != 'styles' or i == latest_styles
+        )
+
+    def _merged(self, run):
+        patch = run[0] if len(run) == 1 else coalesce_patches(run)
+        return patch, self.codec.encode(patch)
+
+    async def _close_connection(self):
+        try:
+            await self.websocket.close(code=1013, reason='send queue overflow')
+        except Exception:
+            pass
+
+    async def _writer(self):
+        try:
+            while True:
+                if self._resync:
+                    self._resync = False
+                    self.resyncs += 1
+                    await self._send_snapshot()
+                    continue
+                if not self._items:
+                    if self._closed:
+                        return
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                _, encoded = self._items.popleft()
+                await self._send(encoded)
+        except ConnectionClosed:
+            self._closed = True
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.warning("Client writer failed: %s", e)
+            self._closed = True
+
+    async def _send_snapshot(self):
+        if self.snapshot is None:
+            return
+        version = None
+        for message, encoded in self.snapshot(self):
+            if message.get('type') == 'widgets':
+                version = message.get('version')
+            await self._send(encoded if encoded is not None else self.codec.encode(message))
+        # Patches queued while the snapshot was pending are already included in it
+        if version is not None:
+            self._items = deque(
+                (m, e) for m, e in self._items
+                if m.get('type') != 'patch' or m['version'] > version
+            )
+
+    async def _send(self, encoded):
+        started = time.perf_counter()
+        await self.websocket.send(encoded)
+        self.send_seconds += time.perf_counter() - started
+        self.sent += 1
+        self.bytes_out += len(encoded)
+        if self.on_send is not None:
+            self.on_send(self, encoded)
+
+    async def close(self, timeout=1.0):
+        """Stop accepting messages, give the writer a moment to drain, then stop it."""
+        self._closed = True
+        self._wakeup.set()
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            self._task.cancel()
@@ -0,0 +1,71 @@
+"""
+Wire codecs, negotiated through the WebSocket subprotocol.
+
+  mdev.json      JSON text frames; also used when a client offers no subprotocol
+  mdev.msgpack   MessagePack binary frames (needs the optional `msgpack` package)
+
+permessage-deflate is configured here too: the websockets default window
+is 4 KiB, which is smaller than a typical register storm's working set of
+ids and keys.
+"""
+
+import json
+
+from websockets.extensions.permessage_deflate import ServerPerMessageDeflateFactory
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class Codec:
+    """Encodes outbound and decodes inbound messages for one subprotocol."""
+
+    def __init__(self, name, dumps, loads, binary=False):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+        self.binary = binary
+
+    @property
+    def is_json(self):
+        """True if pre-encoded JSON (e.g. spliced snapshots) can be sent as is."""
+        return not self.binary
+
+    def encode(self, message):
+        return self.dumps(message)
+
+    def decode(self, data):
+        # Clients may always fall back to JSON text frames
+        if isinstance(data, str):
+            return json.loads(data)
+        return self.loads(data)
+
+
+JSON = Codec('mdev.json', json.dumps, json.loads)
+CODECS = {JSON.name: JSON}
+if msgpack is not None:
+    CODECS['mdev.msgpack'] = Codec('mdev.msgpack', msgpack.packb, msgpack.unpackb, binary=True)
+
+
+def codec_for(subprotocol):
+    """Codec for a negotiated subprotocol; JSON when there is none."""
+    return CODECS.get(subprotocol, JSON)
+
+
+def select_subprotocol(connection, offered):
+    """Pick the client's most preferred codec we support; no subprotocol means JSON."""
+    for subprotocol in offered:
+        if subprotocol in CODECS:
+            return subprotocol
+    return None
+
+
+def deflate_extensions(window_bits=15, mem_level=8):
+    """permessage-deflate settings for websockets.serve(extensions=...)."""
+    return [ServerPerMessageDeflateFactory(
+        server_max_window_bits=window_bits,
+        client_max_window_bits=window_bits,
+        compress_settings={'memLevel': mem_level},
+    )]
@@ -3,210 +3,1173 @@
 Widget Config Server
 
 A WebSocket server for live-editing Flutter widget configurations.
-Provides a web dashboard at http://localhost:8080 and WebSocket API at ws://localhost:8081.
+Provides a web dashboard at http://localhost:8080 and WebSocket API at ws://localhost:8081,
+both served from one asyncio event loop (optionally on a single port).
 """
 
+import argparse
 import asyncio
+import contextlib
+from collections import deque
+from http import HTTPStatus
+import itertools
 import json
-from http.server import HTTPServer, SimpleHTTPRequestHandler
+import logging
+import os
 from pathlib import Path
+import secrets
+import shutil
 import signal
+import socket
 import subprocess
 import sys
-import threading
+import tempfile
+import time
+from urllib.parse import parse_qs, urlsplit
 import websockets
+from websockets.datastructures import Headers
+from websockets.exceptions import ConnectionClosed
+from websockets.http11 import Response
 
-# Server state
-widgets = {}
-original_widgets = {}
-schemas = {}  # Widget type -> schema (from first registration)
-styles = {'colors': {}, 'sizes': {}, 'textStyles': {}, 'custom': {}}
-clients = set()
+from backplane import Broker, Sequencer, UnixBackplane
+from capture import Capture
+from client_queue import ClientQueue, POLICIES, coalesce_patches
+from codec import codec_for, deflate_extensions, select_subprotocol
+from file_watcher import FileWatcher
+from journal import Journal
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, FANOUT_BUCKETS, Registry
+from pipeline import Pipeline
+from profiler import Profiler
+from session import DEFAULT_SESSION, Session, session_from_path
+from static_asset import StaticAsset
 
-# Dashboard HTML (loaded from file)
+# Server state; the module-level names are the default session's
+sessions = {DEFAULT_SESSION: Session(DEFAULT_SESSION)}
+default_session = sessions[DEFAULT_SESSION]
+store = default_session.store
+widgets = store.widgets
+schemas = store.schemas  # Schema hash -> schema
+styles = default_session.styles
+clients = {}  # websocket -> ClientQueue, across all sessions
+client_sessions = {}  # websocket -> Session
+journal = None  # Journal when persistence is enabled
+capture = None  # Capture when traffic capture is on
+pending_ops = {}  # Session -> patch ops applied in the current pipeline tick, not yet broadcast
+tick_messages = []  # Timings of the messages applied this tick, finished once it is flushed
+tick_senders = {}  # Session -> tick_messages entries whose changes wait in its pending patch
+handled_message = None  # tick_messages entry being applied, credited with the clients it broadcasts to
+client_ids = itertools.count(1)  # Labels clients in metrics
+client_websockets = {}  # Client id -> websocket, to reply to a client's backplane records
+
+# Multi-worker mode (see backplane.py): mutations are applied in backplane order
+backplane = None  # Backplane when running as one of several workers
+WORKER_ID = str(os.getpid())
+in_flight = {}  # Client id -> [mutations published but not applied yet, reads deferred until they are]
+
+log = logging.getLogger('mdev_widgets')
+
+# Listening addresses; HTTP_PORT == WS_PORT serves everything on one port
+HTTP_HOST = ''
+HTTP_PORT = 8080
+WS_HOST = 'localhost'
+WS_PORT = 8081
+
+# Outbound queue settings (see client_queue.py for the overflow policies)
+SEND_QUEUE_SIZE = 256
+SEND_QUEUE_POLICY = 'resync'
+
+# Commands queued for the pipeline writer before connections wait for it
+PIPELINE_SIZE = 1024
+
+# Page size bounds for the query message
+QUERY_DEFAULT_LIMIT = 200
+QUERY_MAX_LIMIT = 1000
+
+# Max patches per second carrying update_prop edits, per session (0 = no limit)
+UPDATE_PROP_RATE = 30
+
+# permessage-deflate window (9-15 bits); None disables compression
+DEFLATE_WINDOW_BITS = 15
+
+# Persistence (disabled unless a journal directory is given)
+JOURNAL_DIR = None
+JOURNAL_SNAPSHOT_EVERY = 10000
+HANDOFF_PATH = None  # State file handed between reloader generations
+CAPTURE_PATH = None  # Traffic capture file (see capture.py)
+
+# Worker processes sharing the port (SO_REUSEPORT); 0 runs a single process
+WORKERS = 0
+BACKPLANE_PATH = None  # Broker socket a worker process joins
+
+# Logging threshold; per-message logs are DEBUG, connections and lifecycle INFO
+LOG_LEVEL = 'debug'
+LOG_LEVELS = {'debug': logging.DEBUG, 'info': logging.INFO, 'warning': logging.WARNING}
+
+# Messages taking longer than this to handle are logged and kept for /debug/slow; 0 disables
+SLOW_MESSAGE_MS = 100
+SLOW_LOG_SIZE = 100
+
+# Dashboard HTML (loaded from file, kept in memory until it changes on disk)
 DASHBOARD_HTML = None
 DASHBOARD_PATH = Path(__file__).parent / 'dashboard.html'
 
 
+def render_dashboard(html):
+    """Dashboard HTML pointing at the port this server accepts WebSockets on."""
+    return html.replace(
+        '<meta name="mdev-ws-port" content="8081">',
+        f'<meta name="mdev-ws-port" content="{WS_PORT}">',
+    )
+
+
+dashboard = StaticAsset(
+    DASHBOARD_PATH, 'text/html; charset=utf-8',
+    fallback='<html><body><h1>Error: dashboard.html not found</h1></body></html>',
+    transform=render_dashboard,
+)
+
+
 def load_dashboard():
-    """Load dashboard HTML from file."""
+    """Load dashboard HTML from file and precompress it."""
     global DASHBOARD_HTML
-    try:
-        DASHBOARD_HTML = DASHBOARD_PATH.read_text(encoding='utf-8')
-    except FileNotFoundError:
-        DASHBOARD_HTML = '<html><body><h1>Error: dashboard.html not found</h1></body></html>'
+    dashboard.load()
+    DASHBOARD_HTML = dashboard.text
 
 
 def is_modified(widget_id):
     """Check if widget has been modified from its original state."""
-    if widget_id not in original_widgets:
-        return False
-    orig = original_widgets[widget_id]
-    curr = widgets[widget_id]
-    return orig.get('properties') != curr.get('properties')
+    return store.is_modified(widget_id)
 
 
 def widget_with_modified_flag(widget_id):
     """Return widget data with modified flag."""
-    w = widgets[widget_id].copy()
-    w['modified'] = is_modified(widget_id)
-    return w
+    return store.widget_with_modified_flag(widget_id)
+
+
+def get_session(name):
+    """Session by name, created on first use."""
+    session = sessions.get(name)
+    if session is None:
+        session = sessions[name] = Session(name)
+        log.info("Created session: %s", name)
+    return session
+
+
+def release_session(session):
+    """Forget a session its last client left without storing anything; get_session recreates it.
+
+    Sessions holding widgets or styles are kept (and journaled), so an app
+    can reconnect to its edits.
+    """
+    if session is not default_session and session.is_unused() and sessions.get(session.name) is session:
+        del sessions[session.name]
+        log.info("Dropped empty session: %s", session.name)
+
+
+def store_schema(widget_type, schema, session=None):
+    """Store schema for a widget type; the latest registration wins.
+
+    Returns patch ops announcing the new schemaRef to widgets that were
+    already registered with an older schema.
+    """
+    session = session or default_session
+    changed = session.store.store_schema(widget_type, schema)
+    if changed is None:
+        return []
+    journal_record('schema', session=session, type=widget_type, schema=schema)
+    ref, affected = changed
+    log.debug("Registered schema for %s: %d properties (%s)", widget_type, len(schema), ref)
+    if not affected:
+        return []
+    return [{'op': 'schema_changed', 'type': widget_type, 'schemaRef': ref}]
+
+
+def message_schema_refs(message):
+    """Schema hashes referenced by a patch message."""
+    refs = set()
+    if message.get('type') == 'patch':
+        for op in message['ops']:
+            if op['op'] == 'upsert':
+                ref = op['widget'].get('schemaRef')
+            else:
+                ref = op.get('schemaRef')
+            if ref is not None:
+                refs.add(ref)
+    return refs
+
+
+def send_schema_defs(queue, refs, session=None):
+    """Queue definitions for the schemas in refs that this client hasn't seen yet."""
+    missing = refs - queue.known_schemas
+    if missing:
+        session_schemas = (session or default_session).store.schemas
+        queue.put({'type': 'schema_defs', 'data': {ref: session_schemas[ref] for ref in missing}})
+        queue.known_schemas |= missing
+
+
+def make_patch(ops, session=None):
+    """Wrap patch ops in a versioned patch message.
+
+    Op types:
+      {'op': 'upsert', 'widget': {...}}                         - widget added/replaced
+      {'op': 'removed', 'id': ...}                              - widget unregistered
+      {'op': 'prop_changed', 'id': ..., 'key': ..., 'value': ...}
+      {'op': 'modified_flag_changed', 'id': ..., 'modified': bool}
+      {'op': 'schema_changed', 'type': ..., 'schemaRef': ...}    - widgets of type use a new schema
+      {'op': 'cleared'}                                         - all widgets and schemas removed
+    """
+    session = session or default_session
+    if session.pending_props:
+        # Held property edits go out first, ahead of whatever follows them
+        ops = session.drain_props() + ops
+    session_store = session.store
+    session_store.version += 1
+    patch = {'type': 'patch', 'epoch': session_store.epoch, 'version': session_store.version, 'ops': ops}
+    session_store.log_patch(patch)
+    return patch
+
+
+def broadcast_prop(session, widget_id, key, value, was_modified, now_modified):
+    """Broadcast a property edit, at most UPDATE_PROP_RATE patches per second.
+
+    The first edit after a quiet period goes out with the current tick's
+    patch. Edits arriving sooner are held, newer values replacing older
+    ones, and sent together when the interval is up (or earlier with any
+    other patch).
+    """
+    session.queue_prop(widget_id, key, value, was_modified, now_modified)
+    interval = 1 / UPDATE_PROP_RATE if UPDATE_PROP_RATE else 0
+    wait = session.props_flushed_at + interval - time.monotonic()
+    if wait <= 0:
+        pending_ops.setdefault(session, [])
+    elif session.props_flush is None:
+        session.props_flush = asyncio.create_task(flush_props(session, wait))
+
+
+async def flush_props(session, delay):
+    """Release a session's held property edits after delay, through the pipeline."""
+    try:
+        await asyncio.sleep(delay)
+    finally:
+        session.props_flush = None
+    pipeline.submit_nowait(release_props, session)
+
+
+def release_props(session):
+    """Let a session's held property edits go out with this tick's patch."""
+    if session.pending_props:
+        pending_ops.setdefault(session, [])
+
+
+async def emit_ops(ops, session, exclude=None):
+    """Add patch ops to the session's patch for this tick.
+
+    A patch that skips its sender can't be shared with other changes, so
+    the tick's earlier ops (and held edits) go out first, then it does.
+    """
+    if exclude is None:
+        pending_ops.setdefault(session, []).extend(ops)
+        return
+    if session.pending_props:
+        pending_ops.setdefault(session, [])  # Held edits must reach the sender too
+    await flush_session(session)
+    credit_fanout(await broadcast(make_patch(ops, session), exclude=exclude, session=session))
+
+
+async def emit(message, session):
+    """Broadcast a non-patch message after the session's patch so far."""
+    await flush_session(session)
+    credit_fanout(await broadcast(message, session=session))
+
+
+def credit_fanout(recipients):
+    """Count clients reached by a broadcast of the message being applied."""
+    if handled_message is not None:
+        handled_message['fanout'] += recipients
+
+
+async def flush_session(session):
+    """Broadcast the ops a session has gathered this tick as one patch."""
+    senders = tick_senders.pop(session, ())
+    ops = pending_ops.pop(session, None)
+    if ops is None or not (ops or session.pending_props):
+        return
+    recipients = await broadcast(make_patch(ops, session), session=session)
+    for timing in senders:
+        timing['fanout'] += recipients
+
+
+async def flush_patches():
+    """End of a pipeline tick: one patch per session with changes.
+
+    The tick's messages are timed only now, so their handling time includes
+    getting their changes queued for every client.
+    """
+    flushing = time.perf_counter()
+    try:
+        with profiler.section('flush'):
+            for session in list(pending_ops):
+                await flush_session(session)
+    finally:
+        flushed = time.perf_counter()
+        for timing in tick_messages:
+            message_seconds.observe(flushed - timing['started'], timing['type'])
+            if SLOW_MESSAGE_MS and (timing['handled'] + flushed - flushing) * 1000 >= SLOW_MESSAGE_MS:
+                log_slow_message(timing, flushed - flushing)
+        tick_messages.clear()
+        tick_senders.clear()
+
+
+def catch_up_patch(since, epoch, session=None):
+    """One patch with every change after version `since`, or None if a snapshot is needed.
+
+    A snapshot is needed when the epoch differs (the state was lost, e.g.
+    after a restart without a journal) or the change log was truncated.
+    """
+    session_store = (session or default_session).store
+    if epoch != session_store.epoch or not isinstance(since, int):
+        return None
+    patches = session_store.changes_since(since)
+    if patches is None:
+        return None
+    if not patches:
+        return {'type': 'patch', 'epoch': epoch, 'base_version': since, 'version': since, 'ops': []}
+    return coalesce_patches(patches)
+
+
+def snapshot_messages(queue):
+    """Everything a client needs to rebuild its state from scratch.
+
+    Returns (message, encoded) pairs; the widgets snapshot is spliced from
+    cached per-widget JSON, so only its header is kept as a dict. Schema
+    definitions are only included for hashes the client hasn't seen.
+    Subscribed clients only get the widgets they subscribed to.
+    """
+    session = client_sessions.get(queue.websocket, default_session)
+    session_store = session.store
+    messages = []
+    missing = set(session_store.schema_refs.values()) - queue.known_schemas
+    if missing:
+        messages.append(({'type': 'schema_defs',
+                          'data': {ref: session_store.schemas[ref] for ref in missing}}, None))
+        queue.known_schemas |= missing
+    subscription = session.subscriptions.get(queue)
+    if subscription is not None:
+        subscription.version = session_store.version
+    ids = session.visible_ids(queue)
+    if queue.codec.is_json:
+        messages.append(({'type': 'widgets', 'epoch': session_store.epoch, 'version': session_store.version},
+                         session_store.snapshot_json(ids)))
+    else:
+        data = {widget_id: session_store.widget_with_modified_flag(widget_id)
+                for widget_id in (session_store.widgets if ids is None else ids)}
+        messages.append(({'type': 'widgets', 'epoch': session_store.epoch, 'version': session_store.version,
+                          'data': data}, None))
+    messages.append(({'type': 'styles', 'data': session.styles}, None))
+    return messages
+
+
+def query_result(data, session=None):
+    """Answer a `query` message with one page of matching widgets.
+
+    The first page (no cursor) also carries per-type and per-file counts so
+    a dashboard can build its filters without loading everything.
+    """
+    session_store = (session or default_session).store
+    types = data.get('types')
+    if isinstance(types, str):
+        types = [types]
+    cursor = data.get('cursor')
+    # Raised as ValueError so the client gets the usual `invalid query` error
+    if types is not None and not (isinstance(types, list) and all(isinstance(t, str) for t in types)):
+        raise ValueError('types must be a list of strings')
+    for key in ('id_contains', 'file'):
+        if data.get(key) is not None and not isinstance(data[key], str):
+            raise ValueError(f'{key} must be a string')
+    if cursor and not (isinstance(cursor, list) and len(cursor) == 2
+                       and all(isinstance(part, str) for part in cursor)):
+        raise ValueError('cursor must be a [type, id] pair')
+    limit = data.get('limit') or QUERY_DEFAULT_LIMIT
+    limit = max(1, min(int(limit), QUERY_MAX_LIMIT))
+    ids, total, cursor = session_store.query(
+        types=types,
+        id_contains=data.get('id_contains'),
+        file=data.get('file'),
+        modified=data.get('modified'),
+        limit=limit,
+        cursor=cursor,
+    )
+    result = {
+        'type': 'query_result',
+        'request_id': data.get('request_id'),
+        'epoch': session_store.epoch,
+        'version': session_store.version,
+        'total': total,
+        'cursor': cursor,
+        'widgets': {widget_id: session_store.widget_with_modified_flag(widget_id) for widget_id in ids},
+    }
+    if not data.get('cursor'):
+        result['types'], result['files'] = session_store.facets()
+    return result
+
+
+def journal_record(op, session=None, **fields):
+    """Append a mutation to the journal, if persistence is enabled."""
+    if journal is not None:
+        if session is not None and session is not default_session:
+            fields['session'] = session.name
+        journal.append({'op': op, **fields})
+
+
+def apply_record(record):
+    """Re-apply a journaled mutation during startup replay (no broadcasts)."""
+    session = get_session(record.get('session', DEFAULT_SESSION))
+    store = session.store
+    op = record['op']
+    if op == 'schema':
+        store.store_schema(record['type'], record['schema'])
+    elif op == 'register':
+        store.register(record['id'], record['type'], record['properties'])
+    elif op == 'unregister':
+        store.unregister(record['id'])
+    elif op == 'update_prop':
+        if record['id'] in store:
+            store.set_prop(record['id'], record['key'], record['value'])
+    elif op == 'reset':
+        if record['id'] in store:
+            store.reset(record['id'])
+    elif op == 'reset_all_changes':
+        store.reset_all_changes()
+    elif op == 'clear':
+        store.clear()
+    elif op == 'styles':
+        session.update_styles(record['data'])
+    elif op == 'style_upsert':
+        session.upsert_style(record['category'], record['name'], record['value'])
+    elif op == 'style_delete':
+        session.delete_style(record['category'], record['name'])
+
+
+def capture_state():
+    """Snapshot of everything the journal persists; other sessions nest under 'sessions'."""
+    def capture(session):
+        return {
+            'store': session.store.dump(),
+            'styles': {category: dict(entries) for category, entries in session.styles.items()},
+        }
+    state = capture(default_session)
+    state['sessions'] = {name: capture(session) for name, session in sessions.items()
+                         if session is not default_session}
+    return state
+
+
+def restore_state(state):
+    """Load a capture_state() snapshot."""
+    for name, session_state in [(DEFAULT_SESSION, state), *state.get('sessions', {}).items()]:
+        session = get_session(name)
+        session.store.load(session_state['store'])
+        session.styles.clear()
+        session.update_styles(session_state['styles'])
+
+
+def open_journal(directory, snapshot_every=JOURNAL_SNAPSHOT_EVERY):
+    """Restore state from the journal in directory and start journaling to it."""
+    global journal
+    started = time.perf_counter()
+    journal = Journal(directory, capture_state, snapshot_every=snapshot_every)
+    state, records = journal.load()
+    if state is not None:
+        restore_state(state)
+    for record in records:
+        apply_record(record)
+    if records:
+        for session in sessions.values():
+            # The records changed the state without new patch versions; clients resync
+            session.store.epoch = secrets.token_hex(4)
+    journal.start()
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    log.info("Restored %d widgets from %s (%d journal records) in %.0f ms",
+             len(store), directory, len(records), elapsed_ms)
+    return journal
+
+
+def save_handoff(path):
+    """Write the current state for the next server process (atomically)."""
+    path = Path(path)
+    tmp_path = path.with_name(path.name + '.tmp')
+    tmp_path.write_text(json.dumps(capture_state()), encoding='utf-8')
+    os.replace(tmp_path, path)
+
+
+def restore_handoff(path):
+    """Restore state left by the previous server process. Returns True if there was any."""
+    path = Path(path)
+    try:
+        state = json.loads(path.read_text(encoding='utf-8'))
+    except FileNotFoundError:
+        return False
+    restore_state(state)
+    path.unlink()
+    log.info("Restored %d widgets from the previous server process", len(store))
+    return True
+
+
+async def close_journal():
+    """Flush and close the journal."""
+    global journal
+    if journal is not None:
+        await journal.close()
+        journal = None
+
+
+def open_capture(path):
+    """Start capturing traffic to path."""
+    global capture
+    capture = Capture(path)
+    capture.start()
+    log.info("Capturing traffic to %s", path)
+    return capture
+
+
+async def close_capture():
+    """Record the final state clients see, for replays to diff against, and close the capture."""
+    global capture
+    if capture is not None:
+        capture.record(0, 'state', client_view())
+        await capture.close()
+        log.info("Captured %d events", capture.events)
+        capture = None
+
+
+# Metrics (see metrics.py); live state is read when /metrics is scraped
+metrics = Registry()
+message_count = metrics.counter('mdev_messages_total', 'WebSocket messages handled', ['type'])
+message_seconds = metrics.histogram('mdev_message_handling_seconds',
+                                    'Time from receiving a WebSocket message to having applied it and queued '
+                                    'its tick\'s patches for every client', ['type'])
+pipeline_batch = metrics.histogram('mdev_pipeline_batch_commands', 'Commands applied per pipeline tick',
+                                   buckets=FANOUT_BUCKETS)
+broadcast_recipients = metrics.histogram('mdev_broadcast_recipients',
+                                         'Clients a broadcast was queued for', buckets=FANOUT_BUCKETS)
+broadcast_seconds = metrics.histogram('mdev_broadcast_seconds',
+                                      'Time to encode a broadcast and queue it for every client')
+
+
+def per_session(value):
+    """Scrape-time collector of value(session) for every session."""
+    return lambda: (((name,), value(session)) for name, session in sessions.items())
+
+
+def per_client(value):
+    """Scrape-time collector of value(queue) for every connected client."""
+    return lambda: (((client_sessions[websocket].name, queue.client_id), value(queue))
+                    for websocket, queue in list(clients.items()) if websocket in client_sessions)
+
+
+for name, help, value in [
+    ('mdev_clients', 'Connected clients', lambda s: len(s.clients)),
+    ('mdev_widgets', 'Registered widgets', lambda s: len(s.store)),
+    ('mdev_modified_widgets', 'Widgets edited away from their registered values', lambda s: len(s.store.changed)),
+    ('mdev_schemas', 'Distinct widget schemas', lambda s: len(s.store.schemas)),
+    ('mdev_style_tokens', 'Style tokens across categories', lambda s: len(s.store.style_tokens)),
+    ('mdev_change_log_patches', 'Patches kept for get_changes', lambda s: len(s.store.change_log)),
+    ('mdev_version', 'Current patch version', lambda s: s.store.version),
+]:
+    metrics.collected(name, help, labels=['session'], collect=per_session(value))
+
+for name, help, kind, value in [
+    ('mdev_client_queue_depth', 'Messages waiting in a client\'s send queue', 'gauge', len),
+    ('mdev_client_received_bytes_total', 'Bytes received from a client', 'counter', lambda q: q.bytes_in),
+    ('mdev_client_sent_bytes_total', 'Bytes sent to a client', 'counter', lambda q: q.bytes_out),
+    ('mdev_client_sent_messages_total', 'Messages sent to a client', 'counter', lambda q: q.sent),
+    ('mdev_client_send_seconds_total', 'Time spent sending to a client', 'counter', lambda q: q.send_seconds),
+    ('mdev_client_dropped_messages_total', 'Messages dropped by the overflow policy', 'counter',
+     lambda q: q.dropped),
+    ('mdev_client_resyncs_total', 'Snapshots sent after a queue overflow', 'counter', lambda q: q.resyncs),
+]:
+    metrics.collected(name, help, kind, ['session', 'client'], per_client(value))
+
+metrics.collected('mdev_pipeline_backlog', 'Commands waiting for the pipeline writer',
+                  collect=lambda: [((), len(pipeline))])
+
+# Switched on and off through /debug/profile (see profiler.py)
+profiler = Profiler()
+slow_messages = deque(maxlen=SLOW_LOG_SIZE)  # Most recent messages over SLOW_MESSAGE_MS
+
+# Every mutation is applied by this one writer, in order (see pipeline.py)
+pipeline = Pipeline(flush=flush_patches, maxsize=PIPELINE_SIZE, on_batch=pipeline_batch.observe)
+
+
+def add_client(websocket, session=None):
+    """Register a client in a session and start its writer task."""
+    session = session or default_session
+    queue = ClientQueue(websocket, maxsize=SEND_QUEUE_SIZE, policy=SEND_QUEUE_POLICY,
+                        snapshot=snapshot_messages,
+                        codec=codec_for(getattr(websocket, 'subprotocol', None)),
+                        client_id=next(client_ids),
+                        on_send=capture_sent if capture is not None else None)
+    clients[websocket] = queue
+    client_sessions[websocket] = session
+    client_websockets[queue.client_id] = websocket
+    session.add_client(websocket, queue)
+    queue.start()
+    return queue
+
+
+def move_client(websocket, session):
+    """Move a connected client to another session."""
+    old = client_sessions.get(websocket)
+    if old is not None:
+        old.remove_client(websocket)
+    client_sessions[websocket] = session
+    session.add_client(websocket, clients[websocket])
+    if old is not None and old is not session:
+        release_session(old)
+
+
+def detach_client(websocket):
+    """Unregister a client. Returns its queue (still to be closed), or None."""
+    queue = clients.pop(websocket, None)
+    session = client_sessions.pop(websocket, None)
+    if session is not None:
+        session.remove_client(websocket)
+        release_session(session)
+    if queue is not None:
+        client_websockets.pop(queue.client_id, None)
+        in_flight.pop(queue.client_id, None)
+    return queue
+
+
+async def remove_client(websocket):
+    """Unregister a client and stop its writer task."""
+    queue = detach_client(websocket)
+    if queue is not None:
+        await queue.close()
+
+
+MESSAGE_TYPES = frozenset({
+    'hello', 'subscribe', 'register', 'register_batch', 'unregister', 'get_all', 'get_changes',
+    'query', 'get_styles', 'styles', 'style_upsert', 'style_delete', 'update_prop', 'reset',
+    'reset_all_changes', 'reset_all',
+})
+READS = frozenset({'subscribe', 'get_all', 'get_changes', 'query', 'get_styles'})
+MUTATIONS = frozenset({
+    'register', 'register_batch', 'unregister', 'styles', 'style_upsert', 'style_delete',
+    'update_prop', 'reset', 'reset_all_changes', 'reset_all',
+})
 
 
 async def handle_websocket(websocket):
-    """Handle WebSocket connections from Flutter app and dashboard."""
-    clients.add(websocket)
-    print(f"Client connected. Total clients: {len(clients)}")
+    """Handle WebSocket connections from Flutter app and dashboard.
+
+    The connect path picks the session (e.g. ws://localhost:8081/ios);
+    a `hello` message can switch it later.
+    """
+    request = getattr(websocket, 'request', None)
+    path = request.path if request else '/'
+    session = get_session(session_from_path(path))
+    client = add_client(websocket, session)
+    log.info("Client connected to %s. Total clients: %d", session.name, len(clients))
+    if capture is not None:
+        capture.record(client.client_id, 'open',
+                       {'path': path, 'subprotocol': getattr(websocket, 'subprotocol', None)})
 
     try:
         async for message in websocket:
-            data = json.loads(message)
-            msg_type = data.get('type')
-
-            if msg_type == 'register':
-                widget_id = data['id']
-                widget_type = data.get('widgetType', 'unknown')
-                widget_data = {
-                    'id': widget_id,
-                    'type': widget_type,
-                    'properties': data.get('properties', {}),
-                }
-
-                # Store schema if provided (first registration for this type wins)
-                if 'schema' in data and widget_type not in schemas:
-                    schemas[widget_type] = data['schema']
-                    print(f"Registered schema for {widget_type}: {len(data['schema'])} properties")
-
-                # Include schema in widget data for dashboard
-                if widget_type in schemas:
-                    widget_data['schema'] = schemas[widget_type]
-
-                widgets[widget_id] = widget_data
-                original_widgets[widget_id] = {
-                    'id': widget_id,
-                    'type': widget_data['type'],
-                    'properties': dict(widget_data['properties']),
-                }
-                print(f"Registered widget: {widget_id} ({widget_data['type']})")
-                await broadcast({'type': 'update', 'data': widget_with_modified_flag(widget_id)})
-
-            elif msg_type == 'unregister':
-                widget_id = data['id']
-                if widget_id in widgets:
-                    del widgets[widget_id]
-                    if widget_id in original_widgets:
-                        del original_widgets[widget_id]
-                    print(f"Unregistered widget: {widget_id}")
-                    all_widgets = {wid: widget_with_modified_flag(wid) for wid in widgets}
-                    await broadcast({'type': 'widgets', 'data': all_widgets})
+            started = time.perf_counter()
+            client.bytes_in += len(message)
+            data = client.codec.decode(message)
+            if capture is not None:
+                capture.frame(client.client_id, 'in', message)
+            await pipeline.submit(apply_message, websocket, data, started, len(message))
+    except ConnectionClosed:
+        pass
+    finally:
+        # Commands still queued from this client are applied before it goes
+        queue = await pipeline.call(leave, websocket)
+        if queue is not None:
+            await queue.close()
+        if capture is not None:
+            capture.record(client.client_id, 'close')
+        log.info("Client disconnected. Total clients: %d", len(clients))
+
+
+def capture_sent(queue, encoded):
+    if capture is not None:
+        capture.frame(queue.client_id, 'out', encoded)
+
+
+def client_view():
+    """Every session's widgets as a snapshot shows them, and its styles."""
+    return {
+        name: {
+            'widgets': {widget_id: session.store.widget_with_modified_flag(widget_id)
+                        for widget_id in session.store.widgets},
+            'styles': session.styles,
+        }
+        for name, session in sessions.items()
+    }
+
+
+def valid_registration(entry):
+    """True if a register message or register_batch entry can be stored."""
+    return (isinstance(entry, dict) and isinstance(entry.get('id'), str)
+            and isinstance(entry.get('widgetType', 'unknown'), str)
+            and isinstance(entry.get('properties', {}), dict))
+
+
+def valid_schema(schema):
+    """True if a schema has a shape store_schema() can hash and store."""
+    return isinstance(schema, (list, dict))
+
+
+async def leave(websocket):
+    """Detach a disconnecting client once it has been sent this tick's changes."""
+    session = client_sessions.get(websocket)
+    if session is not None:
+        await flush_session(session)
+    return detach_client(websocket)
+
+
+async def apply_message(websocket, data, started, size=0):
+    """Apply one client message on the pipeline writer.
+
+    Mutations go through apply_mutation, or with a backplane are published
+    to be applied in the order shared by all workers (see apply_sequenced).
+    """
+    global handled_message
+    client = clients.get(websocket)
+    session = client_sessions.get(websocket)
+    if client is None or session is None:
+        return
+    msg_type = data.get('type')
+    label = msg_type if msg_type in MESSAGE_TYPES else 'unknown'  # Keeps label cardinality bounded
+    styles = session.styles
+    if msg_type in READS:
+        waiting = in_flight.get(client.client_id)
+        if waiting is not None:
+            waiting[1].append((data, started, size))  # Answered once the client's mutations are applied
+            return
+        await flush_session(session)  # Replies reflect every change applied before them
+
+    # Replies only go to the sender; changes count the clients they are queued for
+    timing = {'type': label, 'bytes': size, 'client': client, 'started': started,
+              'fanout': 0 if msg_type in MUTATIONS else 1}
+    handling = time.perf_counter()
+    outer, handled_message = handled_message, timing
+    try:
+        with profiler.section(label):
+            if msg_type in MUTATIONS:
+                if backplane is None:
+                    await apply_mutation(session, data, websocket)
+                else:
+                    in_flight.setdefault(client.client_id, [0, []])[0] += 1
+                    await backplane.publish({'worker': WORKER_ID, 'client': client.client_id,
+                                             'session': session.name, 'message': data})
+
+            elif msg_type == 'hello':
+                session = get_session(data.get('session') or DEFAULT_SESSION)
+                move_client(websocket, session)
+                client.put({'type': 'session', 'name': session.name})
+
+            elif msg_type == 'subscribe':
+                types, ids = data.get('types') or [], data.get('ids') or []
+                session.subscribe(client, types, ids)
+                # Start the client over from the subscribed view
+                for message, encoded in snapshot_messages(client):
+                    client.put(message, encoded)
 
             elif msg_type == 'get_all':
-                all_widgets = {wid: widget_with_modified_flag(wid) for wid in widgets}
-                await websocket.send(json.dumps({'type': 'widgets', 'data': all_widgets}))
-                await websocket.send(json.dumps({'type': 'styles', 'data': styles}))
-                await websocket.send(json.dumps({'type': 'schemas', 'data': schemas}))
-
-            elif msg_type == 'styles':
-                styles.update(data.get('data', {}))
-                print(f"Updated styles: {list(styles.keys())}")
-                await broadcast({'type': 'styles', 'data': styles})
-
-            elif msg_type == 'update_prop':
-                widget_id = data['id']
-                if widget_id in widgets:
-                    key = data['key']
-                    value = data['value']
-                    widgets[widget_id]['properties'][key] = value
-                    print(f"Updated widget {widget_id}: {key} = {value}")
-                    await broadcast({'type': 'update', 'data': widget_with_modified_flag(widget_id)})
-
-            elif msg_type == 'reset':
-                widget_id = data['id']
-                if widget_id in widgets and widget_id in original_widgets:
-                    widget_type = original_widgets[widget_id]['type']
-                    widgets[widget_id] = {
-                        'id': widget_id,
-                        'type': widget_type,
-                        'properties': dict(original_widgets[widget_id]['properties']),
-                    }
-                    # Re-add schema if available
-                    if widget_type in schemas:
-                        widgets[widget_id]['schema'] = schemas[widget_type]
-                    print(f"Reset widget: {widget_id}")
-                    await broadcast({'type': 'update', 'data': widget_with_modified_flag(widget_id)})
-
-            elif msg_type == 'reset_all_changes':
-                for widget_id in list(widgets.keys()):
-                    if widget_id in original_widgets:
-                        widget_type = original_widgets[widget_id]['type']
-                        widgets[widget_id] = {
-                            'id': widget_id,
-                            'type': widget_type,
-                            'properties': dict(original_widgets[widget_id]['properties']),
-                        }
-                        if widget_type in schemas:
-                            widgets[widget_id]['schema'] = schemas[widget_type]
-                print("Reset all widgets to original values")
-                all_widgets = {wid: widget_with_modified_flag(wid) for wid in widgets}
-                await broadcast({'type': 'widgets', 'data': all_widgets})
-
-            elif msg_type == 'reset_all':
-                widgets.clear()
-                original_widgets.clear()
-                schemas.clear()
-                print("Cleared all widgets and schemas")
-                await broadcast({'type': 'widgets', 'data': {}})
-                await broadcast({'type': 'schemas', 'data': {}})
-
-    except websockets.exceptions.ConnectionClosed:
-        pass
+                for message, encoded in snapshot_messages(client):
+                    client.put(message, encoded)
+
+            elif msg_type == 'get_changes':
+                # Reconnect: only what was missed since the client's last version
+                patch = None
+                if client not in session.subscriptions:
+                    patch = catch_up_patch(data.get('since'), data.get('epoch'), session)
+                if patch is None:
+                    for message, encoded in snapshot_messages(client):
+                        client.put(message, encoded)
+                else:
+                    send_schema_defs(client, message_schema_refs(patch), session)
+                    client.put(patch)
+                    client.put({'type': 'styles', 'data': styles})
+
+            elif msg_type == 'query':
+                try:
+                    result = query_result(data, session)
+                except (TypeError, ValueError):
+                    client.put({'type': 'error', 'error': 'invalid query',
+                                'request_id': data.get('request_id')})
+                    return
+                refs = {w['schemaRef'] for w in result['widgets'].values() if 'schemaRef' in w}
+                send_schema_defs(client, refs, session)
+                client.put(result)
+
+            elif msg_type == 'get_styles':
+                client.put({'type': 'styles', 'data': styles})
     finally:
-        clients.discard(websocket)
-        print(f"Client disconnected. Total clients: {len(clients)}")
+        handled_message = outer
+        timing['queued'] = handling - started
+        timing['handled'] = time.perf_counter() - handling
+        timing['session'] = session = client_sessions.get(websocket, session)
+        if msg_type in MUTATIONS and session in pending_ops:
+            tick_senders.setdefault(session, []).append(timing)  # Reaches clients with the tick's patch
+        message_count.inc(label)
+        tick_messages.append(timing)
+
+
+def log_slow_message(timing, flushed):
+    """Log a message that took longer than SLOW_MESSAGE_MS to handle and flush.
 
+    Fan-out is how many clients its changes were queued for on this worker,
+    or 1 for a reply to the sender alone. flushed is the time taken by the
+    end-of-tick flush that sent its changes out.
+    """
+    entry = {
+        'type': timing['type'],
+        'bytes': timing['bytes'],
+        'fanout': timing['fanout'],
+        'handling_ms': round(timing['handled'] * 1000, 3),
+        'flush_ms': round(flushed * 1000, 3),
+        'queued_ms': round(timing['queued'] * 1000, 3),
+        'session': timing['session'].name,
+        'client': timing['client'].client_id,
+        'time': time.time(),
+    }
+    slow_messages.append(entry)
+    log.warning("Slow %s message: %.1f ms + %.1f ms flush (%d bytes, fan-out %d, queued %.1f ms)",
+                entry['type'], entry['handling_ms'], entry['flush_ms'], entry['bytes'], entry['fanout'],
+                entry['queued_ms'])
 
-async def broadcast(message):
-    """Broadcast message to all connected clients."""
-    if clients:
-        msg = json.dumps(message)
-        await asyncio.gather(*[client.send(msg) for client in clients])
 
+async def apply_mutation(session, data, websocket=None):
+    """Apply a mutation to a session; acks and errors go to websocket, if it is connected here."""
+    client = clients.get(websocket)
+    msg_type = data.get('type')
+    store, styles = session.store, session.styles
 
-class ConfigHTTPHandler(SimpleHTTPRequestHandler):
-    """HTTP handler for serving the dashboard."""
+    def reply(message):
+        if client is not None:
+            client.put(message)
 
-    def do_GET(self):
-        if self.path == '/' or self.path == '/index.html':
-            # Reload dashboard on each request (for development)
-            load_dashboard()
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-            self.wfile.write(DASHBOARD_HTML.encode())
+    if msg_type == 'register':
+        if not valid_registration(data) or ('schema' in data and not valid_schema(data['schema'])):
+            reply({'type': 'error', 'error': 'invalid register'})
+            return
+        widget_id = data['id']
+        widget_type = data.get('widgetType', 'unknown')
+        ops = store_schema(widget_type, data['schema'], session) if 'schema' in data else []
+        widget_ops = store.register(widget_id, widget_type, data.get('properties', {}),
+                                    data.get('hash'))
+        if widget_ops is not None:
+            journal_record('register', session=session, id=widget_id, type=widget_type,
+                           properties=data.get('properties', {}))
+            log.debug("Registered widget: %s (%s)", widget_id, widget_type)
+            ops.extend(widget_ops)
+        if 'hash' in data:
+            reply({'type': 'register_ack', 'registered': 1,
+                   'unchanged': int(widget_ops is None)})
+        if ops:
+            await emit_ops(ops, session)
+
+    elif msg_type == 'register_batch':
+        widgets, schemas = data.get('widgets', []), data.get('schemas', {})
+        # Everything is checked before anything is stored, so a malformed batch changes nothing
+        if (not isinstance(widgets, list) or not all(valid_registration(entry) for entry in widgets)
+                or not isinstance(schemas, dict)
+                or not all(isinstance(t, str) and valid_schema(schema) for t, schema in schemas.items())):
+            reply({'type': 'error', 'error': 'invalid register_batch'})
+            return
+        entries = [
+            (entry['id'], entry.get('widgetType', 'unknown'), entry.get('properties', {}), entry.get('hash'))
+            for entry in widgets
+        ]
+        ops = []
+        for widget_type, schema in schemas.items():
+            ops.extend(store_schema(widget_type, schema, session))
+        unchanged = 0
+        for widget_id, widget_type, properties, content_hash in entries:
+            widget_ops = store.register(widget_id, widget_type, properties, content_hash)
+            if widget_ops is None:
+                unchanged += 1
+                continue
+            journal_record('register', session=session, id=widget_id, type=widget_type,
+                           properties=properties)
+            ops.extend(widget_ops)
+        log.debug("Registered batch of %d widgets (%d unchanged)", len(entries), unchanged)
+        if any(content_hash is not None for *_, content_hash in entries):
+            reply({'type': 'register_ack', 'registered': len(entries),
+                   'unchanged': unchanged})
+        if ops:
+            await emit_ops(ops, session, exclude=websocket)
+
+    elif msg_type == 'unregister':
+        widget_id = data['id']
+        if store.unregister(widget_id):
+            journal_record('unregister', session=session, id=widget_id)
+            log.debug("Unregistered widget: %s", widget_id)
+            await emit_ops([{'op': 'removed', 'id': widget_id}], session)
+
+    elif msg_type == 'styles':
+        affected = session.update_styles(data.get('data', {}))
+        journal_record('styles', session=session, data=data.get('data', {}))
+        log.debug("Updated styles: %s", list(styles))
+        # Dashboards re-render only these cards unless a category's token names changed
+        await emit({'type': 'styles', 'data': styles, 'widgets': sorted(affected)}, session)
+
+    elif msg_type in ('style_upsert', 'style_delete'):
+        # One token instead of whole categories; clients re-render only the widgets using it
+        category, name = data.get('category'), data.get('name')
+        if not isinstance(category, str) or not isinstance(name, str):
+            reply({'type': 'error', 'error': f'invalid {msg_type}'})
+            return
+        change = {'type': 'style_changed', 'category': category, 'name': name}
+        if msg_type == 'style_upsert':
+            affected = session.upsert_style(category, name, data.get('value'))
+            journal_record('style_upsert', session=session, category=category, name=name,
+                           value=data.get('value'))
+            change['value'] = data.get('value')
         else:
-            self.send_error(404)
+            affected = session.delete_style(category, name)
+            if affected is None:
+                return
+            journal_record('style_delete', session=session, category=category, name=name)
+            change['deleted'] = True
+        change['widgets'] = sorted(affected)
+        await emit(change, session)
 
-    def log_message(self, format, *args):
-        print(f"HTTP: {args[0]}")
+    elif msg_type == 'update_prop':
+        widget_id = data['id']
+        if widget_id in store:
+            key = data['key']
+            value = data['value']
+            was_modified, now_modified = store.set_prop(widget_id, key, value)
+            journal_record('update_prop', session=session, id=widget_id, key=key, value=value)
+            # The editor sees its value at once; everyone gets it rate limited
+            reply({'type': 'prop_ack', 'id': widget_id, 'key': key, 'value': value,
+                   'modified': now_modified})
+            broadcast_prop(session, widget_id, key, value, was_modified, now_modified)
 
+    elif msg_type == 'reset':
+        widget_id = data['id']
+        if widget_id in store:
+            ops = store.reset(widget_id)
+            log.debug("Reset widget: %s", widget_id)
+            if ops:
+                journal_record('reset', session=session, id=widget_id)
+                await emit_ops(ops, session)
 
-def run_http_server(port=8080):
-    """Run HTTP server in a thread."""
-    server = HTTPServer(('', port), ConfigHTTPHandler)
-    print(f"HTTP server running at http://localhost:{port}")
-    server.serve_forever()
+    elif msg_type == 'reset_all_changes':
+        ops = store.reset_all_changes()
+        log.debug("Reset all widgets to original values")
+        if ops:
+            journal_record('reset_all_changes', session=session)
+            await emit_ops(ops, session)
 
+    elif msg_type == 'reset_all':
+        # Only clears this session; other app instances keep their widgets
+        store.clear()
+        journal_record('clear', session=session)
+        log.debug("Cleared all widgets and schemas in %s", session.name)
+        await emit_ops([{'op': 'cleared'}], session)
 
-async def main():
-    """Main entry point for the server."""
-    load_dashboard()
 
-    loop = asyncio.get_event_loop()
+async def apply_sequenced(record):
+    """Apply a mutation record in backplane order.
+
+    Every worker applies every record; only the worker its sender is
+    connected to replies, and then answers the reads that sender sent
+    after it.
+    """
+    websocket = None
+    if record.get('worker') == WORKER_ID:
+        websocket = client_websockets.get(record.get('client'))
+    msg_type = record['message'].get('type')
+    try:
+        with profiler.section(msg_type if msg_type in MESSAGE_TYPES else 'unknown'):
+            await apply_mutation(get_session(record['session']), record['message'], websocket)
+    finally:
+        if websocket is not None:
+            waiting = in_flight.get(record['client'])
+            if waiting is not None:
+                waiting[0] -= 1
+                if waiting[0] <= 0:
+                    del in_flight[record['client']]
+                    for data, started, size in waiting[1]:
+                        await apply_message(websocket, data, started, size)
+
+
+async def broadcast(message, exclude=None, session=None):
+    """Queue message for a session's clients, optionally skipping one.
+
+    Encodes once per wire format and never waits on a client; each client's writer task
+    delivers at its own pace. Subscribed clients get patches cut down to
+    the ops they subscribed to, chained by base_version. Returns how many
+    clients it was queued for.
+    """
+    started = time.perf_counter()
+    session = session or default_session
+    is_patch = message.get('type') == 'patch'
+    targets = session.everything if is_patch else session.clients.values()
+    targets = [queue for queue in targets if queue.websocket is not exclude]
+    if targets:
+        encoded = {}  # Codec -> encoded message
+        refs = message_schema_refs(message)
+        for queue in targets:
+            if refs:
+                send_schema_defs(queue, refs, session)
+            codec = queue.codec
+            if codec not in encoded:
+                encoded[codec] = codec.encode(message)
+            queue.put(message, encoded[codec])
+    recipients = len(targets)
+    if is_patch:
+        for queue, ops in session.route(message['ops']).items():
+            if queue.websocket is exclude:
+                continue
+            subscription = session.subscriptions[queue]
+            patch = {'type': 'patch', 'epoch': message.get('epoch'), 'base_version': subscription.version,
+                     'version': message['version'], 'ops': ops}
+            subscription.version = message['version']
+            send_schema_defs(queue, message_schema_refs(patch), session)
+            queue.put(patch)
+            recipients += 1
+    broadcast_recipients.observe(recipients)
+    broadcast_seconds.observe(time.perf_counter() - started)
+    return recipients
+
+
+def http_response(status, body, content_type='text/plain; charset=utf-8', headers=None):
+    """Build a plain HTTP response for process_request."""
+    if isinstance(body, str):
+        body = body.encode()
+    response_headers = Headers()
+    if status != 304:
+        response_headers['Content-Type'] = content_type
+        response_headers['Content-Length'] = str(len(body))
+    for name, value in (headers or {}).items():
+        response_headers[name] = value
+    return Response(status, HTTPStatus(status).phrase, response_headers, body)
+
+
+def serve_dashboard(request):
+    # Served from memory; re-read (and recompressed) only when the file's mtime changes
+    global DASHBOARD_HTML
+    status, body, headers = dashboard.respond(request.headers)
+    DASHBOARD_HTML = dashboard.text
+    return http_response(status, body, dashboard.content_type, headers)
+
+
+def serve_health(request):
+    # Runs on the event loop, so it can read live state without locking
+    return http_response(200, json.dumps({
+        'widgets': len(store),
+        'clients': len(clients),
+        'version': store.version,
+        **({'worker': WORKER_ID} if backplane is not None else {}),
+        'sessions': {
+            name: {'widgets': len(session.store), 'clients': len(session.clients)}
+            for name, session in sessions.items()
+        },
+    }), 'application/json')
+
+
+def serve_metrics(request):
+    return http_response(200, metrics.render(), METRICS_CONTENT_TYPE)
+
+
+def serve_profile(request):
+    """Profile the live server: ?start=sampling|deterministic (&interval_ms=N), ?stop, or the results.
+
+    Results are collapsed stacks for flamegraph tools; with ?format=pstats
+    the deterministic profile in pstats format.
+    """
+    query = parse_qs(urlsplit(request.path).query, keep_blank_values=True)
+    if 'start' in query:
+        try:
+            interval = float(query['interval_ms'][0]) / 1000 if 'interval_ms' in query else None
+            profiler.start(query['start'][0] or 'sampling', interval)
+        except ValueError as e:
+            return http_response(400, str(e))
+        log.info("Profiling started (%s)", profiler.mode)
+        return http_response(200, json.dumps(profiler.status()), 'application/json')
+    if 'stop' in query:
+        profiler.stop()
+        log.info("Profiling stopped")
+        return http_response(200, json.dumps(profiler.status()), 'application/json')
+    if query.get('format') == ['pstats']:
+        return http_response(200, profiler.pstats(), 'application/octet-stream',
+                             {'Content-Disposition': 'attachment; filename="mdev_widgets.pstats"'})
+    return http_response(200, profiler.collapsed())
+
+
+def serve_slow_messages(request):
+    """Recent slow messages; ?threshold_ms=N changes the threshold (0 turns logging off)."""
+    global SLOW_MESSAGE_MS
+    query = parse_qs(urlsplit(request.path).query)
+    if 'threshold_ms' in query:
+        try:
+            threshold = float(query['threshold_ms'][0])
+        except ValueError:
+            return http_response(400, 'threshold_ms must be a number')
+        SLOW_MESSAGE_MS = max(threshold, 0)
+    return http_response(200, json.dumps({
+        'threshold_ms': SLOW_MESSAGE_MS,
+        'messages': list(slow_messages),
+    }), 'application/json')
+
+
+HTTP_ROUTES = {
+    '/': serve_dashboard,
+    '/index.html': serve_dashboard,
+    '/health': serve_health,
+    '/metrics': serve_metrics,
+    '/debug/profile': serve_profile,
+    '/debug/slow': serve_slow_messages,
+}
+
+
+def process_request(connection, request):
+    """Answer plain HTTP requests; let WebSocket upgrades through to handle_websocket."""
+    if request.headers.get('Upgrade', '').lower() == 'websocket':
+        return None
+    path = request.path.split('?', 1)[0]
+    route = HTTP_ROUTES.get(path)
+    log.debug("HTTP: GET %s", request.path)
+    if route is None:
+        return http_response(404, 'Not Found')
+    return route(request)
+
+
+async def watch_dashboard():
+    """Hot-swap dashboard.html when it changes and tell open dashboards to reload."""
+    global DASHBOARD_HTML
+    watcher = FileWatcher([DASHBOARD_PATH])
+    announced = dashboard.etag
+    try:
+        async for _ in watcher.changes():
+            # An HTTP request may have refreshed the asset already; compare with what open dashboards have
+            dashboard.refresh()
+            DASHBOARD_HTML = dashboard.text
+            if dashboard.etag != announced:
+                announced = dashboard.etag
+                log.info(">>> %s changed, reloading dashboards", DASHBOARD_PATH.name)
+                for session in list(sessions.values()):
+                    await broadcast({'type': 'dashboard_reload'}, session=session)
+    finally:
+        watcher.close()
+
+
+def stop_on_signals():
+    """Future resolved on SIGINT or SIGTERM."""
+    loop = asyncio.get_running_loop()
     stop = loop.create_future()
 
     def handle_signal():
         if not stop.done():
-            print("\nShutting down...")
+            log.info("Shutting down...")
             stop.set_result(None)
 
     for sig in (signal.SIGINT, signal.SIGTERM):
@@ -214,22 +1177,155 @@ async def main():
             loop.add_signal_handler(sig, handle_signal)
         except NotImplementedError:
             signal.signal(sig, lambda s, f: handle_signal())
+    return stop
+
+
+async def join_backplane(plane):
+    """Start from the backplane's state and apply its records from then on."""
+    global backplane
+    state = await plane.join(lambda record: pipeline.submit_nowait(apply_sequenced, record))
+    if state is not None:
+        restore_state(state)
+    for session in sessions.values():
+        # Each worker batches records into its own patch versions, so a catch-up can't cross workers
+        session.store.epoch = secrets.token_hex(4)
+    backplane = plane
+
 
-    http_thread = threading.Thread(target=run_http_server, args=(8080,), daemon=True)
-    http_thread.start()
+async def main():
+    """Main entry point for the server.
+
+    HTTP and WebSocket traffic share one event loop: plain HTTP requests are
+    answered from process_request, so there is no HTTP thread and all state
+    is accessed from the loop. With a single port both run on HTTP_PORT.
+    With WORKERS this process runs the broker (run_broker) and each worker
+    process runs main() joined to it, sharing the port.
+    """
+    if WORKERS:
+        await run_broker()
+        return
+    load_dashboard()
+    if BACKPLANE_PATH:
+        await join_backplane(UnixBackplane(BACKPLANE_PATH))
+    elif JOURNAL_DIR:
+        open_journal(JOURNAL_DIR, JOURNAL_SNAPSHOT_EVERY)
+    elif HANDOFF_PATH:
+        restore_handoff(HANDOFF_PATH)
+    if CAPTURE_PATH:
+        open_capture(CAPTURE_PATH)
+    watch_task = asyncio.create_task(watch_dashboard())
+    pipeline.start()
+    stop = stop_on_signals()
+    if backplane is not None:
+        # Without the broker this worker's replica would silently drift
+        lost = asyncio.create_task(backplane.wait_closed())
+        lost.add_done_callback(lambda _: stop.done() or stop.set_result(None))
 
-    print("WebSocket server running at ws://localhost:8081")
-    async with websockets.serve(handle_websocket, "localhost", 8081):
+    options = dict(
+        process_request=process_request,
+        select_subprotocol=select_subprotocol,
+        compression=None,
+        extensions=deflate_extensions(DEFLATE_WINDOW_BITS) if DEFLATE_WINDOW_BITS else None,
+    )
+    if backplane is not None:
+        options['reuse_port'] = True  # The kernel spreads connections across the workers
+    async with contextlib.AsyncExitStack() as servers:
+        await servers.enter_async_context(websockets.serve(
+            handle_websocket, HTTP_HOST, HTTP_PORT, **options))
+        log.info("HTTP server running at http://localhost:%d", HTTP_PORT)
+        if WS_PORT != HTTP_PORT:
+            await servers.enter_async_context(websockets.serve(
+                handle_websocket, WS_HOST, WS_PORT, **options))
+        log.info("WebSocket server running at ws://localhost:%d", WS_PORT)
         await stop
+    watch_task.cancel()
+    await pipeline.close()
+    await close_capture()
+    if backplane is not None:
+        await backplane.close()
+    await close_journal()
+    if HANDOFF_PATH and not JOURNAL_DIR:
+        save_handoff(HANDOFF_PATH)
+
+
+def worker_command(path):
+    """Command line of a worker process joining the broker at path."""
+    command = [sys.executable, str(Path(__file__).absolute()), '--no-reload', '--join', str(path),
+               '--http-port', str(HTTP_PORT), '--ws-port', str(WS_PORT),
+               '--update-rate', str(UPDATE_PROP_RATE), '--log-level', LOG_LEVEL,
+               '--queue-size', str(SEND_QUEUE_SIZE), '--queue-policy', SEND_QUEUE_POLICY,
+               '--slow-ms', str(SLOW_MESSAGE_MS)]
+    if DEFLATE_WINDOW_BITS:
+        command += ['--deflate-window-bits', str(DEFLATE_WINDOW_BITS)]
+    else:
+        command.append('--no-compression')
+    return command
+
+
+async def run_worker(number, command, stop):
+    """Keep a worker process running until stop (restarting it if it dies)."""
+    while not stop.done():
+        process = await asyncio.create_subprocess_exec(*command)
+        try:
+            code = await process.wait()
+        except asyncio.CancelledError:
+            if process.returncode is None:
+                process.terminate()
+            await process.wait()
+            raise
+        await asyncio.sleep(1)  # Ctrl+C reaches workers too; give stop a moment before restarting
+        if not stop.done():
+            log.warning("Worker %d exited with code %s, restarting", number, code)
+
+
+async def run_broker():
+    """Run the backplane broker and WORKERS server processes joined to it.
+
+    The broker holds the authoritative replica: joining workers start from
+    its snapshot, and it is what gets journaled and handed off. It serves
+    no clients itself.
+    """
+    global UPDATE_PROP_RATE
+    if JOURNAL_DIR:
+        open_journal(JOURNAL_DIR, JOURNAL_SNAPSHOT_EVERY)
+    elif HANDOFF_PATH:
+        restore_handoff(HANDOFF_PATH)
+    socket_dir = tempfile.mkdtemp(prefix='mdev-widgets-')
+    command = worker_command(Path(socket_dir) / 'backplane.sock')
+    UPDATE_PROP_RATE = 0  # Nobody here to rate limit for
+
+    async def apply(record):
+        await apply_sequenced(record)
+        await flush_patches()
+
+    broker = Broker(Path(socket_dir) / 'backplane.sock', Sequencer(apply=apply, snapshot=capture_state))
+    await broker.start()
+    stop = stop_on_signals()
+    workers = [asyncio.create_task(run_worker(number, command, stop)) for number in range(WORKERS)]
+    log.info("Started %d workers sharing port %d", WORKERS, HTTP_PORT)
+    await stop
+    for task in workers:
+        task.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+    await broker.close()
+    await close_journal()
+    if HANDOFF_PATH and not JOURNAL_DIR:
+        save_handoff(HANDOFF_PATH)
+    shutil.rmtree(socket_dir, ignore_errors=True)
 
 
 def run_with_reload():
-    """Run server with auto-reload on file changes."""
-    script_path = Path(__file__).absolute()
-    dashboard_path = DASHBOARD_PATH
+    """Run the server in a child process and restart it when server code changes.
 
-    watch_files = [script_path, dashboard_path]
-    last_mtimes = {f: f.stat().st_mtime for f in watch_files if f.exists()}
+    dashboard.html is not watched here; the server hot-swaps it in process.
+    Across restarts the child hands its state to the next one through a
+    temp file (unless a journal already persists it), so clients reconnect
+    into the same catalog.
+    """
+    script_path = Path(__file__).absolute()
+    watcher = FileWatcher(sorted(script_path.parent.glob('*.py')))
+    handoff_dir = tempfile.mkdtemp(prefix='mdev-widgets-')
+    handoff_path = Path(handoff_dir) / 'state.json'
 
     process = None
     shutdown_requested = False
@@ -248,43 +1344,108 @@ def run_with_reload():
     signal.signal(signal.SIGTERM, handle_shutdown)
 
     while not shutdown_requested:
-        print("Starting server (auto-reload enabled)...")
-        print(f"  Watching: {', '.join(f.name for f in watch_files)}")
-        process = subprocess.Popen([sys.executable, str(script_path), '--no-reload'])
+        print(f"Starting server (auto-reload enabled, {watcher.backend})...")
+        print(f"  Watching: {', '.join(p.name for p in watcher.paths)}")
+        process = subprocess.Popen([sys.executable, str(script_path), '--no-reload',
+                                    '--handoff', str(handoff_path), *sys.argv[1:]])
 
         try:
             while process.poll() is None and not shutdown_requested:
-                for path in watch_files:
-                    if path.exists():
-                        current_mtime = path.stat().st_mtime
-                        if path not in last_mtimes or current_mtime != last_mtimes[path]:
-                            print(f"\n>>> {path.name} changed, restarting server...\n")
-                            last_mtimes[path] = current_mtime
-                            process.terminate()
-                            process.wait()
-                            break
-                else:
-                    threading.Event().wait(1)
-                    continue
-                break  # File changed, restart
+                # Time out now and then to notice the child exiting on its own
+                changed = watcher.wait(timeout=1.0)
+                if changed:
+                    names = ', '.join(sorted(p.name for p in changed))
+                    print(f"\n>>> {names} changed, restarting server...\n")
+                    process.terminate()
+                    process.wait()
+                    break  # File changed, restart
             else:
-                if shutdown_requested:
-                    break
-                break  # Process ended normally
+                break  # Process ended normally or shutdown requested
         except Exception:
             if process and process.poll() is None:
                 process.terminate()
                 process.wait()
             break
 
+    watcher.close()
+    shutil.rmtree(handoff_dir, ignore_errors=True)
     print("Server stopped.")
 
 
+def parse_args(argv=None):
+    """Parse command line options."""
+    parser = argparse.ArgumentParser(description='Widget Config Server')
+    parser.add_argument('--no-reload', action='store_true', help='run without the auto-reloader')
+    parser.add_argument('--http-port', type=int, default=HTTP_PORT, help='dashboard HTTP port')
+    parser.add_argument('--ws-port', type=int, default=WS_PORT, help='WebSocket port')
+    parser.add_argument('--single-port', action='store_true',
+                        help='serve HTTP and WebSocket on the HTTP port only')
+    parser.add_argument('--journal', metavar='DIR',
+                        help='persist widget state to a journal in DIR and restore it on start')
+    parser.add_argument('--snapshot-every', type=int, default=JOURNAL_SNAPSHOT_EVERY,
+                        help='compact the journal into a snapshot every N records')
+    parser.add_argument('--deflate-window-bits', type=int, choices=range(9, 16),
+                        default=DEFLATE_WINDOW_BITS, metavar='9-15',
+                        help='permessage-deflate window size (default: %(default)s)')
+    parser.add_argument('--no-compression', action='store_true',
+                        help='disable permessage-deflate')
+    parser.add_argument('--handoff', metavar='FILE', help=argparse.SUPPRESS)
+    parser.add_argument('--update-rate', type=float, default=UPDATE_PROP_RATE, metavar='HZ',
+                        help='max property edit broadcasts per second per session, 0 for no limit '
+                             '(default: %(default)s)')
+    parser.add_argument('--log-level', choices=LOG_LEVELS, default=LOG_LEVEL,
+                        help='debug logs every message; info only connections and lifecycle '
+                             '(default: %(default)s)')
+    parser.add_argument('--queue-size', type=int, default=SEND_QUEUE_SIZE,
+                        help='max queued outbound messages per client')
+    parser.add_argument('--queue-policy', choices=POLICIES, default=SEND_QUEUE_POLICY,
+                        help='what to do when a client queue is full')
+    parser.add_argument('--slow-ms', type=float, default=SLOW_MESSAGE_MS, metavar='MS',
+                        help='log messages taking longer than MS to handle, 0 to turn off '
+                             '(default: %(default)s)')
+    parser.add_argument('--capture', metavar='FILE',
+                        help='append every message in and out to FILE (.gz to compress), '
+                             'for benchmarks/replay.py')
+    parser.add_argument('--workers', type=int, default=WORKERS, metavar='N',
+                        help='serve from N worker processes sharing the ports, 0 for a single process '
+                             '(default: %(default)s)')
+    parser.add_argument('--join', metavar='SOCKET', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.workers and not hasattr(socket, 'SO_REUSEPORT'):
+        parser.error('--workers needs SO_REUSEPORT, which this platform lacks')
+    if args.workers and args.capture:
+        parser.error('--capture records a single process; it cannot be combined with --workers')
+    return args
+
+
 if __name__ == '__main__':
-    if '--no-reload' in sys.argv:
+    args = parse_args()
+    SEND_QUEUE_SIZE = args.queue_size
+    SEND_QUEUE_POLICY = args.queue_policy
+    UPDATE_PROP_RATE = args.update_rate
+    LOG_LEVEL = args.log_level
+    # Only our logger: at DEBUG the websockets library would log every frame
+    logging.basicConfig(level=logging.WARNING, format='%(message)s')
+    log.setLevel(LOG_LEVELS[LOG_LEVEL])
+    HTTP_PORT = args.http_port
+    JOURNAL_DIR = args.journal
+    JOURNAL_SNAPSHOT_EVERY = args.snapshot_every
+    HANDOFF_PATH = args.handoff
+    DEFLATE_WINDOW_BITS = None if args.no_compression else args.deflate_window_bits
+    SLOW_MESSAGE_MS = args.slow_ms
+    CAPTURE_PATH = args.capture
+    WORKERS = args.workers
+    BACKPLANE_PATH = args.join
+    WS_PORT = args.http_port if args.single_port else args.ws_port
+    if args.single_port:
+        WS_HOST = HTTP_HOST
+    if args.join:
+        with contextlib.suppress(KeyboardInterrupt):
+            asyncio.run(main())  # A worker; the broker process reports for it
+    elif args.no_reload:
         print("Starting Widget Config Server...")
-        print("  - Config Editor: http://localhost:8080")
-        print("  - WebSocket: ws://localhost:8081")
+        print(f"  - Config Editor: http://localhost:{HTTP_PORT}")
+        print(f"  - WebSocket: ws://localhost:{WS_PORT}")
         print("Press Ctrl+C to stop\n")
         try:
             asyncio.run(main())
@@ -0,0 +1,165 @@
+"""
+File change notification for the reloader and the dashboard hot swap.
+
+On Linux changes are delivered by inotify (via ctypes, no extra
+dependency), so a save is noticed within milliseconds instead of on the
+next poll. Elsewhere, or if inotify is unavailable, mtimes are polled.
+
+The parent directories are watched rather than the files themselves, so
+editors that save by writing a temp file and renaming it over the
+original are still seen. Events are confirmed against the file's mtime,
+so only real changes are reported.
+"""
+
+import asyncio
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from pathlib import Path
+
+IN_ATTRIB = 0x00000004  # Also covers `touch`
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, name length
+
+
+def _load_libc():
+    """libc with the inotify calls, or None if inotify is not available."""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+def _mtime(path):
+    try:
+        return path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+class FileWatcher:
+    """Reports changes to a fixed set of files."""
+
+    def __init__(self, paths, interval=1.0, settle=0.05, use_inotify=True):
+        self.paths = [Path(p).absolute() for p in paths]
+        self.interval = interval  # Poll period when inotify is not available
+        self.settle = settle  # Wait after the first event so a burst of writes reports once
+        self._path_set = set(self.paths)
+        self._mtimes = {path: _mtime(path) for path in self.paths}
+        self._fd = None
+        self._watches = {}  # Watch descriptor -> directory
+        libc = _load_libc() if use_inotify else None
+        if libc is not None:
+            self._open_inotify(libc)
+
+    @property
+    def backend(self):
+        return 'inotify' if self._fd is not None else 'poll'
+
+    def _open_inotify(self, libc):
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            return
+        for directory in {path.parent for path in self.paths}:
+            wd = libc.inotify_add_watch(fd, os.fsencode(directory), WATCH_MASK)
+            if wd < 0:
+                os.close(fd)
+                self._watches.clear()
+                return
+            self._watches[wd] = directory
+        self._fd = fd
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _read_events(self):
+        """Drain pending inotify events and return the watched paths they name."""
+        touched = set()
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return touched
+            offset = 0
+            while offset < len(data):
+                wd, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                directory = self._watches.get(wd)
+                if directory is not None:
+                    path = directory / os.fsdecode(name)
+                    if path in self._path_set:
+                        touched.add(path)
+
+    def poll(self):
+        """Return the watched paths that changed since the last call, without blocking."""
+        candidates = self._read_events() if self._fd is not None else self.paths
+        changed = set()
+        for path in candidates:
+            mtime = _mtime(path)
+            if mtime != self._mtimes[path]:
+                self._mtimes[path] = mtime
+                changed.add(path)
+        return changed
+
+    def wait(self, timeout=None):
+        """Block until a watched file changes or timeout elapses; return the changed paths."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if self._fd is not None:
+                ready, _, _ = select.select([self._fd], [], [], remaining)
+                if ready:
+                    time.sleep(self.settle)
+            else:
+                time.sleep(self.interval if remaining is None else min(self.interval, remaining))
+            changed = self.poll()
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+    async def changes(self):
+        """Async iterator yielding each set of changed paths."""
+        if self._fd is None:
+            while True:
+                await asyncio.sleep(self.interval)
+                changed = self.poll()
+                if changed:
+                    yield changed
+
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+        fd = self._fd
+
+        def on_readable():
+            # The fd stays readable until drained; stop watching it meanwhile
+            loop.remove_reader(fd)
+            ready.set()
+
+        try:
+            while True:
+                loop.add_reader(fd, on_readable)
+                await ready.wait()
+                ready.clear()
+                await asyncio.sleep(self.settle)
+                changed = self.poll()
+                if changed:
+                    yield changed
+        finally:
+            loop.remove_reader(fd)
@@ -0,0 +1,166 @@
+"""
+Crash-safe persistence for the config server.
+
+Mutations are appended to a journal of JSON lines. Appends only buffer in
+memory; a writer task group-commits the buffer every `flush_interval`
+seconds, doing the write and fsync in a worker thread so the event loop
+never blocks on disk.
+
+Every `snapshot_every` records the writer compacts: it captures the full
+state, switches to a new journal segment, writes the snapshot atomically
+(temp file + fsync + rename) and deletes the old segments. Startup loads
+the snapshot and replays only the records written after it. A torn last
+line from a crash mid-write is ignored.
+
+Layout:
+  <dir>/snapshot.json               {"seq": N, "state": {...}}
+  <dir>/journal-<first seq>.log     one {"seq": ..., "op": ..., ...} per line
+"""
+
+import asyncio
+import json
+import os
+from pathlib import Path
+
+SNAPSHOT_NAME = 'snapshot.json'
+
+
+class Journal:
+    """Append-only mutation journal with periodic compacted snapshots."""
+
+    def __init__(self, directory, capture, snapshot_every=10000, flush_interval=0.05):
+        self.directory = Path(directory)
+        self.capture = capture  # Callable returning the JSON-able state to snapshot
+        self.snapshot_every = snapshot_every
+        self.flush_interval = flush_interval
+        self.seq = 0  # Seq of the last appended record
+        self.since_snapshot = 0
+        self._buffer = []
+        self._file = None
+        self._wakeup = None
+        self._task = None
+        self._closing = False
+
+    def _segments(self):
+        return sorted(self.directory.glob('journal-*.log'))
+
+    def load(self):
+        """Read the latest snapshot and the records after it.
+
+        Returns (state, records); state is None if there is no snapshot.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        state = None
+        snapshot_seq = 0
+        snapshot_path = self.directory / SNAPSHOT_NAME
+        if snapshot_path.exists():
+            snapshot = json.loads(snapshot_path.read_text(encoding='utf-8'))
+            state = snapshot['state']
+            snapshot_seq = snapshot['seq']
+
+        records = []
+        self.seq = snapshot_seq
+        for segment in self._segments():
+            with open(segment, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        break  # Torn write at the tail of a segment
+                    if record['seq'] > snapshot_seq:
+                        records.append(record)
+                        self.seq = record['seq']
+        self.since_snapshot = len(records)
+        return state, records
+
+    def start(self):
+        """Open a fresh segment and start the group-commit writer."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._file = self._open_segment(self.seq + 1)
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        if self.since_snapshot >= self.snapshot_every:
+            self._wakeup.set()
+
+    def append(self, record):
+        """Queue a mutation record; it is made durable by the next group commit."""
+        self.seq += 1
+        self.since_snapshot += 1
+        self._buffer.append(json.dumps({'seq': self.seq, **record}))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def close(self):
+        """Flush everything buffered and stop the writer."""
+        if self._task is None:
+            return
+        self._closing = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        await asyncio.to_thread(self._file.close)
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if not self._closing:
+                # Group commit window: let more records pile up before the fsync
+                await asyncio.sleep(self.flush_interval)
+            if self.since_snapshot >= self.snapshot_every:
+                await self._compact()
+            await self._flush()
+            if self._closing and not self._buffer:
+                return
+
+    async def _flush(self):
+        lines, self._buffer = self._buffer, []
+        if lines:
+            await asyncio.to_thread(self._write_lines, self._file, lines)
+
+    async def _compact(self):
+        # Draining the buffer and capturing state happen without an await in
+        # between, so the snapshot reflects exactly the records up to seq
+        lines, self._buffer = self._buffer, []
+        state = self.capture()
+        seq = self.seq
+        self.since_snapshot = 0
+
+        old_file = self._file
+        await asyncio.to_thread(self._write_lines, old_file, lines)
+        self._file = await asyncio.to_thread(self._open_segment, seq + 1)
+        await asyncio.to_thread(old_file.close)
+        await asyncio.to_thread(self._write_snapshot, state, seq)
+
+    def _open_segment(self, first_seq):
+        return open(self.directory / f'journal-{first_seq:012d}.log', 'a', encoding='utf-8')
+
+    @staticmethod
+    def _write_lines(f, lines):
+        f.write('\n'.join(lines) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+    def _write_snapshot(self, state, seq):
+        tmp_path = self.directory / (SNAPSHOT_NAME + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'seq': seq, 'state': state}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.directory / SNAPSHOT_NAME)
+        self._fsync_directory()
+        # Every record in segments older than the current one is now in the snapshot
+        current = Path(self._file.name)
+        for segment in self._segments():
+            if segment != current:
+                segment.unlink()
+
+    def _fsync_directory(self):
+        try:
+            fd = os.open(self.directory, os.O_RDONLY)
+        except OSError:
+            return  # Not supported on this platform (e.g. Windows)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
@@ -0,0 +1,122 @@
+"""
+Single-writer command pipeline.
+
+Connection handlers never touch shared state themselves: they submit
+commands, and one writer task applies them strictly in arrival order.
+Everything queued by the time the writer wakes up is applied as one batch
+(a tick), after which the `flush` callback runs, so changes made by many
+clients within a tick can go out as a single ordered patch per session.
+
+Submitting waits only while the backlog is at `maxsize`, which pushes back
+on a client that sends faster than the writer applies. `call` waits until
+its command's tick has been applied and flushed and returns the result,
+which is how a handler makes sure its own earlier commands are done (e.g.
+before it disconnects).
+"""
+
+import asyncio
+from collections import deque
+import inspect
+import logging
+
+log = logging.getLogger('mdev_widgets')
+
+
+class Pipeline:
+    """Command queue consumed by one writer task."""
+
+    def __init__(self, flush=None, maxsize=1024, on_batch=None):
+        self.flush = flush  # Coroutine function run after each batch
+        self.maxsize = maxsize
+        self.on_batch = on_batch  # Callable(batch size), e.g. for metrics
+        self.applied = 0
+        self._commands = deque()  # (callable or coroutine function, args, future or None)
+        self._wakeup = None
+        self._room = None
+        self._task = None
+
+    def __len__(self):
+        return len(self._commands)
+
+    def start(self):
+        """(Re)start the writer on the running loop; a new loop gets a new writer."""
+        loop = asyncio.get_running_loop()
+        if self._task is not None and not self._task.done() and self._task.get_loop() is loop:
+            return
+        self._wakeup = asyncio.Event()
+        self._room = asyncio.Event()
+        self._room.set()
+        self._task = loop.create_task(self._writer())
+        if self._commands:
+            self._wakeup.set()
+
+    async def submit(self, command, *args):
+        """Queue command(*args) (awaited if it is a coroutine); waits only while the backlog is full."""
+        self.start()
+        while len(self._commands) >= self.maxsize:
+            self._room.clear()
+            await self._room.wait()
+        self._commands.append((command, args, None))
+        self._wakeup.set()
+
+    def submit_nowait(self, command, *args):
+        """Queue a command from code that cannot wait (e.g. timers); ignores maxsize."""
+        self.start()
+        self._commands.append((command, args, None))
+        self._wakeup.set()
+
+    async def call(self, command, *args):
+        """Queue a command and wait until its batch has been applied and flushed. Returns its result."""
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._commands.append((command, args, future))
+        self._wakeup.set()
+        return await future
+
+    async def close(self):
+        """Apply whatever is queued, then stop the writer."""
+        if self._task is None or self._task.done():
+            return
+        await self.call(lambda: None)
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    async def _writer(self):
+        while True:
+            if not self._commands:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            size = len(self._commands)
+            outcomes = []  # (future, result, exception) resolved once the batch is flushed
+            for _ in range(size):
+                command, args, future = self._commands.popleft()
+                try:
+                    result = command(*args)
+                    if inspect.isawaitable(result):
+                        result = await result
+                except Exception as e:
+                    log.exception("Command %s failed", getattr(command, '__name__', command))
+                    outcomes.append((future, None, e))
+                else:
+                    outcomes.append((future, result, None))
+            self.applied += size
+            if self.flush is not None:
+                try:
+                    await self.flush()
+                except Exception:
+                    log.exception("Flushing a batch failed")
+            for future, result, exception in outcomes:
+                if future is None or future.done():
+                    continue
+                if exception is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(exception)
+            if self.on_batch is not None:
+                self.on_batch(size)
+            self._room.set()
+
@@ -0,0 +1,173 @@
+"""
+On-demand profiling of a running server.
+
+The server marks what the event loop is busy with as a section named after
+the handler, e.g. the message type being applied or 'flush' for the
+broadcasts at the end of a pipeline tick. While profiling is on, time is
+attributed to those sections:
+
+  sampling       a background thread takes the loop thread's Python stack
+                 every `interval` seconds. Cheap enough for a loaded server.
+  deterministic  one cProfile profile per section, enabled only while the
+                 section runs. Exact call counts, but slows handlers down.
+
+Both render as collapsed stacks, one `section;frame;...;frame count` line
+per stack, which flamegraph.pl, speedscope and inferno read directly.
+Sampling counts samples along full stacks; deterministic mode has no
+stacks, so it writes `section;function microseconds` for each function's
+own time. The deterministic profiles can also be exported in pstats format
+(snakeviz, gprof2dot, flameprof).
+
+A section that awaits keeps its name while other tasks run, so samples
+taken during the suspension are charged to it; handlers rarely suspend.
+"""
+
+from collections import Counter
+import contextlib
+import cProfile
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+
+MODES = ('sampling', 'deterministic')
+IDLE = 'idle'  # Root of samples taken while the loop waits for I/O
+LOOP = 'loop'  # Root of samples outside any section
+
+
+class Profiler:
+    """Sampling or deterministic profiler, switched on and off at runtime."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval  # Seconds between samples
+        self.mode = None  # One of MODES while running
+        self.section_name = None  # Section the loop is in
+        self.started = None
+        self.elapsed = 0.0  # Seconds profiled so far
+        self.samples = 0
+        self._stacks = Counter()  # Collapsed stack -> samples
+        self._profiles = {}  # Section -> cProfile.Profile
+        self._active = None  # Profile enabled right now
+        self._lock = threading.Lock()
+        self._stop = None
+        self._thread = None
+
+    def start(self, mode='sampling', interval=None):
+        """Start profiling the calling thread (the event loop), discarding earlier results."""
+        if mode not in MODES:
+            raise ValueError(f'unknown profiling mode: {mode}')
+        if interval is not None and not interval > 0:
+            raise ValueError('sampling interval must be positive')
+        self.stop()
+        if interval is not None:
+            self.interval = interval
+        with self._lock:
+            self._stacks.clear()
+        self._profiles = {}
+        self.samples = 0
+        self.elapsed = 0.0
+        self.mode = mode
+        self.started = time.perf_counter()
+        if mode == 'sampling':
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._sample, args=(threading.get_ident(), self._stop),
+                                            name='mdev-profiler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop profiling; the results stay until the next start."""
+        if self.mode is None:
+            return
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        if self._active is not None:
+            self._active.disable()
+            self._active = None
+        self.elapsed = time.perf_counter() - self.started
+        self.mode = None
+
+    @contextlib.contextmanager
+    def section(self, name):
+        """Attribute what runs inside to section name."""
+        outer_name, outer = self.section_name, self._active
+        self.section_name = name
+        profile = None
+        if self.mode == 'deterministic':
+            if outer is not None:
+                outer.disable()  # Only one profile can be enabled at a time
+            profile = self._profiles.get(name)
+            if profile is None:
+                profile = self._profiles[name] = cProfile.Profile()
+            self._active = profile
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile is not None and self._active is profile:
+                profile.disable()
+                self._active = outer
+                if outer is not None:
+                    outer.enable()
+            self.section_name = outer_name
+
+    def _sample(self, thread_id, stop):
+        while not stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                return
+            section = self.section_name
+            top = frame.f_code
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if section is None:
+                section = IDLE if os.path.basename(top.co_filename) == 'selectors.py' else LOOP
+            frames.append(section)
+            with self._lock:
+                self._stacks[';'.join(reversed(frames))] += 1
+                self.samples += 1
+
+    def collapsed(self):
+        """Results as collapsed stacks, heaviest first."""
+        with self._lock:
+            stacks = Counter(self._stacks)
+        for name, profile in list(self._profiles.items()):
+            for (filename, line, function), (_, _, own_time, _, _) in self.stats(profile).items():
+                weight = round(own_time * 1e6)
+                if weight:
+                    stacks[f'{name};{function} ({os.path.basename(filename)}:{line})'] += weight
+        return ''.join(f'{stack} {count}\n' for stack, count in stacks.most_common())
+
+    def stats(self, profile):
+        # Reading stats disables a profile; an enabled one is switched back on
+        active = profile is self._active
+        try:
+            return pstats.Stats(profile).stats
+        finally:
+            if active:
+                profile.enable()
+
+    def pstats(self):
+        """The deterministic profiles of every section merged, in pstats (marshal) format."""
+        merged = {}
+        for profile in list(self._profiles.values()):
+            for function, stat in self.stats(profile).items():
+                merged[function] = pstats.add_func_stats(merged[function], stat) if function in merged else stat
+        return marshal.dumps(merged)
+
+    def status(self):
+        running = self.mode is not None
+        return {
+            'mode': self.mode,
+            'running': running,
+            'seconds': round(time.perf_counter() - self.started if running else self.elapsed, 3),
+            'samples': self.samples,
+            'sections': sorted(self._profiles),
+            'interval_ms': self.interval * 1000,
+        }
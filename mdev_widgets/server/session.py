@@ -0,0 +1,224 @@
+"""
+Session namespaces and topic subscriptions.
+
+Each session (one per app instance, e.g. web, iOS simulator, Android
+emulator) has its own widget store, styles and clients, so apps neither
+see nor reset each other's widgets. Apps pick a session with the connect
+path (ws://host:8081/<session>) or a `hello` message.
+
+Within a session a client receives every patch op unless it subscribes to
+widget types and/or ids; then it only receives ops for those widgets.
+Subscriptions are indexed by widget id, so routing an op costs
+O(interested clients) rather than O(all clients).
+
+Style tokens can be changed one at a time; the store's reverse index
+then names the widgets that use the token, so clients only re-render
+those.
+
+Property edits are broadcast at a limited rate: between broadcasts only
+the latest value per (widget, key) is kept, and it goes out with the next
+patch of the session.
+"""
+
+import time
+from urllib.parse import unquote
+
+from widget_store import WidgetStore
+
+DEFAULT_SESSION = 'default'
+
+
+def default_styles():
+    return {'colors': {}, 'sizes': {}, 'textStyles': {}, 'custom': {}}
+
+
+def session_from_path(path):
+    """Session name for a connect path: '/ios' -> 'ios', '/' -> default."""
+    name = unquote((path or '').split('?', 1)[0].strip('/'))
+    return name or DEFAULT_SESSION
+
+
+class Subscription:
+    """What one client subscribed to, and the last patch version it was sent."""
+
+    def __init__(self, types, ids):
+        self.types = set(types)
+        self.ids = set(ids)
+        self.version = 0
+
+
+class Session:
+    """One namespace: widgets, styles, clients and their subscriptions."""
+
+    def __init__(self, name):
+        self.name = name
+        self.store = WidgetStore()
+        self.styles = default_styles()
+        self.clients = {}  # websocket -> ClientQueue
+        self.everything = set()  # Queues that receive every op
+        self.subscriptions = {}  # Queue -> Subscription
+        self.by_type = {}  # Widget type -> queues subscribed to it
+        self.by_id = {}  # Widget id -> queues subscribed to it, directly or via its type
+        self.pending_props = {}  # (widget id, key) -> latest value not broadcast yet
+        self.pending_flags = {}  # Widget id -> [modified flag as last broadcast, as of the held edits]
+        self.props_flushed_at = float('-inf')  # time.monotonic() of the last drain
+        self.props_flush = None  # Task broadcasting the pending props, if scheduled
+
+    def add_client(self, websocket, queue):
+        self.clients[websocket] = queue
+        self.everything.add(queue)
+
+    def remove_client(self, websocket):
+        queue = self.clients.pop(websocket, None)
+        if queue is not None:
+            self._unindex(queue)
+            self.everything.discard(queue)
+        return queue
+
+    def is_unused(self):
+        """True with no clients, widgets, schemas or styles left to keep."""
+        return (not self.clients and not self.store.widgets and not self.store.schemas
+                and self.styles == default_styles())
+
+    def subscribe(self, queue, types=(), ids=()):
+        """Limit a client to ops for these widget types/ids; nothing given means everything."""
+        self._unindex(queue)
+        if not types and not ids:
+            self.everything.add(queue)
+            return
+        self.everything.discard(queue)
+        subscription = Subscription(types, ids)
+        self.subscriptions[queue] = subscription
+        for widget_type in subscription.types:
+            self.by_type.setdefault(widget_type, set()).add(queue)
+        for widget_id in subscription.ids:
+            self.by_id.setdefault(widget_id, set()).add(queue)
+        for widget_id, widget in self.store.widgets.items():
+            if widget.type in subscription.types:
+                self.by_id.setdefault(widget_id, set()).add(queue)
+
+    def _unindex(self, queue):
+        subscription = self.subscriptions.pop(queue, None)
+        if subscription is None:
+            return
+        for widget_type in subscription.types:
+            self._discard(self.by_type, widget_type, queue)
+        for widget_id in list(self.by_id):
+            self._discard(self.by_id, widget_id, queue)
+
+    @staticmethod
+    def _discard(index, key, queue):
+        queues = index.get(key)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del index[key]
+
+    def _track(self, widget_id, widget_type):
+        """Point a (re-)registered widget at the queues subscribed to its id or type."""
+        queues = {q for q in self.by_id.get(widget_id, ()) if widget_id in self.subscriptions[q].ids}
+        queues |= self.by_type.get(widget_type, set())
+        if queues:
+            self.by_id[widget_id] = queues
+        else:
+            self.by_id.pop(widget_id, None)
+
+    def _untrack(self, widget_id):
+        """Forget interest that came from a removed widget's type."""
+        queues = {q for q in self.by_id.get(widget_id, ()) if widget_id in self.subscriptions[q].ids}
+        if queues:
+            self.by_id[widget_id] = queues
+        else:
+            self.by_id.pop(widget_id, None)
+
+    def update_styles(self, data):
+        """Replace whole style categories (the `styles` message).
+
+        Returns the ids of the widgets using a token that was added, changed
+        or removed.
+        """
+        changed = set()
+        for category, entries in data.items():
+            old = self.styles.get(category) or {}
+            if isinstance(old, dict) and isinstance(entries, dict):
+                changed.update(name for name in old.keys() | entries.keys()
+                               if old.get(name) != entries.get(name))
+        affected = set().union(*(self.store.widgets_using(name) for name in changed))
+        self.styles.update(data)
+        self.index_styles()
+        return affected.union(*(self.store.widgets_using(name) for name in changed))
+
+    def index_styles(self):
+        """Point the store's token index at the current style token names."""
+        self.store.set_style_tokens(name for entries in self.styles.values() for name in entries)
+
+    def upsert_style(self, category, name, value):
+        """Add or change one style token. Returns the ids of the widgets using it."""
+        self.styles.setdefault(category, {})[name] = value
+        if name not in self.store.style_tokens:
+            self.index_styles()
+        return self.store.widgets_using(name)
+
+    def delete_style(self, category, name):
+        """Remove one style token. Returns the ids of the widgets that used it, or None."""
+        entries = self.styles.get(category)
+        if not entries or name not in entries:
+            return None
+        del entries[name]
+        affected = set(self.store.widgets_using(name))
+        self.index_styles()
+        return affected
+
+    def queue_prop(self, widget_id, key, value, was_modified, now_modified):
+        """Hold a property edit for the next broadcast; a newer value replaces it."""
+        self.pending_props[(widget_id, key)] = value
+        self.pending_flags.setdefault(widget_id, [was_modified, now_modified])[1] = now_modified
+
+    def drain_props(self):
+        """Patch ops for the held edits: the last value per key, then flag flips."""
+        ops = [{'op': 'prop_changed', 'id': widget_id, 'key': key, 'value': value}
+               for (widget_id, key), value in self.pending_props.items()
+               if widget_id in self.store]
+        for widget_id, (was_modified, now_modified) in self.pending_flags.items():
+            if widget_id in self.store and now_modified != was_modified:
+                ops.append({'op': 'modified_flag_changed', 'id': widget_id, 'modified': now_modified})
+        self.pending_props.clear()
+        self.pending_flags.clear()
+        self.props_flushed_at = time.monotonic()
+        return ops
+
+    def route(self, ops):
+        """Split patch ops among subscribed clients. Returns {queue: ops}."""
+        routed = {}
+        if not self.subscriptions:
+            return routed
+        for op in ops:
+            kind = op['op']
+            if kind == 'cleared':
+                targets = list(self.subscriptions)
+                for widget_id in list(self.by_id):
+                    self._untrack(widget_id)
+            elif kind == 'schema_changed':
+                targets = self.by_type.get(op['type'], ())
+            elif kind == 'upsert':
+                widget = op['widget']
+                self._track(widget['id'], widget['type'])
+                targets = self.by_id.get(widget['id'], ())
+            else:
+                targets = self.by_id.get(op['id'], ())
+                if kind == 'removed':
+                    targets = list(targets)
+                    self._untrack(op['id'])
+            for queue in targets:
+                routed.setdefault(queue, []).append(op)
+        return routed
+
+    def visible_ids(self, queue):
+        """Widget ids a client should see in a snapshot, or None for all."""
+        subscription = self.subscriptions.get(queue)
+        if subscription is None:
+            return None
+        return [
+            widget_id for widget_id, widget in self.store.widgets.items()
+            if widget_id in subscription.ids or widget.type in subscription.types
+        ]
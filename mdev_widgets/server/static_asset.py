@@ -0,0 +1,105 @@
+"""
+In-memory static assets with precompressed variants.
+
+The file is read once and re-read only when its mtime changes. gzip (and
+brotli, if the optional `brotli` package is installed) variants are
+computed at load time and picked by Accept-Encoding. Responses carry an
+ETag so clients can revalidate with If-None-Match and get a 304.
+"""
+
+import gzip
+import hashlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def parse_accept_encoding(header):
+    """Return {coding: q} for an Accept-Encoding header."""
+    codings = {}
+    for part in (header or '').split(','):
+        fields = part.strip().split(';')
+        coding = fields[0].strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in fields[1:]:
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        codings[coding] = q
+    return codings
+
+
+class StaticAsset:
+    """A file served from memory, reloaded when it changes on disk."""
+
+    def __init__(self, path, content_type, fallback='', transform=None):
+        self.path = path
+        self.content_type = content_type
+        self.fallback = fallback  # Served when the file is missing
+        self.transform = transform  # Optional str -> str applied before encoding
+        self.text = None
+        self.mtime = None
+        self.etag = None
+        self.variants = {}  # Content-Encoding ('identity', 'gzip', 'br') -> body
+
+    def load(self):
+        """Read the file and rebuild every encoded variant."""
+        try:
+            self.mtime = self.path.stat().st_mtime_ns
+            self.text = self.path.read_text(encoding='utf-8')
+        except FileNotFoundError:
+            self.mtime = None
+            self.text = self.fallback
+        rendered = self.transform(self.text) if self.transform else self.text
+        body = rendered.encode('utf-8')
+        self.etag = hashlib.sha1(body).hexdigest()[:20]
+        self.variants = {'identity': body, 'gzip': gzip.compress(body, 9, mtime=0)}
+        if brotli is not None:
+            self.variants['br'] = brotli.compress(body)
+
+    def refresh(self):
+        """Reload if the file changed on disk. Returns True if it was reloaded."""
+        try:
+            mtime = self.path.stat().st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if self.text is not None and mtime == self.mtime:
+            return False
+        self.load()
+        return True
+
+    def choose_encoding(self, accept_encoding):
+        """Smallest variant the client accepts."""
+        accepted = parse_accept_encoding(accept_encoding)
+        wildcard = accepted.get('*', 0.0)
+        for coding in ('br', 'gzip'):
+            if coding in self.variants and accepted.get(coding, wildcard) > 0:
+                return coding
+        return 'identity'
+
+    def respond(self, headers):
+        """Return (status, body, response_headers) for a GET with these request headers."""
+        self.refresh()
+        encoding = self.choose_encoding(headers.get('Accept-Encoding'))
+        etag = f'"{self.etag}"' if encoding == 'identity' else f'"{self.etag}-{encoding}"'
+        response_headers = {
+            'ETag': etag,
+            'Cache-Control': 'no-cache',
+            'Vary': 'Accept-Encoding',
+        }
+        if encoding != 'identity':
+            response_headers['Content-Encoding'] = encoding
+
+        if_none_match = headers.get('If-None-Match')
+        if if_none_match:
+            tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+            if '*' in tags or etag in tags:
+                return 304, b'', response_headers
+        return 200, self.variants[encoding], response_headers
@@ -18,6 +18,13 @@ def event_loop():
     loop.close()
 
 
+@pytest.fixture(autouse=True)
+def unthrottled_updates(monkeypatch):
+    """Broadcast every update_prop at once unless a test sets a rate."""
+    import config_server
+    monkeypatch.setattr(config_server, 'UPDATE_PROP_RATE', 0)
+
+
 @pytest.fixture
 def sample_widget():
     """Sample widget data for testing."""
@@ -0,0 +1,134 @@
+"""Tests for the worker backplane backends."""
+
+import asyncio
+import pytest
+import socket
+import sys
+from pathlib import Path
+
+# Add parent directory to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from backplane import Broker, LocalBackplane, Sequencer, UnixBackplane
+
+
+class TestLocalBackplane:
+    """Workers sharing one in-process sequencer."""
+
+    @pytest.mark.asyncio
+    async def test_every_worker_sees_records_in_one_order(self):
+        applied = []
+
+        async def apply(record):
+            applied.append(record['n'])
+
+        sequencer = Sequencer(apply=apply)
+        workers = [LocalBackplane(sequencer) for _ in range(2)]
+        seen = [[], []]
+        for worker, records in zip(workers, seen):
+            await worker.join(records.append)
+
+        await asyncio.gather(workers[0].publish({'n': 1}), workers[1].publish({'n': 2}),
+                             workers[0].publish({'n': 3}))
+
+        assert seen[0] == seen[1]
+        assert [r['seq'] for r in seen[0]] == [1, 2, 3]
+        assert applied == [r['n'] for r in seen[0]]
+
+    @pytest.mark.asyncio
+    async def test_joining_worker_gets_snapshot_then_later_records(self):
+        state = {'n': 0}
+
+        async def apply(record):
+            state['n'] = record['n']
+
+        sequencer = Sequencer(apply=apply, snapshot=lambda: dict(state))
+        first = LocalBackplane(sequencer)
+        await first.join(lambda record: None)
+        await first.publish({'n': 1})
+
+        records = []
+        late = LocalBackplane(sequencer)
+        assert await late.join(records.append) == {'n': 1}
+        await first.publish({'n': 2})
+
+        assert [r['n'] for r in records] == [2]
+
+    @pytest.mark.asyncio
+    async def test_failed_apply_is_still_delivered(self):
+        async def apply(record):
+            raise KeyError('id')
+
+        sequencer = Sequencer(apply=apply)
+        worker, records = LocalBackplane(sequencer), []
+        await worker.join(records.append)
+
+        await worker.publish({'n': 1})
+
+        assert [r['n'] for r in records] == [1]
+
+    @pytest.mark.asyncio
+    async def test_closed_worker_gets_nothing_more(self):
+        sequencer = Sequencer()
+        worker, records = LocalBackplane(sequencer), []
+        await worker.join(records.append)
+        await worker.close()
+
+        await LocalBackplane(sequencer).publish({'n': 1})
+
+        assert records == []
+        await asyncio.wait_for(worker.wait_closed(), 1)
+        with pytest.raises(ConnectionError):
+            await worker.publish({'n': 2})
+
+
+@pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason='needs Unix sockets')
+class TestUnixBroker:
+    """Workers connected to a broker over a Unix socket."""
+
+    async def wait_for(self, condition):
+        for _ in range(100):
+            if condition():
+                return
+            await asyncio.sleep(0.01)
+        raise AssertionError('timed out')
+
+    @pytest.mark.asyncio
+    async def test_records_reach_every_worker_in_order(self, tmp_path):
+        state = {'items': []}
+
+        async def apply(record):
+            state['items'].append(record['n'])
+
+        broker = Broker(tmp_path / 'backplane.sock',
+                        Sequencer(apply=apply, snapshot=lambda: {'items': list(state['items'])}))
+        await broker.start()
+        first, first_seen = UnixBackplane(tmp_path / 'backplane.sock'), []
+        assert await first.join(first_seen.append) == {'items': []}
+        await first.publish({'n': 1})
+        await self.wait_for(lambda: len(first_seen) == 1)
+
+        second, second_seen = UnixBackplane(tmp_path / 'backplane.sock'), []
+        assert await second.join(second_seen.append) == {'items': [1]}
+        await second.publish({'n': 2})
+        await first.publish({'n': 3})
+        await self.wait_for(lambda: len(first_seen) == 3 and len(second_seen) == 2)
+
+        assert [r['n'] for r in first_seen] == [1, 2, 3]
+        assert second_seen == first_seen[1:]
+        assert state['items'] == [1, 2, 3]
+        await first.close()
+        await second.close()
+        await broker.close()
+
+    @pytest.mark.asyncio
+    async def test_worker_notices_the_broker_going_away(self, tmp_path):
+        broker = Broker(tmp_path / 'backplane.sock', Sequencer())
+        await broker.start()
+        worker = UnixBackplane(tmp_path / 'backplane.sock')
+        await worker.join(lambda record: None)
+
+        await broker.close()
+
+        await asyncio.wait_for(worker.wait_closed(), 1)
+        await worker.close()
@@ -0,0 +1,61 @@
+"""Tests for the traffic capture file."""
+
+import json
+import pytest
+import sys
+from pathlib import Path
+
+# Add parent directory to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from capture import Capture, read_capture
+
+
+class TestCapture:
+    """Events written by Capture come back from read_capture."""
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('name', ['traffic.jsonl', 'traffic.jsonl.gz'])
+    async def test_events_round_trip(self, tmp_path, name):
+        path = tmp_path / name
+        capture = Capture(path)
+        capture.start()
+        capture.record(1, 'open', {'path': '/ios', 'subprotocol': None})
+        capture.frame(1, 'in', '{"type": "get_all"}')
+        capture.frame(1, 'out', b'\x81\xa4type')
+        capture.frame(1, 'out', '{\n  "type": "styles"\n}')  # Pretty-printed JSON stays one line
+        capture.record(1, 'close')
+        await capture.close()
+
+        events = list(read_capture(path))
+
+        assert [(conn, kind, data) for _, conn, kind, data in events] == [
+            ('1:1', 'open', {'path': '/ios', 'subprotocol': None}),
+            ('1:1', 'in', {'type': 'get_all'}),
+            ('1:1', 'out', b'\x81\xa4type'),
+            ('1:1', 'out', {'type': 'styles'}),
+            ('1:1', 'close', None),
+        ]
+        times = [t for t, *_ in events]
+        assert times == sorted(times)
+
+    @pytest.mark.asyncio
+    async def test_restarts_append_with_later_times_and_new_connection_ids(self, tmp_path):
+        path = tmp_path / 'traffic.jsonl'
+        for _ in range(2):
+            capture = Capture(path)
+            capture.start()
+            capture.frame(1, 'in', '{"type": "hello"}')
+            await capture.close()
+
+        events = list(read_capture(path))
+
+        assert [conn for _, conn, _, _ in events] == ['1:1', '2:1']
+        assert events[1][0] >= events[0][0]
+
+    def test_torn_last_line_is_ignored(self, tmp_path):
+        path = tmp_path / 'traffic.jsonl'
+        lines = [json.dumps([0, 0, 'start', {'time': 0}]), json.dumps([0.5, 1, 'in', {'type': 'get_all'}])]
+        path.write_text('\n'.join(lines) + '\n[0.7, 1, "in", {"ty')
+
+        assert [kind for _, _, kind, _ in read_capture(path)] == ['in']
@@ -0,0 +1,215 @@
+"""Tests for per-client outbound queues."""
+
+import asyncio
+import json
+import pytest
+import sys
+from pathlib import Path
+from unittest.mock import AsyncMock
+
+# Add parent directory to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from websockets.exceptions import ConnectionClosed
+
+import config_server
+from client_queue import ClientQueue, coalesce_patches
+
+
+class GatedWebSocket:
+    """Websocket whose sends block until the gate is opened."""
+
+    def __init__(self):
+        self.gate = asyncio.Event()
+        self.sent = []
+        self.close = AsyncMock()
+
+    async def send(self, message):
+        await self.gate.wait()
+        self.sent.append(json.loads(message))
+
+
+def patch(version, *ops):
+    return {'type': 'patch', 'version': version, 'ops': list(ops)}
+
+
+def prop(widget_id, key, value):
+    return {'op': 'prop_changed', 'id': widget_id, 'key': key, 'value': value}
+
+
+class TestCoalescePatches:
+    """Tests for merging queued patches."""
+
+    def test_last_write_per_field_wins(self):
+        """Repeated changes to one property collapse to the latest value."""
+        merged = coalesce_patches([
+            patch(1, prop('a', 'x', 1)),
+            patch(2, prop('a', 'x', 2), prop('b', 'x', 1)),
+            patch(3, prop('a', 'x', 3)),
+        ])
+
+        assert merged['base_version'] == 0
+        assert merged['version'] == 3
+        assert merged['ops'] == [prop('b', 'x', 1), prop('a', 'x', 3)]
+
+    def test_removed_supersedes_earlier_ops(self):
+        """Ops before a removal of the same widget are dropped."""
+        merged = coalesce_patches([
+            patch(1, prop('a', 'x', 1), prop('b', 'x', 1)),
+            patch(2, {'op': 'removed', 'id': 'a'}),
+        ])
+
+        assert merged['ops'] == [prop('b', 'x', 1), {'op': 'removed', 'id': 'a'}]
+
+    def test_cleared_supersedes_everything(self):
+        """A clear drops every earlier op."""
+        merged = coalesce_patches([
+            patch(1, prop('a', 'x', 1)),
+            patch(2, {'op': 'cleared'}),
+            patch(3, prop('b', 'x', 1)),
+        ])
+
+        assert merged['ops'] == [{'op': 'cleared'}, prop('b', 'x', 1)]
+
+
+class TestClientQueue:
+    """Tests for queue delivery and overflow policies."""
+
+    @pytest.mark.asyncio
+    async def test_messages_delivered_in_order(self):
+        """Writer task sends queued messages in order."""
+        ws = GatedWebSocket()
+        ws.gate.set()
+        queue = ClientQueue(ws)
+        queue.start()
+
+        for i in range(3):
+            queue.put({'type': 'test', 'n': i})
+        await queue.close()
+
+        assert [m['n'] for m in ws.sent] == [0, 1, 2]
+
+    @pytest.mark.asyncio
+    async def test_resync_policy_replaces_backlog_with_snapshot(self):
+        """A full queue is dropped and a snapshot is sent instead."""
+        ws = GatedWebSocket()
+        snapshot = [({'type': 'widgets', 'version': 5}, '{"type": "widgets", "version": 5, "data": {}}')]
+        queue = ClientQueue(ws, maxsize=2, policy='resync', snapshot=lambda queue: snapshot)
+        queue.start()
+        await asyncio.sleep(0)
+
+        queue.put(patch(1, prop('a', 'x', 1)))
+        await asyncio.sleep(0)  # Writer picks up patch 1 and blocks on the gate
+        for version in range(2, 6):
+            queue.put(patch(version, prop('a', 'x', version)))
+        # Patches 2-4 overflowed; patch 5 is queued behind the pending resync
+        assert len(queue) == 1
+        assert queue.dropped == 3
+
+        ws.gate.set()
+        await queue.close()
+
+        # The first patch was already in flight; everything else is replaced by the snapshot
+        assert [m['type'] for m in ws.sent] == ['patch', 'widgets']
+        assert queue.resyncs == 1
+
+    @pytest.mark.asyncio
+    async def test_coalesce_policy_merges_backlog(self):
+        """A full queue of patches is merged into one patch."""
+        ws = GatedWebSocket()
+        queue = ClientQueue(ws, maxsize=2, policy='coalesce')
+        queue.start()
+        await asyncio.sleep(0)
+
+        queue.put(patch(1, prop('a', 'x', 1)))
+        await asyncio.sleep(0)  # Writer picks up patch 1 and blocks on the gate
+        for version in range(2, 6):
+            queue.put(patch(version, prop('a', 'x', version)))
+
+        ws.gate.set()
+        await queue.close()
+
+        assert ws.sent[0]['version'] == 1
+        assert ws.sent[-1]['ops'] == [prop('a', 'x', 5)]
+        assert ws.sent[-1]['version'] == 5
+
+    @pytest.mark.asyncio
+    async def test_coalesce_policy_handles_schema_changes(self):
+        """Queued schema_changed ops merge by widget type instead of failing the broadcast."""
+        ws = GatedWebSocket()
+        queue = ClientQueue(ws, maxsize=2, policy='coalesce')
+        queue.start()
+        await asyncio.sleep(0)
+
+        queue.put(patch(1, prop('a', 'x', 1)))
+        await asyncio.sleep(0)  # Writer picks up patch 1 and blocks on the gate
+        queue.put(patch(2, {'op': 'schema_changed', 'type': 'Text', 'schemaRef': 'r1'}))
+        queue.put(patch(3, prop('a', 'x', 3)))
+        queue.put(patch(4, {'op': 'schema_changed', 'type': 'Text', 'schemaRef': 'r2'}))
+
+        ws.gate.set()
+        await queue.close()
+
+        assert ws.sent[-1]['ops'] == [prop('a', 'x', 3),
+                                      {'op': 'schema_changed', 'type': 'Text', 'schemaRef': 'r2'}]
+        assert ws.sent[-1]['version'] == 4
+
+    @pytest.mark.asyncio
+    async def test_disconnect_policy_closes_connection(self):
+        """A full queue closes the connection and ignores further messages."""
+        ws = GatedWebSocket()
+        queue = ClientQueue(ws, maxsize=1, policy='disconnect')
+        queue.start()
+
+        queue.put({'type': 'test'})
+        queue.put({'type': 'test'})
+        await asyncio.sleep(0)
+
+        assert queue.closed
+        ws.close.assert_called_once()
+        queue.put({'type': 'test'})
+        assert len(queue) == 0
+        await queue.close(timeout=0.01)
+
+    def test_unknown_policy_rejected(self):
+        """Only the documented policies are accepted."""
+        with pytest.raises(ValueError):
+            ClientQueue(AsyncMock(), policy='block')
+
+
+class TestBroadcastIsolation:
+    """Tests that slow or dead clients don't affect others."""
+
+    def setup_method(self):
+        """Reset server state before each test."""
+        config_server.clients.clear()
+
+    @pytest.mark.asyncio
+    async def test_slow_client_does_not_block_broadcast(self):
+        """Broadcast returns immediately even if one client never drains."""
+        slow = GatedWebSocket()
+        fast = GatedWebSocket()
+        fast.gate.set()
+        config_server.add_client(slow)
+        config_server.add_client(fast)
+
+        await asyncio.wait_for(config_server.broadcast({'type': 'test'}), timeout=0.1)
+        await config_server.remove_client(fast)
+
+        assert fast.sent == [{'type': 'test'}]
+        await config_server.remove_client(slow)
+
+    @pytest.mark.asyncio
+    async def test_closed_client_does_not_raise_into_sender(self):
+        """ConnectionClosed from one client stays in that client's writer."""
+        dead = AsyncMock()
+        dead.send.side_effect = ConnectionClosed(None, None)
+        alive = AsyncMock()
+        config_server.add_client(dead)
+        config_server.add_client(alive)
+
+        await config_server.broadcast({'type': 'test'})
+        await config_server.remove_client(dead)
+        await config_server.remove_client(alive)
+
+        alive.send.assert_called_once()
@@ -0,0 +1,78 @@
+"""Tests for wire codecs and subprotocol negotiation."""
+
+import json
+import pytest
+import sys
+from pathlib import Path
+
+# Add parent directory to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import websockets
+
+import config_server
+from codec import CODECS, JSON, codec_for, deflate_extensions, select_subprotocol
+
+
+class TestNegotiation:
+    """Tests for picking a codec from the offered subprotocols."""
+
+    def test_client_preference_wins(self):
+        assert select_subprotocol(None, ['x-unknown', 'mdev.json']) == 'mdev.json'
+
+    def test_no_subprotocol_means_json(self):
+        assert select_subprotocol(None, []) is None
+        assert codec_for(None) is JSON
+
+    def test_deflate_window_is_configurable(self):
+        factory, = deflate_extensions(window_bits=10)
+        assert factory.server_max_window_bits == 10
+
+
+class TestServerCodecs:
+    """End-to-end negotiation against a running server."""
+
+    def setup_method(self):
+        config_server.store.clear()
+        config_server.clients.clear()
+
+    async def exchange(self, port, **connect_options):
+        config_server.store.clear()  # So the registration is new and gets broadcast
+        async with websockets.connect(f'ws://localhost:{port}', **connect_options) as ws:
+            await ws.send(json.dumps({'type': 'register', 'id': 'w1', 'widgetType': 'Text',
+                                      'properties': {'fontSize': 12}}))
+            frames = [await ws.recv()]
+            while 'patch' not in str(frames[-1]):
+                frames.append(await ws.recv())
+            return ws.subprotocol, ws.response.headers.get('Sec-WebSocket-Extensions'), frames
+
+    @pytest.mark.asyncio
+    async def test_old_and_new_clients(self):
+        """Clients with and without a subprotocol get JSON; deflate is negotiated."""
+        async with websockets.serve(config_server.handle_websocket, 'localhost', 0,
+                                    select_subprotocol=select_subprotocol, compression=None,
+                                    extensions=deflate_extensions(15)) as server:
+            port = server.sockets[0].getsockname()[1]
+
+            subprotocol, extensions, frames = await self.exchange(port)
+            assert subprotocol is None
+            assert json.loads(frames[-1])['ops'][0]['widget']['id'] == 'w1'
+            assert 'permessage-deflate' in extensions
+
+            subprotocol, _, frames = await self.exchange(port, subprotocols=['mdev.json'])
+            assert subprotocol == 'mdev.json'
+            assert json.loads(frames[-1])['ops'][0]['widget']['id'] == 'w1'
+
+    @pytest.mark.asyncio
+    async def test_msgpack_frames(self):
+        """msgpack clients get binary frames and may send either framing."""
+        msgpack = pytest.importorskip('msgpack')
+        async with websockets.serve(config_server.handle_websocket, 'localhost', 0,
+                                    select_subprotocol=select_subprotocol) as server:
+            port = server.sockets[0].getsockname()[1]
+            async with websockets.connect(f'ws://localhost:{port}', subprotocols=['mdev.msgpack']) as ws:
+                await ws.send(msgpack.packb({'type': 'get_all'}))
+                frame = await ws.recv()
+                assert isinstance(frame, bytes)
+                assert msgpack.unpackb(frame)['type'] in ('widgets', 'schema_defs')
+        assert 'mdev.msgpack' in CODECS
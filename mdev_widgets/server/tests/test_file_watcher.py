@@ -0,0 +1,72 @@
+"""Tests for file change notification."""
+
+import asyncio
+import os
+import pytest
+import sys
+from pathlib import Path
+
+# Add parent directory to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from file_watcher import FileWatcher
+
+
+def bump(path, text):
+    """Write text and push the mtime forward so coarse clocks still see a change."""
+    old = path.stat().st_mtime_ns if path.exists() else 0
+    path.write_text(text, encoding='utf-8')
+    os.utime(path, ns=(old + 1_000_000, old + 1_000_000))
+
+
+@pytest.fixture(params=[True, False], ids=['inotify', 'poll'])
+def watcher(request, tmp_path):
+    """Watcher on one file, with each backend."""
+    path = tmp_path / 'watched.txt'
+    path.write_text('a', encoding='utf-8')
+    watcher = FileWatcher([path], interval=0.01, settle=0.01, use_inotify=request.param)
+    if request.param and watcher.backend != 'inotify':
+        pytest.skip('inotify not available')
+    yield watcher
+    watcher.close()
+
+
+class TestFileWatcher:
+    """Tests for both watcher backends."""
+
+    def test_reports_write(self, watcher):
+        """An in-place write is reported."""
+        bump(watcher.paths[0], 'b')
+        assert watcher.wait(timeout=1.0) == {watcher.paths[0]}
+
+    def test_reports_atomic_rename(self, watcher):
+        """Saving via temp file + rename is reported."""
+        path = watcher.paths[0]
+        tmp = path.with_name('watched.txt.tmp')
+        bump(tmp, 'b')
+        os.replace(tmp, path)
+        assert watcher.wait(timeout=1.0) == {path}
+
+    def test_ignores_other_files(self, watcher):
+        """Files next to the watched one do not count."""
+        bump(watcher.paths[0].with_name('other.txt'), 'x')
+        assert watcher.wait(timeout=0.05) == set()
+
+    def test_unchanged_file_not_reported(self, watcher):
+        """Rewriting identical content with the same mtime is not a change."""
+        path = watcher.paths[0]
+        stat = path.stat()
+        path.write_text('a', encoding='utf-8')
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        assert watcher.wait(timeout=0.05) == set()
+
+    @pytest.mark.asyncio
+    async def test_async_changes(self, watcher):
+        """The async iterator yields changes without blocking the loop."""
+        changes = watcher.changes()
+        pending = asyncio.ensure_future(changes.__anext__())
+        await asyncio.sleep(0.02)
+        bump(watcher.paths[0], 'b')
+
+        assert await asyncio.wait_for(pending, 1.0) == {watcher.paths[0]}
+        await changes.aclose()
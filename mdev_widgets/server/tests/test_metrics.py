@@ -0,0 +1,52 @@
+"""Tests for the Prometheus metrics registry."""
+
+import sys
+from pathlib import Path
+
+# Add parent directory to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from metrics import Registry
+
+
+def test_counter_renders_per_label_values():
+    registry = Registry()
+    counter = registry.counter('requests_total', 'Requests', ['type'])
+    counter.inc('get')
+    counter.inc('get')
+    counter.inc('put', amount=3)
+
+    assert registry.render().splitlines() == [
+        '# HELP requests_total Requests',
+        '# TYPE requests_total counter',
+        'requests_total{type="get"} 2',
+        'requests_total{type="put"} 3',
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    histogram = registry.histogram('latency_seconds', 'Latency', buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+
+    lines = registry.render().splitlines()
+
+    assert 'latency_seconds_bucket{le="0.1"} 2' in lines  # Bounds are inclusive
+    assert 'latency_seconds_bucket{le="1.0"} 3' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 4' in lines
+    assert 'latency_seconds_sum 2.65' in lines
+    assert 'latency_seconds_count 4' in lines
+
+
+def test_collected_metrics_read_state_when_rendered():
+    state = {'a': 1}
+    registry = Registry()
+    registry.collected('items', 'Items', labels=['name'], collect=lambda: (((k,), v) for k, v in state.items()))
+    state['b"'] = 2
+
+    lines = registry.render().splitlines()
+
+    assert '# TYPE items gauge' in lines
+    assert 'items{name="a"} 1' in lines
+    assert 'items{name="b\\""} 2' in lines
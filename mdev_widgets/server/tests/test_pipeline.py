@@ -0,0 +1,86 @@
+"""Tests for the single-writer command pipeline."""
+
+import asyncio
+import pytest
+import sys
+from pathlib import Path
+
+# Add parent directory to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from pipeline import Pipeline
+
+
+class TestPipeline:
+    """Commands are applied in order, in batches, by one writer."""
+
+    @pytest.mark.asyncio
+    async def test_commands_queued_together_form_one_batch(self):
+        applied = []
+        flushes = []
+
+        async def flush():
+            flushes.append(list(applied))
+
+        pipeline = Pipeline(flush=flush)
+        for i in range(3):
+            await pipeline.submit(applied.append, i)
+        await pipeline.call(applied.append, 'last')
+
+        assert applied == [0, 1, 2, 'last']
+        assert flushes == [[0, 1, 2, 'last']]
+        await pipeline.close()
+
+    @pytest.mark.asyncio
+    async def test_call_returns_after_its_batch_is_flushed(self):
+        events = []
+
+        async def flush():
+            events.append('flush')
+
+        async def command():
+            events.append('command')
+            return 42
+
+        pipeline = Pipeline(flush=flush)
+
+        assert await pipeline.call(command) == 42
+        assert events == ['command', 'flush']
+        await pipeline.close()
+
+    @pytest.mark.asyncio
+    async def test_failing_command_does_not_stop_the_writer(self):
+        applied = []
+
+        def fail():
+            raise KeyError('id')
+
+        pipeline = Pipeline()
+        await pipeline.submit(fail)
+        with pytest.raises(KeyError):
+            await pipeline.call(fail)
+        await pipeline.call(applied.append, 'after')
+
+        assert applied == ['after']
+        await pipeline.close()
+
+    @pytest.mark.asyncio
+    async def test_submit_waits_while_the_backlog_is_full(self):
+        release = asyncio.Event()
+        applied = []
+        pipeline = Pipeline(maxsize=2)
+        await pipeline.submit(release.wait)  # Holds the writer
+        await asyncio.sleep(0)
+        await pipeline.submit(applied.append, 1)
+        await pipeline.submit(applied.append, 2)
+
+        third = asyncio.create_task(pipeline.submit(applied.append, 3))
+        for _ in range(3):
+            await asyncio.sleep(0)
+        assert not third.done()
+
+        release.set()
+        await third
+        await pipeline.call(lambda: None)
+        assert applied == [1, 2, 3]
+        await pipeline.close()
@@ -0,0 +1,75 @@
+"""Tests for the runtime profiler."""
+
+import io
+import marshal
+import pstats
+import pytest
+import sys
+import time
+from pathlib import Path
+
+# Add parent directory to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from profiler import Profiler
+
+
+def busy(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        sum(range(100))
+
+
+def test_samples_are_charged_to_the_running_section():
+    profiler = Profiler(interval=0.001)
+    profiler.start('sampling')
+    with profiler.section('update_prop'):
+        busy(0.1)
+    profiler.stop()
+
+    lines = profiler.collapsed().splitlines()
+
+    assert profiler.samples > 0
+    top, count = lines[0].rsplit(' ', 1)
+    assert top.startswith('update_prop;')
+    assert top.endswith(f'busy (test_profiler.py:{busy.__code__.co_firstlineno})')
+    assert int(count) > 0
+
+
+def test_deterministic_profile_per_section():
+    profiler = Profiler()
+    profiler.start('deterministic')
+    with profiler.section('get_all'):
+        busy(0.01)
+        with profiler.section('flush'):
+            sorted(range(1000))
+        busy(0.01)
+    profiler.stop()
+
+    stacks = {line.rsplit(' ', 1)[0] for line in profiler.collapsed().splitlines()}
+
+    assert f'get_all;busy (test_profiler.py:{busy.__code__.co_firstlineno})' in stacks
+    assert 'flush;<built-in method builtins.sorted> (~:0)' in stacks
+    assert not any(s.startswith('flush;busy') for s in stacks)
+    assert profiler.status()['sections'] == ['flush', 'get_all']
+    stats = pstats.Stats(stream=io.StringIO())
+    stats.stats = marshal.loads(profiler.pstats())
+    assert any(function == 'busy' for _, _, function in stats.stats)
+
+
+def test_start_discards_earlier_results_and_checks_its_arguments():
+    profiler = Profiler()
+    profiler.start('deterministic')
+    with profiler.section('register'):
+        busy(0.001)
+    profiler.stop()
+
+    with pytest.raises(ValueError):
+        profiler.start('tracing')
+    with pytest.raises(ValueError):
+        profiler.start('sampling', interval=0)
+    profiler.start('sampling')
+    profiler.stop()
+
+    assert profiler.status()['sections'] == []
+    assert 'register;' not in profiler.collapsed()
@@ -1,16 +1,64 @@
 """Tests for the config server."""
 
 import asyncio
+from collections import deque
 import json
+import os
 import pytest
 import sys
+import time
 from pathlib import Path
 from unittest.mock import AsyncMock, MagicMock, patch
 
 # Add parent directory to path for imports
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
+import websockets
+from websockets.datastructures import Headers
+from websockets.http11 import Request
+
+from backplane import LocalBackplane, Sequencer
+from capture import read_capture
 import config_server
+from session import default_styles
+from widget_store import WidgetStore
+
+
+class FakeWebSocket:
+    """Websocket stand-in that replays inbound messages and records sends."""
+
+    def __init__(self, messages=(), path='/'):
+        self.inbound = [json.dumps(m) for m in messages]
+        self.sent = []
+        self.request = Request(path, Headers())
+
+    def __aiter__(self):
+        return self._iter()
+
+    async def _iter(self):
+        for message in self.inbound:
+            await asyncio.sleep(0)  # Each message is its own network read, as on a real socket
+            yield message
+
+    async def send(self, message):
+        self.sent.append(json.loads(message))
+
+
+class BurstWebSocket(FakeWebSocket):
+    """Websocket whose messages all arrive in one read, so they share a pipeline tick.
+
+    With `hold`, the connection stays open until the event is set.
+    """
+
+    def __init__(self, messages=(), path='/', hold=None):
+        super().__init__(messages, path)
+        self.hold = hold
+
+    async def _iter(self):
+        for message in self.inbound:
+            yield message
+        if self.hold is not None:
+            await self.hold.wait()
 
 
 class TestWidgetManagement:
@@ -18,46 +66,40 @@ class TestWidgetManagement:
 
     def setup_method(self):
         """Reset server state before each test."""
-        config_server.widgets.clear()
-        config_server.original_widgets.clear()
-        config_server.styles = {'colors': {}, 'sizes': {}, 'textStyles': {}, 'custom': {}}
+        config_server.store.clear()
+        config_server.styles.clear()
+        config_server.styles.update(default_styles())
         config_server.clients.clear()
 
     def test_is_modified_false_for_new_widget(self, sample_widget):
         """New widget should not be marked as modified."""
         widget_id = sample_widget['id']
-        config_server.widgets[widget_id] = {
-            'id': widget_id,
-            'type': sample_widget['widgetType'],
-            'properties': dict(sample_widget['properties']),
-        }
-        config_server.original_widgets[widget_id] = {
-            'id': widget_id,
-            'type': sample_widget['widgetType'],
-            'properties': dict(sample_widget['properties']),
-        }
+        config_server.store.register(widget_id, sample_widget['widgetType'],
+                                     dict(sample_widget['properties']))
 
         assert config_server.is_modified(widget_id) is False
 
     def test_is_modified_true_after_change(self, sample_widget):
         """Widget should be marked as modified after property change."""
         widget_id = sample_widget['id']
-        config_server.widgets[widget_id] = {
-            'id': widget_id,
-            'type': sample_widget['widgetType'],
-            'properties': dict(sample_widget['properties']),
-        }
-        config_server.original_widgets[widget_id] = {
-            'id': widget_id,
-            'type': sample_widget['widgetType'],
-            'properties': dict(sample_widget['properties']),
-        }
+        config_server.store.register(widget_id, sample_widget['widgetType'],
+                                     dict(sample_widget['properties']))
 
         # Modify a property
-        config_server.widgets[widget_id]['properties']['fontSize'] = 24
+        config_server.store.set_prop(widget_id, 'fontSize', 24)
 
         assert config_server.is_modified(widget_id) is True
 
+    def test_is_modified_false_after_change_is_reverted(self, sample_widget):
+        """Setting a property back to its original value clears the flag."""
+        widget_id = sample_widget['id']
+        config_server.store.register(widget_id, sample_widget['widgetType'],
+                                     dict(sample_widget['properties']))
+
+        assert config_server.store.set_prop(widget_id, 'fontSize', 24) == (False, True)
+        assert config_server.store.set_prop(widget_id, 'fontSize', None) == (True, False)
+        assert config_server.is_modified(widget_id) is False
+
     def test_is_modified_false_for_unknown_widget(self):
         """Unknown widget should not be marked as modified."""
         assert config_server.is_modified('unknown_widget_id') is False
@@ -65,16 +107,8 @@ class TestWidgetManagement:
     def test_widget_with_modified_flag(self, sample_widget):
         """widget_with_modified_flag should include modified status."""
         widget_id = sample_widget['id']
-        config_server.widgets[widget_id] = {
-            'id': widget_id,
-            'type': sample_widget['widgetType'],
-            'properties': dict(sample_widget['properties']),
-        }
-        config_server.original_widgets[widget_id] = {
-            'id': widget_id,
-            'type': sample_widget['widgetType'],
-            'properties': dict(sample_widget['properties']),
-        }
+        config_server.store.register(widget_id, sample_widget['widgetType'],
+                                     dict(sample_widget['properties']))
 
         result = config_server.widget_with_modified_flag(widget_id)
 
@@ -106,49 +140,235 @@ class TestDashboardLoading:
         assert 'dark' in config_server.DASHBOARD_HTML
 
 
+class TestHTTPServing:
+    """Tests for HTTP requests answered from the event loop."""
+
+    def request(self, path, **headers):
+        return Request(path, Headers(headers))
+
+    def test_dashboard_served_with_ws_port(self):
+        """Dashboard is served with the configured WebSocket port filled in."""
+        response = config_server.process_request(None, self.request('/'))
+
+        assert response.status_code == 200
+        assert response.headers['Content-Type'].startswith('text/html')
+        body = response.body.decode()
+        assert 'Widget Config Editor' in body
+        assert f'<meta name="mdev-ws-port" content="{config_server.WS_PORT}">' in body
+
+    def test_dashboard_revalidation_returns_304(self):
+        """Dashboards reloading an unchanged page get a 304 without a body."""
+        first = config_server.process_request(None, self.request('/', **{'Accept-Encoding': 'gzip'}))
+        assert first.headers['Content-Encoding'] == 'gzip'
+
+        second = config_server.process_request(None, self.request(
+            '/', **{'Accept-Encoding': 'gzip', 'If-None-Match': first.headers['ETag']}))
+
+        assert second.status_code == 304
+        assert second.body == b''
+
+    def test_unknown_path_returns_404(self):
+        """Unknown paths are rejected."""
+        response = config_server.process_request(None, self.request('/missing'))
+        assert response.status_code == 404
+
+    def test_websocket_upgrade_passes_through(self):
+        """Upgrade requests continue to the WebSocket handshake."""
+        request = self.request('/', Upgrade='websocket', Connection='Upgrade')
+        assert config_server.process_request(None, request) is None
+
+    def test_health_reports_live_state(self):
+        """HTTP endpoints can read live server state."""
+        config_server.store.clear()
+        config_server.store.register('a', 'Text', {})
+
+        response = config_server.process_request(None, self.request('/health?x=1'))
+
+        assert json.loads(response.body)['widgets'] == 1
+
+    @pytest.mark.asyncio
+    async def test_http_and_websocket_share_one_port(self):
+        """A single server answers both the dashboard and WebSocket clients."""
+        config_server.store.clear()
+        config_server.clients.clear()
+        async with websockets.serve(config_server.handle_websocket, 'localhost', 0,
+                                    process_request=config_server.process_request) as server:
+            port = server.sockets[0].getsockname()[1]
+
+            reader, writer = await asyncio.open_connection('localhost', port)
+            writer.write(b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+            await writer.drain()
+            status_line = await reader.readline()
+            writer.close()
+            assert b'200' in status_line
+
+            async with websockets.connect(f'ws://localhost:{port}') as ws:
+                await ws.send(json.dumps({'type': 'get_all'}))
+                first = json.loads(await ws.recv())
+                assert first['type'] == 'widgets'
+
+
+class TestMetrics:
+    """Tests for the Prometheus /metrics endpoint."""
+
+    def setup_method(self):
+        config_server.store.clear()
+        config_server.clients.clear()
+
+    def scrape(self):
+        response = config_server.process_request(None, Request('/metrics', Headers()))
+        assert response.status_code == 200
+        assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+        return response.body.decode()
+
+    @pytest.mark.asyncio
+    async def test_messages_are_counted_and_timed_per_type(self):
+        """Each handled message is counted and timed under its type."""
+        before = config_server.message_count.values.get(('get_all',), 0)
+        await config_server.handle_websocket(FakeWebSocket([{'type': 'get_all'}, {'type': 'bogus'}]))
+
+        body = self.scrape()
+
+        assert config_server.message_count.values[('get_all',)] == before + 1
+        assert 'mdev_message_handling_seconds_bucket{type="get_all",le="+Inf"}' in body
+        assert 'mdev_messages_total{type="unknown"}' in body
+        assert 'type="bogus"' not in body
+
+    @pytest.mark.asyncio
+    async def test_handling_time_includes_the_end_of_tick_flush(self, monkeypatch):
+        """A message is timed until its tick's patch has been queued for every client."""
+        flush_session = config_server.flush_session
+
+        async def slow_flush(session):
+            time.sleep(0.05)
+            return await flush_session(session)
+
+        monkeypatch.setattr(config_server, 'flush_session', slow_flush)
+        before = config_server.message_seconds.values.get(('register',), [None, 0.0, 0])[1]
+        await config_server.handle_websocket(FakeWebSocket([
+            {'type': 'register', 'id': 'a', 'widgetType': 'Text', 'properties': {}}]))
+
+        assert config_server.message_seconds.values[('register',)][1] - before >= 0.05
+
+    @pytest.mark.asyncio
+    async def test_live_state_is_read_at_scrape_time(self):
+        """Store sizes and per-client queue stats reflect the current state."""
+        config_server.store.register('a', 'Text', {'text': 'x'})
+        websocket = FakeWebSocket()
+        queue = config_server.add_client(websocket)
+        await config_server.broadcast({'type': 'test'})
+
+        body = self.scrape()
+
+        assert 'mdev_widgets{session="default"} 1' in body
+        assert 'mdev_clients{session="default"} 1' in body
+        assert f'mdev_client_queue_depth{{session="default",client="{queue.client_id}"}}' in body
+        assert 'mdev_broadcast_recipients_count' in body
+        await config_server.remove_client(websocket)
+        assert f'client="{queue.client_id}"' not in self.scrape()
+
+
+class TestProfiling:
+    """Tests for the /debug profiling and slow-message endpoints."""
+
+    def setup_method(self):
+        config_server.store.clear()
+        config_server.clients.clear()
+        config_server.slow_messages.clear()
+
+    def get(self, path):
+        return config_server.process_request(None, Request(path, Headers()))
+
+    @pytest.mark.asyncio
+    async def test_profile_is_switched_on_and_off_at_runtime(self):
+        """Handlers profiled between start and stop show up under their message type."""
+        started = self.get('/debug/profile?start=deterministic')
+        assert json.loads(started.body)['running'] is True
+        await config_server.handle_websocket(FakeWebSocket([
+            {'type': 'register', 'id': 'a', 'widgetType': 'Text', 'properties': {}}]))
+        stopped = json.loads(self.get('/debug/profile?stop').body)
+
+        stacks = self.get('/debug/profile').body.decode().splitlines()
+
+        assert stopped['running'] is False
+        assert {'register', 'flush'} <= set(stopped['sections'])
+        assert any(line.startswith('register;register (widget_store.py:') for line in stacks)
+        assert self.get('/debug/profile?format=pstats').headers['Content-Type'] == 'application/octet-stream'
+        assert self.get('/debug/profile?start=tracing').status_code == 400
+
+    @pytest.mark.asyncio
+    async def test_slow_messages_are_logged_with_size_and_fanout(self, monkeypatch):
+        monkeypatch.setattr(config_server, 'SLOW_MESSAGE_MS', 100)
+        register = {'type': 'register', 'id': 'a', 'widgetType': 'Text', 'properties': {}}
+        watcher = FakeWebSocket()
+        config_server.add_client(watcher)
+        assert json.loads(self.get('/debug/slow?threshold_ms=0.000001').body)['threshold_ms'] == 0.000001
+
+        await config_server.handle_websocket(FakeWebSocket([register, {'type': 'get_all'}]))
+        await config_server.remove_client(watcher)
+
+        entries = json.loads(self.get('/debug/slow').body)['messages']
+        assert [(e['type'], e['bytes'], e['fanout']) for e in entries] == [
+            ('register', len(json.dumps(register)), 2),
+            ('get_all', len(json.dumps({'type': 'get_all'})), 1),
+        ]
+        assert self.get('/debug/slow?threshold_ms=x').status_code == 400
+
+    @pytest.mark.asyncio
+    async def test_slow_log_counts_the_clients_actually_reached(self, monkeypatch):
+        """Fan-out is the real recipient count, and the flush is part of the time."""
+        monkeypatch.setattr(config_server, 'SLOW_MESSAGE_MS', 0.000001)
+        batch = {'type': 'register_batch', 'widgets': [
+            {'id': 'a', 'widgetType': 'Text', 'properties': {}, 'hash': 'h'}]}
+        watcher = FakeWebSocket()
+        config_server.add_client(watcher)
+
+        # Not echoed to its sender, then unchanged and only acked
+        await config_server.handle_websocket(FakeWebSocket([batch]))
+        await config_server.handle_websocket(FakeWebSocket([batch]))
+        await config_server.remove_client(watcher)
+
+        entries = list(config_server.slow_messages)
+        assert [(e['type'], e['fanout']) for e in entries] == [('register_batch', 1), ('register_batch', 0)]
+        assert all(e['flush_ms'] >= 0 for e in entries)
+
+
 class TestWebSocketMessages:
     """Tests for WebSocket message handling."""
 
     def setup_method(self):
         """Reset server state before each test."""
-        config_server.widgets.clear()
-        config_server.original_widgets.clear()
-        config_server.styles = {'colors': {}, 'sizes': {}, 'textStyles': {}, 'custom': {}}
+        config_server.store.clear()
+        config_server.styles.clear()
+        config_server.styles.update(default_styles())
         config_server.clients.clear()
 
     @pytest.mark.asyncio
     async def test_register_widget(self, sample_widget):
         """Register message should add widget to state."""
         mock_websocket = AsyncMock()
-        config_server.clients.add(mock_websocket)
+        config_server.add_client(mock_websocket)
 
-        # Simulate register message handling
         widget_id = sample_widget['id']
-        widget_data = {
-            'id': widget_id,
-            'type': sample_widget['widgetType'],
-            'properties': sample_widget['properties'],
-        }
-        config_server.widgets[widget_id] = widget_data
-        config_server.original_widgets[widget_id] = {
-            'id': widget_id,
-            'type': widget_data['type'],
-            'properties': dict(widget_data['properties']),
-        }
+        config_server.store.register(widget_id, sample_widget['widgetType'], sample_widget['properties'])
 
         assert widget_id in config_server.widgets
-        assert widget_id in config_server.original_widgets
+        assert config_server.widgets[widget_id].baseline == sample_widget['properties']
+        await config_server.remove_client(mock_websocket)
 
     @pytest.mark.asyncio
     async def test_broadcast_sends_to_all_clients(self):
         """Broadcast should send message to all connected clients."""
         mock_client1 = AsyncMock()
         mock_client2 = AsyncMock()
-        config_server.clients.add(mock_client1)
-        config_server.clients.add(mock_client2)
+        config_server.add_client(mock_client1)
+        config_server.add_client(mock_client2)
 
         message = {'type': 'test', 'data': 'hello'}
         await config_server.broadcast(message)
+        # Writers deliver asynchronously; removing a client drains its queue
+        await config_server.remove_client(mock_client1)
+        await config_server.remove_client(mock_client2)
 
         mock_client1.send.assert_called_once()
         mock_client2.send.assert_called_once()
@@ -168,12 +388,1097 @@ class TestWebSocketMessages:
         await config_server.broadcast(message)
 
 
+class TestPatchMessages:
+    """Tests for the versioned patch protocol."""
+
+    def setup_method(self):
+        """Reset server state before each test."""
+        config_server.store.clear()
+        config_server.clients.clear()
+
+    def register_msg(self, sample_widget):
+        return {'type': 'register', 'id': sample_widget['id'],
+                'widgetType': sample_widget['widgetType'],
+                'properties': sample_widget['properties']}
+
+    @pytest.mark.asyncio
+    async def test_register_sends_upsert_patch(self, sample_widget):
+        """Register should broadcast a single upsert op."""
+        ws = FakeWebSocket([self.register_msg(sample_widget)])
+        await config_server.handle_websocket(ws)
+
+        assert ws.sent[-1]['type'] == 'patch'
+        op = ws.sent[-1]['ops'][0]
+        assert op['op'] == 'upsert'
+        assert op['widget']['id'] == sample_widget['id']
+        assert op['widget']['modified'] is False
+
+    @pytest.mark.asyncio
+    async def test_update_prop_sends_prop_and_flag_ops(self, sample_widget):
+        """update_prop should send only the changed key, not the whole widget."""
+        widget_id = sample_widget['id']
+        ws = FakeWebSocket([
+            self.register_msg(sample_widget),
+            {'type': 'update_prop', 'id': widget_id, 'key': 'fontSize', 'value': 24},
+            {'type': 'update_prop', 'id': widget_id, 'key': 'color', 'value': '#ff0000'},
+        ])
+        await config_server.handle_websocket(ws)
+
+        first, second = [m for m in ws.sent if m['type'] == 'patch'][-2:]
+        assert first['ops'] == [
+            {'op': 'prop_changed', 'id': widget_id, 'key': 'fontSize', 'value': 24},
+            {'op': 'modified_flag_changed', 'id': widget_id, 'modified': True},
+        ]
+        # Already modified, so no flag op the second time
+        assert second['ops'] == [
+            {'op': 'prop_changed', 'id': widget_id, 'key': 'color', 'value': '#ff0000'},
+        ]
+        assert second['version'] == first['version'] + 1
+
+    @pytest.mark.asyncio
+    async def test_unregister_sends_removed_op(self, sample_widget):
+        """Unregister should not resend the remaining widgets."""
+        widget_id = sample_widget['id']
+        ws = FakeWebSocket([
+            self.register_msg(sample_widget),
+            {'type': 'unregister', 'id': widget_id},
+        ])
+        await config_server.handle_websocket(ws)
+
+        assert ws.sent[-1]['ops'] == [{'op': 'removed', 'id': widget_id}]
+        assert widget_id not in config_server.widgets
+
+    @pytest.mark.asyncio
+    async def test_reset_all_changes_reverts_changed_keys_only(self, sample_widget):
+        """reset_all_changes should emit ops only for modified widgets."""
+        widget_id = sample_widget['id']
+        other = dict(sample_widget, id='otherWidget (test.dart:20:5)')
+        ws = FakeWebSocket([
+            self.register_msg(sample_widget),
+            self.register_msg(other),
+            {'type': 'update_prop', 'id': widget_id, 'key': 'fontSize', 'value': 24},
+            {'type': 'reset_all_changes'},
+        ])
+        await config_server.handle_websocket(ws)
+
+        assert ws.sent[-1]['ops'] == [
+            {'op': 'prop_changed', 'id': widget_id, 'key': 'fontSize', 'value': None},
+            {'op': 'modified_flag_changed', 'id': widget_id, 'modified': False},
+        ]
+        assert config_server.is_modified(widget_id) is False
+
+    @pytest.mark.asyncio
+    async def test_get_all_returns_versioned_snapshot(self, sample_widget):
+        """Full snapshots are only sent on request and carry the current version."""
+        ws = FakeWebSocket([self.register_msg(sample_widget), {'type': 'get_all'}])
+        await config_server.handle_websocket(ws)
+
+        snapshot = next(m for m in ws.sent if m['type'] == 'widgets')
+        assert snapshot['version'] == config_server.store.version
+        assert sample_widget['id'] in snapshot['data']
+
+    def test_snapshot_reuses_cached_fragments(self, sample_widget):
+        """Snapshots are spliced from per-widget JSON that is only re-encoded on change."""
+        store = config_server.store
+        store.register(sample_widget['id'], 'Text', dict(sample_widget['properties']))
+        store.register('other', 'Text', {'fontSize': 12})
+        store.snapshot_json()
+        cached = store._fragments['other']
+
+        store.set_prop(sample_widget['id'], 'fontSize', 24)
+        snapshot = json.loads(store.snapshot_json())
+
+        assert store._fragments['other'] is cached
+        assert snapshot['data'][sample_widget['id']]['properties']['fontSize'] == 24
+        assert snapshot['data'][sample_widget['id']]['modified'] is True
+
+
+class TestPipeline:
+    """Tests for applying every mutation on the single pipeline writer."""
+
+    def setup_method(self):
+        """Reset server state before each test."""
+        config_server.store.clear()
+        config_server.clients.clear()
+
+    def register_msg(self, widget_id):
+        return {'type': 'register', 'id': widget_id, 'widgetType': 'Text', 'properties': {'size': 1}}
+
+    @pytest.mark.asyncio
+    async def test_changes_from_one_tick_go_out_as_one_ordered_patch(self):
+        """A reset_all racing another client's register is seen in the order it was applied."""
+        watcher = FakeWebSocket()
+        config_server.add_client(watcher)
+        version = config_server.store.version
+        hold = asyncio.Event()
+
+        apps = asyncio.gather(
+            config_server.handle_websocket(BurstWebSocket([self.register_msg('a')], hold=hold)),
+            config_server.handle_websocket(BurstWebSocket([{'type': 'reset_all'}], hold=hold)),
+        )
+        await asyncio.sleep(0)
+        await config_server.pipeline.call(lambda: None)
+        hold.set()
+        await apps
+        await config_server.remove_client(watcher)
+
+        patches = [m for m in watcher.sent if m['type'] == 'patch']
+        assert [[op['op'] for op in p['ops']] for p in patches] == [['upsert', 'cleared']]
+        assert patches[0]['version'] == version + 1
+        assert len(config_server.store) == 0
+
+    @pytest.mark.asyncio
+    async def test_reads_see_the_tick_flushed_first(self):
+        """A snapshot requested in the same tick follows the patch it includes."""
+        ws = BurstWebSocket([self.register_msg('a'), {'type': 'get_all'}])
+
+        await config_server.handle_websocket(ws)
+
+        kinds = [m['type'] for m in ws.sent]
+        assert kinds.index('patch') < kinds.index('widgets')
+        patch = next(m for m in ws.sent if m['type'] == 'patch')
+        snapshot = next(m for m in ws.sent if m['type'] == 'widgets')
+        assert snapshot['version'] == patch['version']
+
+    @pytest.mark.asyncio
+    async def test_excluded_sender_batch_follows_earlier_changes(self):
+        """A register_batch (not echoed to its sender) goes out after the tick's earlier ops."""
+        watcher = FakeWebSocket()
+        config_server.add_client(watcher)
+        batch = {'type': 'register_batch', 'widgets': [
+            {'id': 'b', 'widgetType': 'Text', 'properties': {}}]}
+
+        hold = asyncio.Event()
+        app = BurstWebSocket([batch], hold=hold)
+        apps = asyncio.gather(
+            config_server.handle_websocket(BurstWebSocket([self.register_msg('a')], hold=hold)),
+            config_server.handle_websocket(app),
+        )
+        await asyncio.sleep(0)
+        await config_server.pipeline.call(lambda: None)
+        hold.set()
+        await apps
+        await config_server.remove_client(watcher)
+
+        patches = [m for m in watcher.sent if m['type'] == 'patch']
+        assert [[op['widget']['id'] for op in p['ops']] for p in patches] == [['a'], ['b']]
+        assert [m for m in app.sent if m['type'] == 'patch'] == patches[:1]
+
+
+class TestWorkers:
+    """Tests for a worker applying mutations in backplane order (in-process backend)."""
+
+    def setup_method(self):
+        """Reset server state before each test."""
+        config_server.store.clear()
+        config_server.clients.clear()
+        config_server.in_flight.clear()
+
+    def register_msg(self, widget_id):
+        return {'type': 'register', 'id': widget_id, 'widgetType': 'Text', 'properties': {'size': 1},
+                'hash': 'h1'}
+
+    async def join(self, monkeypatch, snapshot=None):
+        """Join this process and a stand-in for another worker to one sequencer."""
+        monkeypatch.setattr(config_server, 'backplane', None)
+        sequencer = Sequencer(snapshot=snapshot)
+        await config_server.join_backplane(LocalBackplane(sequencer))
+        other, records = LocalBackplane(sequencer), []
+        await other.join(records.append)
+        return other, records
+
+    @pytest.mark.asyncio
+    async def test_own_mutation_is_applied_when_sequenced(self, monkeypatch):
+        """The sender gets its ack and, after it, answers to the reads it sent next."""
+        other, records = await self.join(monkeypatch)
+        ws = FakeWebSocket([self.register_msg('a'), {'type': 'get_all'}])
+
+        await config_server.handle_websocket(ws)
+
+        assert [r['message']['type'] for r in records] == ['register']
+        assert records[0]['worker'] == config_server.WORKER_ID
+        assert [m['type'] for m in ws.sent] == ['register_ack', 'patch', 'widgets', 'styles']
+        assert 'a' in ws.sent[2]['data']
+        assert config_server.in_flight == {}
+
+    @pytest.mark.asyncio
+    async def test_other_workers_mutations_reach_local_clients(self, monkeypatch):
+        """A record published elsewhere is applied and broadcast here, without replies."""
+        other, _ = await self.join(monkeypatch)
+        watcher = FakeWebSocket()
+        config_server.add_client(watcher)
+
+        await other.publish({'worker': 'elsewhere', 'client': 1, 'session': 'default',
+                             'message': self.register_msg('a')})
+        await config_server.pipeline.call(lambda: None)
+        await config_server.remove_client(watcher)
+
+        assert 'a' in config_server.store
+        assert [m['type'] for m in watcher.sent] == ['patch']
+
+    @pytest.mark.asyncio
+    async def test_joining_worker_starts_from_snapshot_with_its_own_epoch(self, monkeypatch):
+        config_server.store.register('a', 'Text', {'size': 1})
+        state = json.loads(json.dumps(config_server.capture_state()))
+        epoch = config_server.store.epoch
+        config_server.store.clear()
+
+        await self.join(monkeypatch, snapshot=lambda: state)
+
+        assert config_server.store.properties('a') == {'size': 1}
+        assert config_server.store.epoch != epoch
+
+
+class TestRegisterBatch:
+    """Tests for bulk registration."""
+
+    def setup_method(self):
+        """Reset server state before each test."""
+        config_server.store.clear()
+        config_server.clients.clear()
+
+    def batch_msg(self, count):
+        return {
+            'type': 'register_batch',
+            'schemas': {'Text': [{'key': 'fontSize', 'type': 'number'}]},
+            'widgets': [
+                {'id': f'w{i} (test.dart:{i}:1)', 'widgetType': 'Text', 'properties': {'fontSize': i}}
+                for i in range(count)
+            ],
+        }
+
+    @pytest.mark.asyncio
+    async def test_batch_registers_all_widgets_with_shared_schema(self):
+        """All widgets in a batch are stored and get the shared schema."""
+        await config_server.handle_websocket(FakeWebSocket([self.batch_msg(3)]))
+
+        assert len(config_server.widgets) == 3
+        assert config_server.store.schema_for_type('Text') == [{'key': 'fontSize', 'type': 'number'}]
+        widget = config_server.widget_with_modified_flag('w1 (test.dart:1:1)')
+        assert widget['schemaRef'] == config_server.store.schema_refs['Text']
+        assert 'schema' not in widget
+        assert config_server.widgets['w1 (test.dart:1:1)'].baseline == {'fontSize': 1}
+
+    @pytest.mark.asyncio
+    async def test_batch_sends_one_update_to_other_clients(self):
+        """Other clients get one aggregated patch; the sender gets nothing."""
+        dashboard = AsyncMock()
+        config_server.add_client(dashboard)
+        sender = FakeWebSocket([self.batch_msg(5)])
+
+        await config_server.handle_websocket(sender)
+        await config_server.remove_client(dashboard)
+
+        # Schema definitions first, then a single patch for all widgets
+        sent = [json.loads(call[0][0]) for call in dashboard.send.call_args_list]
+        assert [m['type'] for m in sent] == ['schema_defs', 'patch']
+        patch = sent[1]
+        assert [op['op'] for op in patch['ops']] == ['upsert'] * 5
+        assert sender.sent == []
+
+    @pytest.mark.asyncio
+    async def test_invalid_batch_is_rejected_atomically(self):
+        """A batch with a malformed entry registers nothing."""
+        msg = self.batch_msg(2)
+        msg['widgets'].append({'widgetType': 'Text'})
+        sender = FakeWebSocket([msg])
+
+        await config_server.handle_websocket(sender)
+
+        assert config_server.widgets == {}
+        assert sender.sent[0]['type'] == 'error'
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('change', [
+        {'widgets': [{'id': 7, 'widgetType': 'Text'}]},
+        {'widgets': [{'id': 'w', 'widgetType': ['Text']}]},
+        {'widgets': [{'id': 'w', 'widgetType': 'Text', 'properties': [1]}]},
+        {'schemas': {'Text': 'number'}},
+        {'schemas': [['Text', []]]},
+    ])
+    async def test_wrongly_typed_batch_changes_nothing(self, change):
+        """Entries and schemas are type-checked before any schema is stored."""
+        msg = self.batch_msg(2)
+        if 'widgets' in change:
+            msg['widgets'] += change['widgets']
+        else:
+            msg['schemas'] = change['schemas']
+        version = config_server.store.version
+        sender = FakeWebSocket([msg])
+
+        await config_server.handle_websocket(sender)
+
+        assert config_server.widgets == {}
+        assert config_server.store.schema_for_type('Text') is None
+        assert config_server.store.version == version
+        assert sender.sent == [{'type': 'error', 'error': 'invalid register_batch'}]
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('msg', [
+        {'type': 'register', 'widgetType': 'Text'},
+        {'type': 'register', 'id': 'w', 'widgetType': 'Text', 'properties': 'big'},
+        {'type': 'register', 'id': 'w', 'widgetType': 'Text', 'schema': 3},
+    ])
+    async def test_malformed_register_gets_an_error(self, msg):
+        """A single malformed register is answered, not just logged."""
+        sender = FakeWebSocket([msg])
+
+        await config_server.handle_websocket(sender)
+
+        assert config_server.widgets == {}
+        assert sender.sent == [{'type': 'error', 'error': 'invalid register'}]
+
+
+class TestUpdateThrottle:
+    """Tests for rate-limited update_prop broadcasts."""
+
+    def setup_method(self):
+        """Reset server state before each test."""
+        config_server.store.clear()
+        config_server.clients.clear()
+        config_server.default_session.pending_props.clear()
+        config_server.default_session.pending_flags.clear()
+        config_server.default_session.props_flushed_at = float('-inf')
+        config_server.store.register('w', 'Text', {'fontSize': 10, 'color': None})
+
+    def drag(self, values, key='fontSize'):
+        return [{'type': 'update_prop', 'id': 'w', 'key': key, 'value': v} for v in values]
+
+    @pytest.mark.asyncio
+    async def test_drag_broadcasts_first_and_last_value(self, monkeypatch):
+        """Intermediate values are dropped; the last one always goes out."""
+        monkeypatch.setattr(config_server, 'UPDATE_PROP_RATE', 20)
+        dashboard = FakeWebSocket([])
+        config_server.add_client(dashboard)
+
+        editor = FakeWebSocket(self.drag(range(11, 31)))
+        await config_server.handle_websocket(editor)
+        await asyncio.sleep(0.1)
+        await config_server.remove_client(dashboard)
+
+        patches = [m['ops'] for m in dashboard.sent if m['type'] == 'patch']
+        assert patches == [
+            [{'op': 'prop_changed', 'id': 'w', 'key': 'fontSize', 'value': 11},
+             {'op': 'modified_flag_changed', 'id': 'w', 'modified': True}],
+            [{'op': 'prop_changed', 'id': 'w', 'key': 'fontSize', 'value': 30}],
+        ]
+        assert config_server.store.properties('w')['fontSize'] == 30
+
+    @pytest.mark.asyncio
+    async def test_editor_gets_every_value_immediately(self, monkeypatch):
+        """The originating client is acked without waiting for the broadcast."""
+        monkeypatch.setattr(config_server, 'UPDATE_PROP_RATE', 1)
+        editor = FakeWebSocket(self.drag([11, 12, 10]))
+        await config_server.handle_websocket(editor)
+
+        acks = [(m['value'], m['modified']) for m in editor.sent if m['type'] == 'prop_ack']
+        assert acks == [(11, True), (12, True), (10, False)]
+        config_server.default_session.props_flush.cancel()
+
+    @pytest.mark.asyncio
+    async def test_other_patch_carries_held_edits_first(self, monkeypatch):
+        """A reset right after a drag can't be overtaken by the held values."""
+        monkeypatch.setattr(config_server, 'UPDATE_PROP_RATE', 1)
+        dashboard = FakeWebSocket([])
+        config_server.add_client(dashboard)
+
+        await config_server.handle_websocket(FakeWebSocket(
+            self.drag([11, 12]) + self.drag(['red'], key='color') + [{'type': 'reset', 'id': 'w'}]))
+        config_server.default_session.props_flush.cancel()
+        await config_server.remove_client(dashboard)
+
+        last = [m for m in dashboard.sent if m['type'] == 'patch'][-1]
+        assert last['ops'] == [
+            {'op': 'prop_changed', 'id': 'w', 'key': 'fontSize', 'value': 12},
+            {'op': 'prop_changed', 'id': 'w', 'key': 'color', 'value': 'red'},
+            {'op': 'prop_changed', 'id': 'w', 'key': 'color', 'value': None},
+            {'op': 'prop_changed', 'id': 'w', 'key': 'fontSize', 'value': 10},
+            {'op': 'modified_flag_changed', 'id': 'w', 'modified': False},
+        ]
+        assert config_server.default_session.pending_props == {}
+
+
+class TestRegistrationDedup:
+    """Tests for skipping unchanged re-registrations."""
+
+    def setup_method(self):
+        """Reset server state before each test."""
+        config_server.store.clear()
+        config_server.clients.clear()
+
+    def batch_msg(self, sizes, content_hash=None):
+        return {'type': 'register_batch', 'widgets': [
+            {'id': f'w{i}', 'widgetType': 'Text', 'properties': {'fontSize': size},
+             **({'hash': f'{content_hash}{i}'} if content_hash else {})}
+            for i, size in enumerate(sizes)
+        ]}
+
+    @pytest.mark.asyncio
+    async def test_matching_hash_is_acked_without_broadcast(self):
+        """A reconnect with unchanged hashes only gets an ack."""
+        await config_server.handle_websocket(FakeWebSocket([self.batch_msg([10, 11], 'h')]))
+        original = config_server.widgets['w0']
+        dashboard = AsyncMock()
+        config_server.add_client(dashboard)
+
+        app = FakeWebSocket([self.batch_msg([10, 11], 'h')])
+        await config_server.handle_websocket(app)
+        await config_server.remove_client(dashboard)
+
+        assert app.sent == [{'type': 'register_ack', 'registered': 2, 'unchanged': 2}]
+        dashboard.send.assert_not_called()
+        assert config_server.widgets['w0'] is original
+
+    @pytest.mark.asyncio
+    async def test_equal_content_without_hash_is_not_broadcast(self, sample_widget):
+        """Servers compare content when the client sends no hash."""
+        msg = {'type': 'register', 'id': sample_widget['id'], 'widgetType': 'Text',
+               'properties': dict(sample_widget['properties'])}
+        await config_server.handle_websocket(FakeWebSocket([msg]))
+        version = config_server.store.version
+
+        app = FakeWebSocket([dict(msg, properties=dict(sample_widget['properties']))])
+        await config_server.handle_websocket(app)
+
+        assert app.sent == []
+        assert config_server.store.version == version
+
+    @pytest.mark.asyncio
+    async def test_changed_baseline_sends_minimal_delta(self):
+        """Only the keys that changed are broadcast, and edits are dropped."""
+        await config_server.handle_websocket(FakeWebSocket([self.batch_msg([10, 11], 'a')]))
+        config_server.store.set_prop('w0', 'fontSize', 30)
+        dashboard = AsyncMock()
+        config_server.add_client(dashboard)
+
+        app = FakeWebSocket([self.batch_msg([14, 12], 'b')])
+        await config_server.handle_websocket(app)
+        await config_server.remove_client(dashboard)
+
+        patch = json.loads(dashboard.send.call_args[0][0])
+        assert patch['ops'] == [
+            {'op': 'prop_changed', 'id': 'w0', 'key': 'fontSize', 'value': 14},
+            {'op': 'modified_flag_changed', 'id': 'w0', 'modified': False},
+            {'op': 'prop_changed', 'id': 'w1', 'key': 'fontSize', 'value': 12},
+        ]
+        assert app.sent == [{'type': 'register_ack', 'registered': 2, 'unchanged': 0}]
+
+    def test_dropped_keys_and_type_changes_upsert(self):
+        """Changes a prop delta can't express fall back to an upsert."""
+        store = config_server.store
+        store.register('w', 'Text', {'fontSize': 10, 'color': 'red'})
+
+        assert store.register('w', 'Text', {'fontSize': 10})[0]['op'] == 'upsert'
+        assert store.register('w', 'Button', {'fontSize': 10})[0]['op'] == 'upsert'
+        assert store.by_type == {'Button': {'w'}}
+
+
+class TestCompactStore:
+    """Tests for the baseline + overlay widget representation."""
+
+    def setup_method(self):
+        """Reset server state before each test."""
+        config_server.store.clear()
+
+    def test_widgets_with_the_same_keys_share_interned_names(self):
+        """Property names are stored once per shape and type names are interned."""
+        store = config_server.store
+        first, second = json.loads('[{"a": 1, "b": 2}, {"a": 3, "b": 4}]')
+        store.register('w1', ''.join(['Te', 'xt']), first)
+        store.register('w2', ''.join(['Te', 'xt']), second)
+
+        assert store.widgets['w1'].keys is store.widgets['w2'].keys
+        assert store.widgets['w1'].type is store.widgets['w2'].type
+
+    def test_edits_live_in_an_overlay_over_the_baseline(self):
+        """Only edited keys are kept per widget; the baseline is untouched."""
+        store = config_server.store
+        store.register('w', 'Text', {'fontSize': 14, 'color': 'red'})
+
+        store.set_prop('w', 'fontSize', 20)
+        store.set_prop('w', 'extra', True)
+
+        assert store.changed['w'] == {'fontSize': 20, 'extra': True}
+        assert store.widgets['w'].baseline == {'fontSize': 14, 'color': 'red'}
+        assert store.properties('w') == {'fontSize': 20, 'color': 'red', 'extra': True}
+
+    def test_setting_the_original_value_shrinks_the_overlay(self):
+        """A key edited back to its registered value leaves the overlay."""
+        store = config_server.store
+        store.register('w', 'Text', {'fontSize': 14, 'color': 'red'})
+        store.set_prop('w', 'fontSize', 20)
+        store.set_prop('w', 'color', 'blue')
+
+        store.set_prop('w', 'fontSize', 14)
+        assert store.changed['w'] == {'color': 'blue'}
+        store.set_prop('w', 'color', 'red')
+        assert 'w' not in store.changed
+
+    def test_reset_drops_the_overlay(self):
+        """Reset restores registered values and removes added keys without copying the baseline."""
+        store = config_server.store
+        store.register('w', 'Text', {'fontSize': 14})
+        widget = store.widgets['w']
+        store.set_prop('w', 'fontSize', 20)
+        store.set_prop('w', 'extra', 1)
+
+        ops = store.reset('w')
+
+        # Clients can't drop a key from a prop_changed op, so they get the baseline widget
+        assert ops == [{'op': 'upsert', 'widget': {'id': 'w', 'type': 'Text', 'properties': {'fontSize': 14},
+                                                   'modified': False}}]
+        assert store.properties('w') == {'fontSize': 14}
+        assert store.widgets['w'] is widget
+
+    def test_dump_and_load_round_trip_edits(self):
+        """Snapshots keep live and original properties; loading rebuilds the overlay."""
+        store = config_server.store
+        store.register('w', 'Text', {'fontSize': 14, 'color': 'red'})
+        store.set_prop('w', 'color', 'blue')
+
+        restored = WidgetStore()
+        restored.load(store.dump())
+
+        assert restored.changed == {'w': {'color': 'blue'}}
+        assert restored.widgets['w'].baseline == {'fontSize': 14, 'color': 'red'}
+        assert restored.widget_with_modified_flag('w') == store.widget_with_modified_flag('w')
+
+
+class TestSchemaStore:
+    """Tests for content-addressed schemas."""
+
+    SCHEMA = [{'key': 'fontSize', 'type': 'number'}]
+
+    def setup_method(self):
+        """Reset server state before each test."""
+        config_server.store.clear()
+        config_server.clients.clear()
+
+    def register_msg(self, widget_id, schema):
+        return {'type': 'register', 'id': widget_id, 'widgetType': 'Text',
+                'properties': {}, 'schema': schema}
+
+    def test_identical_schemas_share_one_entry(self):
+        """Schemas are stored once per content hash."""
+        config_server.store_schema('Text', self.SCHEMA)
+        config_server.store_schema('Label', list(self.SCHEMA))
+
+        assert len(config_server.schemas) == 1
+        assert config_server.store.schema_refs['Text'] == config_server.store.schema_refs['Label']
+
+    @pytest.mark.asyncio
+    async def test_schema_sent_once_per_client(self):
+        """A client receives each schema definition only the first time it needs it."""
+        ws = FakeWebSocket([
+            self.register_msg('a', self.SCHEMA),
+            self.register_msg('b', self.SCHEMA),
+            {'type': 'get_all'},
+        ])
+        await config_server.handle_websocket(ws)
+
+        types = [m['type'] for m in ws.sent]
+        assert types.count('schema_defs') == 1
+        ref = config_server.store.schema_refs['Text']
+        snapshot = next(m for m in ws.sent if m['type'] == 'widgets')
+        assert snapshot['data']['a']['schemaRef'] == ref
+        assert 'schema' not in snapshot['data']['a']
+
+    @pytest.mark.asyncio
+    async def test_changed_schema_replaces_old_one(self):
+        """A new schema after hot reload wins and is announced to existing widgets."""
+        new_schema = self.SCHEMA + [{'key': 'color', 'type': 'color'}]
+        ws = FakeWebSocket([
+            self.register_msg('a', self.SCHEMA),
+            self.register_msg('b', new_schema),
+        ])
+        await config_server.handle_websocket(ws)
+
+        ref = config_server.store.schema_refs['Text']
+        assert config_server.schemas[ref] == new_schema
+        assert ws.sent[-1]['ops'][0] == {'op': 'schema_changed', 'type': 'Text', 'schemaRef': ref}
+        assert ws.sent[-2] == {'type': 'schema_defs', 'data': {ref: new_schema}}
+        assert config_server.widget_with_modified_flag('a')['schemaRef'] == ref
+
+
+class TestChangeLog:
+    """Tests for reconnecting with `since` instead of a full snapshot."""
+
+    def setup_method(self):
+        """Reset server state before each test."""
+        config_server.store.clear()
+        config_server.store.change_log.clear()
+        config_server.clients.clear()
+
+    def edit(self, widget_id, value):
+        return {'type': 'update_prop', 'id': widget_id, 'key': 'fontSize', 'value': value}
+
+    @pytest.mark.asyncio
+    async def test_reconnect_gets_only_missed_changes(self, sample_widget):
+        """get_changes answers with one coalesced patch covering the gap."""
+        widget_id = sample_widget['id']
+        config_server.store.register(widget_id, 'Text', dict(sample_widget['properties']))
+        since = config_server.store.version
+        await config_server.handle_websocket(FakeWebSocket([self.edit(widget_id, v) for v in (20, 21, 22)]))
+
+        ws = FakeWebSocket([{'type': 'get_changes', 'since': since, 'epoch': config_server.store.epoch}])
+        await config_server.handle_websocket(ws)
+
+        patch, styles = ws.sent
+        assert patch['base_version'] == since
+        assert patch['version'] == config_server.store.version
+        assert patch['epoch'] == config_server.store.epoch
+        assert [op for op in patch['ops'] if op['op'] == 'prop_changed'] == [
+            {'op': 'prop_changed', 'id': widget_id, 'key': 'fontSize', 'value': 22},
+        ]
+        assert styles['type'] == 'styles'
+
+    @pytest.mark.asyncio
+    async def test_reconnect_across_schema_change(self):
+        """A missed schema change is coalesced by type and lands after the upserts it applies to."""
+        config_server.store.register('a', 'Text', {'fontSize': 14})
+        since = config_server.store.version
+        await config_server.handle_websocket(FakeWebSocket([
+            {'type': 'register', 'id': 'b', 'widgetType': 'Text', 'properties': {'fontSize': 12},
+             'schema': [{'key': 'fontSize', 'type': 'number'}]},
+            {'type': 'register', 'id': 'c', 'widgetType': 'Text', 'properties': {'fontSize': 10},
+             'schema': [{'key': 'fontSize', 'type': 'number', 'min': 8}]},
+        ]))
+        ref = config_server.store.schema_refs['Text']
+
+        ws = FakeWebSocket([{'type': 'get_changes', 'since': since, 'epoch': config_server.store.epoch}])
+        await config_server.handle_websocket(ws)
+
+        patch = next(m for m in ws.sent if m['type'] == 'patch')
+        assert [op['op'] for op in patch['ops']] == ['upsert', 'schema_changed', 'upsert']
+        assert patch['ops'][1] == {'op': 'schema_changed', 'type': 'Text', 'schemaRef': ref}
+        assert patch['ops'][2]['widget']['schemaRef'] == ref
+
+    @pytest.mark.asyncio
+    async def test_up_to_date_client_gets_empty_patch(self):
+        """Nothing missed means an empty patch, not a snapshot."""
+        version = config_server.store.version
+        ws = FakeWebSocket([{'type': 'get_changes', 'since': version, 'epoch': config_server.store.epoch}])
+        await config_server.handle_websocket(ws)
+
+        assert ws.sent[0]['ops'] == []
+        assert ws.sent[0]['version'] == version
+
+    @pytest.mark.asyncio
+    async def test_truncated_log_falls_back_to_snapshot(self, sample_widget, monkeypatch):
+        """A version older than the log reaches gets the full snapshot."""
+        widget_id = sample_widget['id']
+        config_server.store.register(widget_id, 'Text', dict(sample_widget['properties']))
+        since = config_server.store.version
+        monkeypatch.setattr(config_server.store, 'change_log', deque(maxlen=2))
+        await config_server.handle_websocket(FakeWebSocket([self.edit(widget_id, v) for v in (20, 21, 22)]))
+
+        ws = FakeWebSocket([{'type': 'get_changes', 'since': since, 'epoch': config_server.store.epoch}])
+        await config_server.handle_websocket(ws)
+
+        assert [m['type'] for m in ws.sent] == ['widgets', 'styles']
+        assert ws.sent[0]['epoch'] == config_server.store.epoch
+
+    @pytest.mark.asyncio
+    async def test_other_epoch_falls_back_to_snapshot(self):
+        """A version from a server that lost its state is not trusted."""
+        ws = FakeWebSocket([{'type': 'get_changes', 'since': 0, 'epoch': 'someother'}])
+        await config_server.handle_websocket(ws)
+
+        assert ws.sent[0]['type'] == 'widgets'
+
+    def test_epoch_and_version_survive_handoff(self, tmp_path):
+        """A restart with state handoff keeps the version sequence."""
+        config_server.store.register('w', 'Text', {})
+        config_server.make_patch([])
+        epoch, version = config_server.store.epoch, config_server.store.version
+        path = tmp_path / 'state.json'
+
+        config_server.save_handoff(path)
+        config_server.store.epoch = 'changed'
+        config_server.restore_handoff(path)
+
+        assert (config_server.store.epoch, config_server.store.version) == (epoch, version)
+
+
+class TestQuery:
+    """Tests for the paged, indexed query API."""
+
+    def setup_method(self):
+        """Register a small catalog across types and files."""
+        config_server.store.clear()
+        config_server.clients.clear()
+        for i in range(5):
+            config_server.store.register(f'title{i} (package:app/home.dart:{i}:1)', 'Text', {'size': i})
+            config_server.store.register(f'box{i} (lib/settings.dart:{i}:1)', 'Container', {'size': i})
+        config_server.store.set_prop('title3 (package:app/home.dart:3:1)', 'size', 99)
+
+    def test_pages_follow_cursor(self):
+        """Pages are ordered by (type, id) and the cursor resumes after the last one."""
+        ids, total, cursor = config_server.store.query(limit=4)
+        rest, _, end = config_server.store.query(limit=10, cursor=cursor)
+
+        assert total == 10
+        assert ids[0].startswith('box0')
+        assert len(ids) + len(rest) == 10
+        assert not set(ids) & set(rest)
+        assert end is None
+
+    def test_filters_combine(self):
+        """Type, file, id substring and modified filters narrow together."""
+        store = config_server.store
+        assert store.query(types=['Text'])[1] == 5
+        assert store.query(file='lib/settings.dart')[1] == 5
+        assert store.query(file='app/home.dart', modified=True)[0] == ['title3 (package:app/home.dart:3:1)']
+        assert store.query(id_contains='TITLE', modified=False)[1] == 4
+        assert store.query(types=['Text'], file='lib/settings.dart')[1] == 0
+
+    def test_indexes_follow_unregister_and_reset(self):
+        """Indexes stay in sync with the store."""
+        store = config_server.store
+        store.unregister('box0 (lib/settings.dart:0:1)')
+        store.reset('title3 (package:app/home.dart:3:1)')
+
+        assert store.query(types=['Container'])[1] == 4
+        assert store.query(modified=True)[1] == 0
+        assert store.facets() == ({'Text': 5, 'Container': 4}, {'app/home.dart': 5, 'lib/settings.dart': 4})
+
+    @pytest.mark.asyncio
+    async def test_query_message(self):
+        """query returns a page, a cursor and facets on the first page."""
+        ws = FakeWebSocket([
+            {'type': 'query', 'types': 'Text', 'limit': 2, 'request_id': 1},
+            {'type': 'query', 'limit': 'x', 'request_id': 2},
+            {'type': 'query', 'id_contains': 5, 'request_id': 3},
+            {'type': 'query', 'types': [['Text']], 'request_id': 4},
+            {'type': 'query', 'cursor': [1, 2], 'request_id': 5},
+        ])
+        await config_server.handle_websocket(ws)
+
+        result, error, *errors = ws.sent
+        assert result['type'] == 'query_result'
+        assert result['request_id'] == 1
+        assert result['total'] == 5
+        assert len(result['widgets']) == 2
+        assert result['cursor'] == ['Text', 'title1 (package:app/home.dart:1:1)']
+        assert result['types'] == {'Text': 5, 'Container': 5}
+        assert error == {'type': 'error', 'error': 'invalid query', 'request_id': 2}
+        assert errors == [{'type': 'error', 'error': 'invalid query', 'request_id': i} for i in (3, 4, 5)]
+
+    def test_first_page_of_large_catalog_is_fast(self):
+        """Page one of 20k widgets is served in milliseconds."""
+        store = config_server.store
+        for i in range(20000):
+            store.register(f'w{i} (lib/screen{i % 40}.dart:{i}:1)', f'Type{i % 12}', {'v': i})
+        store.query(limit=1)  # Builds the sorted order once
+
+        started = time.perf_counter()
+        result = config_server.query_result({'type': 'query', 'limit': 200})
+        filtered = config_server.query_result({'type': 'query', 'types': ['Type3'], 'file': 'lib/screen3.dart'})
+        elapsed = time.perf_counter() - started
+
+        assert len(result['widgets']) == 200
+        assert filtered['total'] == 20000 // 120 + 1
+        assert elapsed < 0.05
+
+
+class TestSessions:
+    """Tests for session namespaces and subscriptions."""
+
+    def setup_method(self):
+        """Reset server state before each test."""
+        config_server.store.clear()
+        config_server.clients.clear()
+        for name in list(config_server.sessions):
+            if name != 'default':
+                del config_server.sessions[name]
+
+    def register_msg(self, widget_id, widget_type='Text', **properties):
+        return {'type': 'register', 'id': widget_id, 'widgetType': widget_type,
+                'properties': properties or {'fontSize': 14}}
+
+    @pytest.mark.asyncio
+    async def test_empty_sessions_are_dropped_when_their_last_client_leaves(self):
+        """Sessions without widgets or styles are forgotten; ones holding state are kept."""
+        await config_server.handle_websocket(FakeWebSocket([{'type': 'get_styles'}], path='/probe'))
+        await config_server.handle_websocket(FakeWebSocket([self.register_msg('w1')], path='/ios'))
+        ws = FakeWebSocket([{'type': 'hello', 'session': 'android'}], path='/web')
+        await config_server.handle_websocket(ws)
+
+        assert set(config_server.sessions) == {'default', 'ios'}
+
+    @pytest.mark.asyncio
+    async def test_sessions_are_isolated(self):
+        """Apps on different paths have separate widgets; reset_all clears only their own."""
+        dashboard = FakeWebSocket()
+        config_server.add_client(dashboard, config_server.get_session('ios'))
+
+        await config_server.handle_websocket(FakeWebSocket([self.register_msg('ios1')], path='/ios'))
+        await config_server.handle_websocket(FakeWebSocket([
+            {'type': 'reset_all'}, self.register_msg('web1'),
+        ], path='/web'))
+        await asyncio.sleep(0)
+        await config_server.remove_client(dashboard)
+
+        assert list(config_server.sessions['ios'].store.widgets) == ['ios1']
+        assert list(config_server.sessions['web'].store.widgets) == ['web1']
+        assert len(config_server.widgets) == 0
+        # The ios dashboard only saw the ios registration
+        assert [op['widget']['id'] for m in dashboard.sent for op in m['ops']] == ['ios1']
+
+    @pytest.mark.asyncio
+    async def test_hello_switches_session(self):
+        """A hello message moves the client to the named session."""
+        ws = FakeWebSocket([{'type': 'hello', 'session': 'android'}, self.register_msg('a1')])
+        await config_server.handle_websocket(ws)
+
+        assert ws.sent[0] == {'type': 'session', 'name': 'android'}
+        assert 'a1' in config_server.sessions['android'].store
+        assert 'a1' not in config_server.store
+
+    @pytest.mark.asyncio
+    async def test_subscriber_only_gets_its_widgets(self):
+        """A type subscriber gets a filtered snapshot and only matching ops, chained by base_version."""
+        config_server.store.register('t1', 'Text', {'fontSize': 14})
+        config_server.store.register('b1', 'Button', {'label': 'Go'})
+        watcher = FakeWebSocket()
+        queue = config_server.add_client(watcher)
+        config_server.default_session.subscribe(queue, types=['Text'])
+        for message, encoded in config_server.snapshot_messages(queue):
+            queue.put(message, encoded)
+
+        await config_server.handle_websocket(FakeWebSocket([
+            {'type': 'update_prop', 'id': 'b1', 'key': 'label', 'value': 'Stop'},
+            {'type': 'update_prop', 'id': 't1', 'key': 'fontSize', 'value': 20},
+            self.register_msg('t2'),
+            {'type': 'unregister', 'id': 't2'},
+        ]))
+        await asyncio.sleep(0)
+        await config_server.remove_client(watcher)
+
+        snapshot = next(m for m in watcher.sent if m['type'] == 'widgets')
+        patches = [m for m in watcher.sent if m['type'] == 'patch']
+        assert list(snapshot['data']) == ['t1']
+        assert [[op['op'] for op in p['ops']] for p in patches] == [
+            ['prop_changed', 'modified_flag_changed'], ['upsert'], ['removed'],
+        ]
+        assert patches[0]['base_version'] == snapshot['version']
+        assert [p['base_version'] for p in patches[1:]] == [p['version'] for p in patches[:-1]]
+
+    @pytest.mark.asyncio
+    async def test_sessions_survive_restart(self, tmp_path):
+        """Handoff state keeps every session."""
+        await config_server.handle_websocket(FakeWebSocket([self.register_msg('ios1')], path='/ios'))
+        path = tmp_path / 'state.json'
+        config_server.save_handoff(path)
+        del config_server.sessions['ios']
+
+        config_server.restore_handoff(path)
+
+        assert 'ios1' in config_server.sessions['ios'].store
+
+
+class TestJournalPersistence:
+    """Tests for restoring state from the journal."""
+
+    def setup_method(self):
+        """Reset server state before each test."""
+        config_server.store.clear()
+        config_server.clients.clear()
+
+    def teardown_method(self):
+        config_server.journal = None
+
+    @pytest.mark.asyncio
+    async def test_edits_survive_restart(self, sample_widget, tmp_path):
+        """Registered widgets, edits and styles are restored from the journal."""
+        widget_id = sample_widget['id']
+        config_server.open_journal(tmp_path)
+        ws = FakeWebSocket([
+            {'type': 'register', 'id': widget_id, 'widgetType': sample_widget['widgetType'],
+             'properties': dict(sample_widget['properties']), 'schema': {'fontSize': 'double'}},
+            {'type': 'update_prop', 'id': widget_id, 'key': 'fontSize', 'value': 24},
+            {'type': 'styles', 'data': {'colors': {'primary': '#ff0000'}}},
+        ])
+        await config_server.handle_websocket(ws)
+        await config_server.close_journal()
+
+        config_server.store.clear()
+        config_server.styles.clear()
+        config_server.open_journal(tmp_path)
+        await config_server.close_journal()
+
+        assert config_server.store.properties(widget_id)['fontSize'] == 24
+        assert config_server.is_modified(widget_id) is True
+        assert config_server.store.schema_for_type(sample_widget['widgetType']) == {'fontSize': 'double'}
+        assert config_server.styles['colors'] == {'primary': '#ff0000'}
+
+    @pytest.mark.asyncio
+    async def test_app_reconnect_keeps_restored_edits(self, sample_widget, tmp_path):
+        """Re-registering the same baseline after a restart does not wipe edits."""
+        widget_id = sample_widget['id']
+        config_server.open_journal(tmp_path, snapshot_every=1)
+        config_server.store.register(widget_id, sample_widget['widgetType'],
+                                     dict(sample_widget['properties']))
+        config_server.journal_record('register', id=widget_id, type=sample_widget['widgetType'],
+                                     properties=dict(sample_widget['properties']))
+        config_server.store.set_prop(widget_id, 'fontSize', 30)
+        config_server.journal_record('update_prop', id=widget_id, key='fontSize', value=30)
+        await config_server.close_journal()
+
+        config_server.store.clear()
+        config_server.open_journal(tmp_path)
+        await config_server.handle_websocket(FakeWebSocket([
+            {'type': 'register', 'id': widget_id, 'widgetType': sample_widget['widgetType'],
+             'properties': dict(sample_widget['properties'])},
+        ]))
+        await config_server.close_journal()
+
+        assert config_server.store.properties(widget_id)['fontSize'] == 30
+        assert (tmp_path / 'snapshot.json').exists()
+
+    @pytest.mark.asyncio
+    async def test_replayed_records_rotate_the_epoch(self, tmp_path):
+        """Changes replayed after the snapshot aren't hidden from catching-up clients."""
+        config_server.open_journal(tmp_path, snapshot_every=1)
+        await config_server.handle_websocket(FakeWebSocket([
+            {'type': 'register', 'id': 'w', 'widgetType': 'Text', 'properties': {'x': 1}},
+        ]))
+        await asyncio.sleep(0.1)  # Let the snapshot be written
+        config_server.journal.snapshot_every = 10**9
+        await config_server.handle_websocket(FakeWebSocket([
+            {'type': 'update_prop', 'id': 'w', 'key': 'x', 'value': 99},
+        ]))
+        version, epoch = config_server.store.version, config_server.store.epoch
+        await config_server.close_journal()
+
+        config_server.store.clear()
+        config_server.open_journal(tmp_path, snapshot_every=10**9)
+        await config_server.close_journal()
+
+        assert config_server.store.properties('w')['x'] == 99
+        assert config_server.store.epoch != epoch
+        assert config_server.catch_up_patch(version, epoch) is None
+
+    @pytest.mark.asyncio
+    async def test_large_journal_replays_quickly(self, tmp_path):
+        """Replaying a large journal stays well under a second."""
+        config_server.open_journal(tmp_path, snapshot_every=10**9)
+        for i in range(1000):
+            config_server.journal_record('register', id=f'w{i}', type='Text', properties={'size': 1})
+        for i in range(20000):
+            config_server.journal_record('update_prop', id=f'w{i % 1000}', key='size', value=i)
+        await config_server.close_journal()
+
+        config_server.store.clear()
+        started = asyncio.get_running_loop().time()
+        config_server.open_journal(tmp_path)
+        elapsed = asyncio.get_running_loop().time() - started
+        await config_server.close_journal()
+
+        assert len(config_server.widgets) == 1000
+        assert config_server.store.properties('w999')['size'] == 19999
+        assert elapsed < 1.0
+
+
+class TestReload:
+    """Tests for the dashboard hot swap and restart state handoff."""
+
+    def setup_method(self):
+        """Reset server state before each test."""
+        config_server.store.clear()
+        config_server.clients.clear()
+
+    @pytest.mark.asyncio
+    async def test_dashboard_change_is_hot_swapped(self, tmp_path, monkeypatch):
+        """Editing dashboard.html swaps it in memory and tells clients to reload."""
+        path = tmp_path / 'dashboard.html'
+        path.write_text('<html>old</html>', encoding='utf-8')
+        monkeypatch.setattr(config_server, 'DASHBOARD_PATH', path)
+        monkeypatch.setattr(config_server.dashboard, 'path', path)
+        config_server.load_dashboard()
+        ws = FakeWebSocket()
+        client = config_server.add_client(ws)
+        ios = FakeWebSocket()
+        ios_client = config_server.add_client(ios, config_server.get_session('ios'))
+
+        task = asyncio.create_task(config_server.watch_dashboard())
+        await asyncio.sleep(0.05)
+        path.write_text('<html>new</html>', encoding='utf-8')
+        stat = path.stat()
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+        # A page load picking up the new file first doesn't swallow the reload
+        config_server.process_request(None, Request('/', Headers()))
+        for _ in range(100):
+            await asyncio.sleep(0.02)
+            if {'type': 'dashboard_reload'} in ios.sent:
+                break
+        task.cancel()
+        await client.close()
+        await ios_client.close()
+        config_server.detach_client(ios)
+
+        assert config_server.DASHBOARD_HTML == '<html>new</html>'
+        # Dashboards in every session reload
+        assert {'type': 'dashboard_reload'} in ws.sent
+        assert {'type': 'dashboard_reload'} in ios.sent
+        config_server.dashboard.path = Path(config_server.__file__).parent / 'dashboard.html'
+        config_server.load_dashboard()
+
+    def test_handoff_restores_state(self, sample_widget, tmp_path):
+        """State written on shutdown is restored by the next process, once."""
+        widget_id = sample_widget['id']
+        config_server.store.register(widget_id, sample_widget['widgetType'],
+                                     dict(sample_widget['properties']))
+        config_server.store.set_prop(widget_id, 'fontSize', 24)
+        path = tmp_path / 'state.json'
+
+        config_server.save_handoff(path)
+        config_server.store.clear()
+
+        assert config_server.restore_handoff(path) is True
+        assert config_server.store.properties(widget_id)['fontSize'] == 24
+        assert config_server.is_modified(widget_id) is True
+        assert not path.exists()
+        assert config_server.restore_handoff(path) is False
+
+
+class TestTrafficCapture:
+    """Tests for capturing traffic for replay."""
+
+    def setup_method(self):
+        """Reset server state before each test."""
+        config_server.store.clear()
+        config_server.clients.clear()
+
+    @pytest.mark.asyncio
+    async def test_messages_both_ways_and_final_state_are_captured(self, tmp_path):
+        path = tmp_path / 'traffic.jsonl'
+        config_server.open_capture(path)
+        register = {'type': 'register', 'id': 'a', 'widgetType': 'Text', 'properties': {'size': 1}}
+        ws = FakeWebSocket([register, {'type': 'get_styles'}], path='/ios')
+
+        await config_server.handle_websocket(ws)
+        await config_server.close_capture()
+
+        events = list(read_capture(path))
+        kinds = [(kind, data.get('type') if isinstance(data, dict) else None) for _, _, kind, data in events]
+        assert kinds[:2] == [('open', None), ('in', 'register')]
+        assert ('out', 'patch') in kinds and ('out', 'styles') in kinds
+        assert kinds[-2:] == [('close', None), ('state', None)]
+        assert events[0][3] == {'path': '/ios', 'subprotocol': None}
+        assert [data for _, _, kind, data in events if kind == 'out'] == ws.sent
+        state = events[-1][3]
+        assert state['ios']['widgets']['a']['properties'] == {'size': 1}
+        assert config_server.capture is None
+
+
 class TestStylesManagement:
     """Tests for styles registration and management."""
 
     def setup_method(self):
         """Reset server state before each test."""
-        config_server.styles = {'colors': {}, 'sizes': {}, 'textStyles': {}, 'custom': {}}
+        config_server.styles.clear()
+        config_server.styles.update(default_styles())
 
     def test_styles_update(self, sample_styles):
         """Styles should be updated correctly."""
@@ -194,66 +1499,154 @@ class TestStylesManagement:
         assert primary['light'] != primary['dark']
 
 
+class TestStyleTokens:
+    """Tests for per-token style updates and the token -> widget index."""
+
+    def setup_method(self):
+        """Reset server state before each test."""
+        config_server.store.clear()
+        config_server.clients.clear()
+        config_server.default_session.update_styles(default_styles())
+        config_server.default_session.update_styles({'sizes': {'padding-sm': 8.0, 'padding-md': 16.0}})
+        config_server.store.register('a', 'Padding', {'padding': 'padding-sm'})
+        config_server.store.register('b', 'Padding', {'padding': 'padding-sm', 'gap': 'padding-md'})
+        config_server.store.register('c', 'Padding', {'padding': 4.0})
+
+    @pytest.mark.asyncio
+    async def test_upsert_sends_diff_with_affected_widgets(self):
+        """Editing one token leaves the rest of the category alone."""
+        dashboard = FakeWebSocket([])
+        config_server.add_client(dashboard)
+
+        await config_server.handle_websocket(FakeWebSocket([
+            {'type': 'style_upsert', 'category': 'sizes', 'name': 'padding-sm', 'value': 10.0},
+        ]))
+        await config_server.remove_client(dashboard)
+
+        assert dashboard.sent == [{'type': 'style_changed', 'category': 'sizes', 'name': 'padding-sm',
+                                   'value': 10.0, 'widgets': ['a', 'b']}]
+        assert config_server.styles['sizes'] == {'padding-sm': 10.0, 'padding-md': 16.0}
+
+    @pytest.mark.asyncio
+    async def test_styles_broadcast_names_widgets_using_changed_tokens(self):
+        """Replacing a category lists the users of tokens that changed, were added or removed."""
+        dashboard = FakeWebSocket([])
+        config_server.add_client(dashboard)
+        config_server.store.register('d', 'Padding', {'padding': 'padding-lg'})
+
+        await config_server.handle_websocket(FakeWebSocket([
+            {'type': 'styles', 'data': {'sizes': {'padding-sm': 8.0, 'padding-lg': 24.0}}},
+        ]))
+        await config_server.remove_client(dashboard)
+
+        # padding-sm kept its value; padding-md was removed and padding-lg added
+        assert dashboard.sent[-1]['widgets'] == ['b', 'd']
+
+    @pytest.mark.asyncio
+    async def test_delete_token(self):
+        """Deleting a token reports its users; unknown tokens are ignored."""
+        ws = FakeWebSocket([
+            {'type': 'style_delete', 'category': 'sizes', 'name': 'padding-md'},
+            {'type': 'style_delete', 'category': 'sizes', 'name': 'missing'},
+        ])
+        await config_server.handle_websocket(ws)
+
+        assert ws.sent == [{'type': 'style_changed', 'category': 'sizes', 'name': 'padding-md',
+                            'deleted': True, 'widgets': ['b']}]
+        assert 'padding-md' not in config_server.styles['sizes']
+        assert 'padding-md' not in config_server.store.token_refs
+
+    def test_index_follows_edits(self):
+        """Property edits, resets and unregistrations keep the index current."""
+        store = config_server.store
+        store.set_prop('c', 'padding', 'padding-md')
+        store.set_prop('b', 'gap', 'padding-sm')
+        assert store.widgets_using('padding-md') == {'c'}
+
+        store.reset('c')
+        store.set_prop('b', 'padding', 12.0)  # gap still names padding-sm
+        assert store.widgets_using('padding-md') == set()
+        assert store.widgets_using('padding-sm') == {'a', 'b'}
+
+        store.unregister('a')
+        assert store.widgets_using('padding-sm') == {'b'}
+
+    def test_new_token_indexes_existing_widgets(self):
+        """Widgets that named a token before it existed are picked up."""
+        config_server.store.register('d', 'Padding', {'padding': 'padding-lg'})
+
+        affected = config_server.default_session.upsert_style('sizes', 'padding-lg', 24.0)
+
+        assert affected == {'d'}
+
+    @pytest.mark.asyncio
+    async def test_token_edits_are_journaled(self, tmp_path):
+        """style_upsert and style_delete survive a restart."""
+        config_server.open_journal(tmp_path)
+        await config_server.handle_websocket(FakeWebSocket([
+            {'type': 'style_upsert', 'category': 'colors', 'name': 'accent', 'value': {'light': '#f00'}},
+            {'type': 'style_delete', 'category': 'sizes', 'name': 'padding-md'},
+        ]))
+        await config_server.close_journal()
+        config_server.default_session.update_styles({'colors': {}, 'sizes': {'padding-md': 16.0}})
+
+        config_server.open_journal(tmp_path)
+        await config_server.close_journal()
+
+        assert config_server.styles['colors'] == {'accent': {'light': '#f00'}}
+        assert 'padding-md' not in config_server.styles['sizes']
+
+
 class TestResetFunctionality:
     """Tests for reset functionality."""
 
     def setup_method(self):
         """Reset server state before each test."""
-        config_server.widgets.clear()
-        config_server.original_widgets.clear()
+        config_server.store.clear()
 
     def test_reset_widget_restores_original(self, sample_widget):
         """Reset should restore widget to original properties."""
         widget_id = sample_widget['id']
 
         # Register widget
-        config_server.widgets[widget_id] = {
-            'id': widget_id,
-            'type': sample_widget['widgetType'],
-            'properties': dict(sample_widget['properties']),
-        }
-        config_server.original_widgets[widget_id] = {
-            'id': widget_id,
-            'type': sample_widget['widgetType'],
-            'properties': dict(sample_widget['properties']),
-        }
+        config_server.store.register(widget_id, sample_widget['widgetType'],
+                                     dict(sample_widget['properties']))
 
         # Modify widget
-        config_server.widgets[widget_id]['properties']['fontSize'] = 24
-        config_server.widgets[widget_id]['properties']['color'] = '#ff0000'
+        config_server.store.set_prop(widget_id, 'fontSize', 24)
+        config_server.store.set_prop(widget_id, 'color', '#ff0000')
 
         assert config_server.is_modified(widget_id) is True
 
         # Reset widget
-        config_server.widgets[widget_id] = {
-            'id': widget_id,
-            'type': config_server.original_widgets[widget_id]['type'],
-            'properties': dict(config_server.original_widgets[widget_id]['properties']),
-        }
+        ops = config_server.store.reset(widget_id)
 
         assert config_server.is_modified(widget_id) is False
-        assert config_server.widgets[widget_id]['properties']['fontSize'] is None
+        assert config_server.store.properties(widget_id)['fontSize'] is None
+        assert [op['key'] for op in ops if op['op'] == 'prop_changed'] == ['color', 'fontSize']
+
+    def test_reset_removes_keys_added_after_registration(self, sample_widget):
+        """Keys that were not registered are dropped on reset."""
+        widget_id = sample_widget['id']
+        config_server.store.register(widget_id, sample_widget['widgetType'],
+                                     dict(sample_widget['properties']))
+        config_server.store.set_prop(widget_id, 'extra', 1)
+
+        config_server.store.reset(widget_id)
+
+        assert 'extra' not in config_server.store.properties(widget_id)
 
     def test_reset_all_clears_state(self, sample_widget):
         """Reset all should clear all widgets."""
         widget_id = sample_widget['id']
-        config_server.widgets[widget_id] = {
-            'id': widget_id,
-            'type': sample_widget['widgetType'],
-            'properties': sample_widget['properties'],
-        }
-        config_server.original_widgets[widget_id] = {
-            'id': widget_id,
-            'type': sample_widget['widgetType'],
-            'properties': sample_widget['properties'],
-        }
+        config_server.store.register(widget_id, sample_widget['widgetType'], sample_widget['properties'])
+        config_server.store.set_prop(widget_id, 'fontSize', 24)
 
         # Clear all
-        config_server.widgets.clear()
-        config_server.original_widgets.clear()
+        config_server.store.clear()
 
         assert len(config_server.widgets) == 0
-        assert len(config_server.original_widgets) == 0
+        assert len(config_server.store.changed) == 0
 
 
 if __name__ == '__main__':
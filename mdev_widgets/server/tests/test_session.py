@@ -0,0 +1,104 @@
+"""Tests for session subscriptions and op routing."""
+
+import pytest
+import sys
+from pathlib import Path
+
+# Add parent directory to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from session import DEFAULT_SESSION, Session, session_from_path
+
+
+def upsert(widget_id, widget_type):
+    return {'op': 'upsert', 'widget': {'id': widget_id, 'type': widget_type}}
+
+
+@pytest.fixture
+def session():
+    """Session with two Text widgets and a Button."""
+    session = Session('test')
+    session.store.register('t1', 'Text', {})
+    session.store.register('t2', 'Text', {})
+    session.store.register('b1', 'Button', {})
+    return session
+
+
+class TestSessionFromPath:
+    """Tests for picking a session from the connect path."""
+
+    def test_root_is_default(self):
+        assert session_from_path('/') == DEFAULT_SESSION
+        assert session_from_path(None) == DEFAULT_SESSION
+
+    def test_path_names_session(self):
+        assert session_from_path('/ios?x=1') == 'ios'
+        assert session_from_path('/my%20app/') == 'my app'
+
+
+class TestRouting:
+    """Tests for routing patch ops to subscribers."""
+
+    def test_unsubscribed_clients_are_not_routed(self, session):
+        """Clients without a subscription get the full patch, not routed ops."""
+        session.add_client('ws', 'queue')
+        assert 'queue' in session.everything
+        assert session.route([{'op': 'prop_changed', 'id': 't1', 'key': 'k', 'value': 1}]) == {}
+
+    def test_type_and_id_subscriptions(self, session):
+        """Ops reach subscribers of the widget's type or id only."""
+        session.add_client('a', 'texts')
+        session.add_client('b', 'button')
+        session.subscribe('texts', types=['Text'])
+        session.subscribe('button', ids=['b1'])
+
+        routed = session.route([
+            {'op': 'prop_changed', 'id': 't2', 'key': 'k', 'value': 1},
+            {'op': 'prop_changed', 'id': 'b1', 'key': 'k', 'value': 2},
+            {'op': 'schema_changed', 'type': 'Text', 'schemaRef': 'abc'},
+        ])
+
+        assert [op['id'] if 'id' in op else op['type'] for op in routed['texts']] == ['t2', 'Text']
+        assert [op['id'] for op in routed['button']] == ['b1']
+        assert session.everything == set()
+
+    def test_new_widget_of_subscribed_type_is_routed_until_removed(self, session):
+        """Type interest follows widgets as they register and unregister."""
+        session.add_client('a', 'texts')
+        session.subscribe('texts', types=['Text'])
+
+        assert session.route([upsert('t3', 'Text')]) == {'texts': [upsert('t3', 'Text')]}
+        assert 'texts' in session.route([{'op': 'removed', 'id': 't3'}])
+        assert 't3' not in session.by_id
+
+    def test_id_subscription_survives_removal(self, session):
+        """Explicit id interest outlives an unregister (e.g. hot reload)."""
+        session.add_client('a', 'one')
+        session.subscribe('one', ids=['t1'])
+        session.route([{'op': 'removed', 'id': 't1'}])
+
+        assert session.route([upsert('t1', 'Text')]) == {'one': [upsert('t1', 'Text')]}
+
+    def test_empty_subscription_means_everything(self, session):
+        """Subscribing to nothing goes back to receiving every op."""
+        session.add_client('a', 'q')
+        session.subscribe('q', types=['Text'])
+        session.subscribe('q')
+
+        assert 'q' in session.everything
+        assert session.by_id == {} and session.by_type == {}
+
+    def test_remove_client_drops_indexes(self, session):
+        """Disconnecting cleans up every index entry."""
+        session.add_client('a', 'q')
+        session.subscribe('q', types=['Text'], ids=['b1'])
+        session.remove_client('a')
+
+        assert session.by_id == {} and session.by_type == {} and session.subscriptions == {}
+
+    def test_visible_ids(self, session):
+        """Snapshots of subscribed clients only contain their widgets."""
+        session.add_client('a', 'q')
+        assert session.visible_ids('q') is None
+        session.subscribe('q', types=['Button'], ids=['t2'])
+        assert session.visible_ids('q') == ['t2', 'b1']
@@ -0,0 +1,101 @@
+"""Tests for cached, precompressed static assets."""
+
+import gzip
+import os
+import pytest
+import sys
+from pathlib import Path
+
+# Add parent directory to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from static_asset import StaticAsset, parse_accept_encoding
+
+
+@pytest.fixture
+def asset(tmp_path):
+    """Asset backed by a temporary HTML file."""
+    path = tmp_path / 'page.html'
+    path.write_text('<html>' + 'x' * 2000 + '</html>', encoding='utf-8')
+    return StaticAsset(path, 'text/html', fallback='missing')
+
+
+class TestAcceptEncoding:
+    """Tests for Accept-Encoding parsing."""
+
+    def test_parses_q_values(self):
+        """Codings default to q=1 and honour explicit weights."""
+        assert parse_accept_encoding('gzip, br;q=0.5, identity;q=0') == {
+            'gzip': 1.0, 'br': 0.5, 'identity': 0.0,
+        }
+
+    def test_empty_header(self):
+        """Missing header means no codings."""
+        assert parse_accept_encoding(None) == {}
+
+
+class TestStaticAsset:
+    """Tests for serving from memory."""
+
+    def test_gzip_served_when_accepted(self, asset):
+        """gzip variant is chosen and decodes to the file contents."""
+        status, body, headers = asset.respond({'Accept-Encoding': 'gzip, deflate'})
+
+        assert status == 200
+        assert headers['Content-Encoding'] == 'gzip'
+        assert gzip.decompress(body) == asset.variants['identity']
+        assert len(body) < len(asset.variants['identity'])
+
+    def test_identity_without_accept_encoding(self, asset):
+        """Clients that accept no compression get the plain body."""
+        status, body, headers = asset.respond({})
+
+        assert status == 200
+        assert 'Content-Encoding' not in headers
+        assert body.startswith(b'<html>')
+
+    def test_gzip_refused_with_q_zero(self, asset):
+        """q=0 excludes a coding."""
+        _, _, headers = asset.respond({'Accept-Encoding': 'gzip;q=0'})
+        assert 'Content-Encoding' not in headers
+
+    def test_conditional_get_returns_304(self, asset):
+        """A matching If-None-Match gets an empty 304."""
+        _, _, headers = asset.respond({'Accept-Encoding': 'gzip'})
+
+        status, body, _ = asset.respond({'Accept-Encoding': 'gzip', 'If-None-Match': headers['ETag']})
+
+        assert status == 304
+        assert body == b''
+
+    def test_etag_differs_per_encoding(self, asset):
+        """A gzip ETag does not validate the identity variant."""
+        _, _, gzip_headers = asset.respond({'Accept-Encoding': 'gzip'})
+
+        status, _, _ = asset.respond({'If-None-Match': gzip_headers['ETag']})
+
+        assert status == 200
+
+    def test_file_read_once_until_mtime_changes(self, asset):
+        """Unchanged files are not re-read; a newer mtime triggers a reload."""
+        asset.respond({})
+        assert asset.refresh() is False
+
+        asset.path.write_text('<html>new</html>', encoding='utf-8')
+        stat = asset.path.stat()
+        os.utime(asset.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+        _, body, _ = asset.respond({})
+        assert body == b'<html>new</html>'
+
+    def test_missing_file_serves_fallback(self, tmp_path):
+        """A missing file serves the fallback text."""
+        asset = StaticAsset(tmp_path / 'nope.html', 'text/html', fallback='missing')
+        _, body, _ = asset.respond({})
+        assert body == b'missing'
+
+    def test_transform_applied_before_compression(self, asset):
+        """The transform output is what gets served and hashed."""
+        asset.transform = lambda text: text.replace('x', 'y')
+        _, body, _ = asset.respond({'Accept-Encoding': 'gzip'})
+        assert b'x' not in gzip.decompress(body).replace(b'html', b'')
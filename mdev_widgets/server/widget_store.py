@@ -0,0 +1,473 @@
+"""
+Widget store for the config server.
+
+Keeps the live widgets, their original (registered) properties and the
+schemas per widget type. Memory scales with the catalog once plus the
+edits, not with two copies of it:
+
+  - each widget is a slotted record holding its registered (baseline)
+    properties as a tuple of values; the tuple of property names is shared
+    by every widget with the same names, and names and types are interned
+  - edits are an overlay of the keys that differ from the baseline, kept
+    per modified widget; live properties are the baseline plus the overlay,
+    and resetting a widget just drops its overlay
+
+Three things make emitting widgets cheap:
+
+  - dirty tracking: the overlay only holds keys that differ from the
+    original, so `is_modified` is O(1) instead of a full properties
+    comparison
+  - payload cache: each widget's encoded JSON is cached and only
+    invalidated when that widget changes, so snapshots are spliced
+    together from cached fragments
+  - content-addressed schemas: schemas are stored once by hash and widget
+    payloads only carry a `schemaRef`, so a schema is not re-shipped with
+    every widget instance
+
+Re-registrations are deduplicated: a client may send a content hash with
+each registration, and one that matches the stored hash is skipped without
+touching any dicts. A real change yields only the keys that changed.
+
+Secondary indexes (type -> ids, source file -> ids, and the modified set)
+back `query`, so a filtered page doesn't require scanning every widget.
+A reverse index from style token names to the widgets whose properties
+name them tells which widgets one token edit affects.
+
+Every broadcast patch is also kept in a bounded change log. A client that
+reconnects with the last version it saw (and the store's epoch, which
+changes whenever the state is lost) can then catch up from the log.
+"""
+
+import bisect
+from collections import deque
+import hashlib
+import json
+import re
+import secrets
+import sys
+
+# Widget ids end with their call site, e.g. 'title (package:app/main.dart:12:5)'
+WIDGET_FILE = re.compile(r'\((?:package:)?([^:)]+\.dart):\d+:\d+\)')
+
+
+def widget_file(widget_id):
+    """Source file a widget id points at, or 'unknown'."""
+    match = WIDGET_FILE.search(widget_id)
+    return match.group(1) if match else 'unknown'
+
+
+_MISSING = object()
+
+
+class Widget:
+    """A registered widget: its type and baseline properties, both immutable.
+
+    keys is shared by every widget registered with the same property names;
+    values holds this widget's registered values in the same order.
+    """
+
+    __slots__ = ('type', 'keys', 'values', 'hash')
+
+    def __init__(self, widget_type, keys, values, content_hash=None):
+        self.type = widget_type
+        self.keys = keys
+        self.values = values
+        self.hash = content_hash  # Client-supplied content hash of the registration
+
+    @property
+    def baseline(self):
+        """The registered properties as a new dict."""
+        return dict(zip(self.keys, self.values))
+
+    def original(self, key):
+        """Registered value of one property, or _MISSING."""
+        try:
+            return self.values[self.keys.index(key)]
+        except ValueError:
+            return _MISSING
+
+
+def schema_hash(schema):
+    """Stable content hash for a schema."""
+    canonical = json.dumps(schema, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(canonical.encode()).hexdigest()[:16]
+
+
+class WidgetStore:
+    """Widgets, original baselines, schemas and derived caches."""
+
+    def __init__(self, change_log_size=1000):
+        self.widgets = {}  # Widget id -> Widget
+        self.schemas = {}  # Schema hash -> schema
+        self.schema_refs = {}  # Widget type -> schema hash (latest registration wins)
+        self.changed = {}  # Widget id -> {key: value} differing from the baseline (modified widgets only)
+        self.version = 0  # Bumped once per broadcast patch
+        self.epoch = secrets.token_hex(4)  # Identifies this version sequence; kept across handoffs
+        self.change_log = deque(maxlen=change_log_size)  # Recent patches, oldest first
+        self.by_type = {}  # Widget type -> ids
+        self.by_file = {}  # Source file -> ids
+        self.style_tokens = set()  # Style token names, across categories
+        self.token_refs = {}  # Style token name -> ids of widgets with a property set to it
+        self._fragments = {}  # Widget id -> encoded widget_with_modified_flag()
+        self._order = None  # Sorted (type, id) keys; rebuilt lazily after (un)registrations
+        self._shapes = {}  # Tuple of property names -> the shared, interned instance
+
+    def __len__(self):
+        return len(self.widgets)
+
+    def __contains__(self, widget_id):
+        return widget_id in self.widgets
+
+    def is_modified(self, widget_id):
+        """Check if widget has been modified from its original state."""
+        return widget_id in self.changed
+
+    def properties(self, widget_id):
+        """Live properties of a widget (baseline plus edits) as a new dict."""
+        widget = self.widgets[widget_id]
+        props = dict(zip(widget.keys, widget.values))
+        edits = self.changed.get(widget_id)
+        if edits:
+            props.update(edits)
+        return props
+
+    def _live_values(self, widget_id):
+        if widget_id in self.changed:
+            return self.properties(widget_id).values()
+        return self.widgets[widget_id].values
+
+    def widget_with_modified_flag(self, widget_id):
+        """Return widget data with modified flag and schema reference."""
+        widget_type = self.widgets[widget_id].type
+        w = {'id': widget_id, 'type': widget_type, 'properties': self.properties(widget_id)}
+        ref = self.schema_refs.get(widget_type)
+        if ref is not None:
+            w['schemaRef'] = ref
+        w['modified'] = widget_id in self.changed
+        return w
+
+    def schema_for_type(self, widget_type):
+        """Current schema for a widget type, or None."""
+        ref = self.schema_refs.get(widget_type)
+        return self.schemas[ref] if ref is not None else None
+
+    def fragment(self, widget_id):
+        """Encoded JSON of widget_with_modified_flag(), cached until the widget changes."""
+        encoded = self._fragments.get(widget_id)
+        if encoded is None:
+            encoded = json.dumps(self.widget_with_modified_flag(widget_id))
+            self._fragments[widget_id] = encoded
+        return encoded
+
+    def snapshot_json(self, ids=None):
+        """Encoded `widgets` snapshot message, spliced from cached fragments.
+
+        ids limits the snapshot to those widgets (all widgets by default).
+        """
+        data = ', '.join(f'{json.dumps(wid)}: {self.fragment(wid)}'
+                         for wid in (self.widgets if ids is None else ids))
+        return (f'{{"type": "widgets", "epoch": "{self.epoch}", "version": {self.version}, '
+                f'"data": {{{data}}}}}')
+
+    def log_patch(self, patch):
+        """Remember a broadcast patch for changes_since()."""
+        self.change_log.append(patch)
+
+    def changes_since(self, version):
+        """Patches after version, oldest first; None if the log no longer reaches back that far."""
+        if version == self.version:
+            return []
+        if version > self.version or not self.change_log:
+            return None
+        first = self.change_log[0]
+        if first.get('base_version', first['version'] - 1) > version:
+            return None
+        patches = []
+        for patch in reversed(self.change_log):
+            if patch['version'] <= version:
+                break
+            patches.append(patch)
+        patches.reverse()
+        return patches
+
+    def _ref_tokens(self, widget_id, values):
+        for value in values:
+            if isinstance(value, str) and value in self.style_tokens:
+                self.token_refs.setdefault(value, set()).add(widget_id)
+
+    def _unref_tokens(self, widget_id, values):
+        for value in values:
+            self._unref_token(widget_id, value)
+
+    def _unref_token(self, widget_id, value):
+        ids = self.token_refs.get(value) if isinstance(value, str) else None
+        if ids is not None:
+            ids.discard(widget_id)
+            if not ids:
+                del self.token_refs[value]
+
+    def set_style_tokens(self, names):
+        """Track a new set of style token names, indexing widgets for the added ones."""
+        names = set(names)
+        added = names - self.style_tokens
+        for name in self.style_tokens - names:
+            self.token_refs.pop(name, None)
+        self.style_tokens = names
+        if added:
+            for widget_id in self.widgets:
+                for value in self._live_values(widget_id):
+                    if isinstance(value, str) and value in added:
+                        self.token_refs.setdefault(value, set()).add(widget_id)
+
+    def widgets_using(self, name):
+        """Ids of the widgets with a property naming style token `name`."""
+        return self.token_refs.get(name, set())
+
+    def _index(self, widget_id, widget_type):
+        self.by_type.setdefault(widget_type, set()).add(widget_id)
+        self.by_file.setdefault(widget_file(widget_id), set()).add(widget_id)
+        self._order = None
+
+    def _unindex(self, widget_id, widget_type):
+        for index, key in ((self.by_type, widget_type), (self.by_file, widget_file(widget_id))):
+            ids = index.get(key)
+            if ids is not None:
+                ids.discard(widget_id)
+                if not ids:
+                    del index[key]
+        self._order = None
+
+    def query(self, types=None, id_contains=None, file=None, modified=None, limit=100, cursor=None):
+        """One page of widget ids matching every given filter, ordered by (type, id).
+
+        Type, file and modified=True filters come from the indexes, smallest
+        first; the id substring match is case-insensitive. cursor is the
+        `next` value of the previous page. Returns (ids, total, next).
+        """
+        sets = []
+        if types is not None:
+            sets.append(set().union(*(self.by_type.get(t, ()) for t in types)))
+        if file is not None:
+            sets.append(self.by_file.get(file, set()))
+        if modified:
+            sets.append(self.changed.keys())
+        sets.sort(key=len)
+        needle = id_contains.lower() if id_contains else None
+
+        def matches(widget_id):
+            if modified is False and widget_id in self.changed:
+                return False
+            if needle is not None and needle not in widget_id.lower():
+                return False
+            return all(widget_id in ids for ids in sets[1:])
+
+        if sets:
+            keys = sorted((self.widgets[wid].type, wid) for wid in sets[0] if matches(wid))
+        else:
+            if self._order is None:
+                self._order = sorted((w.type, wid) for wid, w in self.widgets.items())
+            keys = self._order
+            if needle is not None or modified is False:
+                keys = [key for key in keys if matches(key[1])]
+
+        start = bisect.bisect_right(keys, tuple(cursor)) if cursor else 0
+        page = keys[start:start + limit]
+        has_more = start + limit < len(keys)
+        return [wid for _, wid in page], len(keys), (list(page[-1]) if has_more else None)
+
+    def facets(self):
+        """Widget counts per type and per source file."""
+        return (
+            {widget_type: len(ids) for widget_type, ids in self.by_type.items()},
+            {file: len(ids) for file, ids in self.by_file.items()},
+        )
+
+    def store_schema(self, widget_type, schema):
+        """Point a widget type at a schema, storing the schema by content hash.
+
+        Returns (ref, affected) if the type's schema changed, where affected
+        is the number of already registered widgets of that type, or None if
+        the schema is unchanged.
+        """
+        ref = schema_hash(schema)
+        if self.schema_refs.get(widget_type) == ref:
+            return None
+        self.schemas.setdefault(ref, schema)
+        self.schema_refs[widget_type] = ref
+        affected = 0
+        for widget_id, widget in self.widgets.items():
+            if widget.type == widget_type:
+                self._fragments.pop(widget_id, None)
+                affected += 1
+        return ref, affected
+
+    def _shape(self, properties):
+        """Shared tuple of interned property names for a properties dict."""
+        keys = tuple(properties)
+        shape = self._shapes.get(keys)
+        if shape is None:
+            shape = self._shapes[keys] = tuple(sys.intern(key) for key in keys)
+        return shape
+
+    def register(self, widget_id, widget_type, properties, content_hash=None):
+        """Store a widget and its original properties. Returns the patch ops.
+
+        Re-registering with the same type and properties (app reconnect,
+        server restart) keeps the current edits and returns None. A matching
+        content_hash short-circuits the comparison. A new baseline for an
+        existing widget returns only the live keys that changed (plus the
+        modified flag if the re-registration cleared edits); new widgets,
+        type changes and dropped keys return an upsert.
+        """
+        existing = self.widgets.get(widget_id)
+        if existing is not None:
+            if content_hash is not None and existing.hash == content_hash:
+                return None
+            if existing.type == widget_type and existing.baseline == properties:
+                if content_hash is not None:
+                    existing.hash = content_hash
+                return None
+
+        ops = None
+        if existing is not None:
+            previous = self.properties(widget_id)
+            if existing.type == widget_type and previous.keys() <= properties.keys():
+                ops = [{'op': 'prop_changed', 'id': widget_id, 'key': key, 'value': value}
+                       for key, value in properties.items()
+                       if key not in previous or previous[key] != value]
+                if widget_id in self.changed:
+                    ops.append({'op': 'modified_flag_changed', 'id': widget_id, 'modified': False})
+            self._unindex(widget_id, existing.type)
+            self._unref_tokens(widget_id, previous.values())
+        widget_type = sys.intern(widget_type)
+        self.widgets[widget_id] = Widget(widget_type, self._shape(properties), tuple(properties.values()),
+                                         content_hash)
+        self._index(widget_id, widget_type)
+        self._ref_tokens(widget_id, properties.values())
+        self.changed.pop(widget_id, None)
+        self._fragments.pop(widget_id, None)
+        if ops is None:
+            ops = [{'op': 'upsert', 'widget': self.widget_with_modified_flag(widget_id)}]
+        return ops
+
+    def unregister(self, widget_id):
+        """Remove a widget. Returns False if it was not registered."""
+        if widget_id not in self.widgets:
+            return False
+        self._unref_tokens(widget_id, self._live_values(widget_id))
+        widget = self.widgets.pop(widget_id)
+        self._unindex(widget_id, widget.type)
+        self.changed.pop(widget_id, None)
+        self._fragments.pop(widget_id, None)
+        return True
+
+    def set_prop(self, widget_id, key, value):
+        """Set one property, keeping only values that differ from the baseline in the overlay.
+
+        Returns (was_modified, is_modified).
+        """
+        was_modified = widget_id in self.changed
+        original = self.widgets[widget_id].original(key)
+        edits = self.changed.get(widget_id)
+        old = edits.get(key, original) if edits else original
+        if original is not _MISSING and original == value:
+            if edits is not None and key in edits:
+                del edits[key]
+                if not edits:
+                    del self.changed[widget_id]
+        elif edits is None:
+            self.changed[widget_id] = {key: value}
+        else:
+            edits[key] = value
+        self._fragments.pop(widget_id, None)
+        if old is _MISSING:
+            old = None
+        if old != value:
+            self._retoken(widget_id, old, value)
+        return was_modified, widget_id in self.changed
+
+    def reset(self, widget_id):
+        """Restore a widget to its original properties and return the patch ops.
+
+        Dropping the overlay is the whole reset; unmodified widgets produce no ops.
+        """
+        edits = self.changed.pop(widget_id, None)
+        if not edits:
+            return []
+        widget = self.widgets[widget_id]
+        ops = []
+        added = False  # An edit added a key the baseline doesn't have
+        for key in sorted(edits):
+            original = widget.original(key)
+            added = added or original is _MISSING
+            value = None if original is _MISSING else original
+            self._retoken(widget_id, edits[key], value)
+            ops.append({'op': 'prop_changed', 'id': widget_id, 'key': key, 'value': value})
+        ops.append({'op': 'modified_flag_changed', 'id': widget_id, 'modified': False})
+        self._fragments.pop(widget_id, None)
+        if added:
+            # prop_changed can't remove a key; send the baseline widget instead
+            return [{'op': 'upsert', 'widget': self.widget_with_modified_flag(widget_id)}]
+        return ops
+
+    def _retoken(self, widget_id, old, new):
+        """Update token_refs after one property changed from old to new."""
+        if isinstance(old, str) and old in self.token_refs and old not in self._live_values(widget_id):
+            self._unref_token(widget_id, old)
+        if isinstance(new, str) and new in self.style_tokens:
+            self.token_refs.setdefault(new, set()).add(widget_id)
+
+    def reset_all_changes(self):
+        """Reset every modified widget; O(modified widgets). Returns the patch ops."""
+        ops = []
+        for widget_id in list(self.changed):
+            ops.extend(self.reset(widget_id))
+        return ops
+
+    def dump(self):
+        """Plain-data copy of the store for snapshots.
+
+        Property dicts are built fresh so the result can be serialized off
+        the event loop; values themselves are replaced, never mutated in place.
+        """
+        return {
+            'epoch': self.epoch,
+            'version': self.version,
+            'schemas': dict(self.schemas),
+            'schema_refs': dict(self.schema_refs),
+            'widgets': [
+                [widget_id, widget.type, self.properties(widget_id), widget.baseline]
+                for widget_id, widget in self.widgets.items()
+            ],
+        }
+
+    def load(self, data):
+        """Replace the store contents with a dump() result."""
+        self.clear()
+        self.change_log.clear()
+        self.version = data.get('version', 0)
+        self.epoch = data.get('epoch', self.epoch)
+        self.schemas.update(data['schemas'])
+        self.schema_refs.update(data['schema_refs'])
+        for widget_id, widget_type, properties, original in data['widgets']:
+            widget_type = sys.intern(widget_type)
+            self.widgets[widget_id] = Widget(widget_type, self._shape(original), tuple(original.values()))
+            self._index(widget_id, widget_type)
+            self._ref_tokens(widget_id, properties.values())
+            edits = {key: value for key, value in properties.items()
+                     if key not in original or original[key] != value}
+            if edits:
+                self.changed[widget_id] = edits
+
+    def clear(self):
+        """Remove all widgets and schemas."""
+        self.widgets.clear()
+        self.schemas.clear()
+        self.schema_refs.clear()
+        self.changed.clear()
+        self.by_type.clear()
+        self.by_file.clear()
+        self.token_refs.clear()
+        self._fragments.clear()
+        self._shapes.clear()
+        self._order = None
@@ -240,5 +240,33 @@ void main() {
         expect(newRegistry.getTextStyle('title')?.letterSpacing, equals(0.15));
       });
     });
+
+    group('token updates', () {
+      test('updateToken changes one token and keeps the rest', () {
+        registry.registerSize('padding-sm', 8.0);
+        registry.registerSize('padding-lg', 24.0);
+
+        registry.updateToken('sizes', 'padding-sm', 10);
+
+        expect(registry.getSize('padding-sm'), equals(10.0));
+        expect(registry.getSize('padding-lg'), equals(24.0));
+      });
+
+      test('updateToken parses colors and text styles', () {
+        registry.updateToken('colors', 'accent', {'light': '#ff0000', 'dark': '#00ff00'});
+        registry.updateToken('textStyles', 'title', {'fontSize': 20.0});
+
+        expect(registry.getColor('accent', isDark: true), equals('#00ff00'));
+        expect(registry.getTextStyle('title')?.fontSize, equals(20.0));
+      });
+
+      test('updateToken with null removes the token', () {
+        registry.registerColor('primary', light: '#000', dark: '#fff');
+
+        registry.updateToken('colors', 'primary', null);
+
+        expect(registry.getThemedColor('primary'), isNull);
+      });
+    });
   });
 }
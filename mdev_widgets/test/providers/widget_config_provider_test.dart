@@ -139,6 +139,34 @@ void main() {
         expect(config.get('visible'), isNull);
       });
 
+      test('updatePropsFromServer applies single property changes', () {
+        provider.register('widget-1', 'Text', properties: {'fontSize': 14.0, 'visible': true});
+
+        provider.updatePropsFromServer({
+          'widget-1': {'fontSize': 20.0},
+        });
+
+        final config = provider.getConfig('widget-1');
+        expect(config!.get('fontSize'), equals(20.0));
+        expect(config.get('visible'), isNull);
+      });
+
+      test('updatePropsFromServer clears override when value matches default', () {
+        provider.register('widget-1', 'Text', properties: {'fontSize': 14.0});
+        provider.updatePropsFromServer({'widget-1': {'fontSize': 20.0}});
+
+        provider.updatePropsFromServer({'widget-1': {'fontSize': 14.0}});
+
+        expect(provider.getConfig('widget-1')!.get('fontSize'), isNull);
+      });
+
+      test('updatePropsFromServer ignores non-existent widget', () {
+        expect(
+          () => provider.updatePropsFromServer({'non-existent': {'fontSize': 20.0}}),
+          returnsNormally,
+        );
+      });
+
       test('updateFromServer ignores non-existent widget', () {
         expect(
           () => provider.updateFromServer('non-existent', {'properties': {}}),
@@ -231,6 +259,23 @@ void main() {
         expect(changedStyles, isNotNull);
         expect(changedStyles!['colors'], isNotNull);
       });
+
+      test('onStyleTokenChange gets only the changed token', () {
+        final tokens = <List<dynamic>>[];
+        var fullStylesSent = false;
+
+        provider.onStyleChange = (_) => fullStylesSent = true;
+        provider.onStyleTokenChange = (category, name, value) => tokens.add([category, name, value]);
+
+        provider.registerSize('padding-sm', 8.0);
+        provider.registerColor('primary', light: '#000', dark: '#fff');
+
+        expect(tokens, equals([
+          ['sizes', 'padding-sm', 8.0],
+          ['colors', 'primary', {'light': '#000', 'dark': '#fff'}],
+        ]));
+        expect(fullStylesSent, isFalse);
+      });
     });
 
     group('reregisterAll', () {